@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# archive.py (part of "AIS Logger")
+# Archiving of raw (unparsed) data to rotated files
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os, glob, logging
+import time
+import threading, Queue
+import gzip
+import unittest
+import tempfile, shutil
+
+# File name time formats for each rotation interval
+ROTATIONS = {'hourly': '%Y%m%d-%H',
+             'daily': '%Y%m%d'}
+
+def openarchive(filename, mode='rb'):
+    # Open a raw data file, using gzip if the file name says so
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    else:
+        return open(filename, mode)
+
+
+class RawArchive(object):
+    # Archives raw sentences to files that are rotated hourly or
+    # daily. Each line is written as "time<TAB>source<TAB>sentence"
+    # where time is the receive time in seconds since 1970 (UTC).
+    #
+    # The put function never blocks: lines are queued and written
+    # in batches by a background thread, so a slow disk only fills
+    # the queue. If the queue is full, lines are dropped and counted.
+
+    def __init__(self, directory, rotation='daily', compression='gzip', prefix='raw', flushtime=10, maxqueue=100000):
+        self.directory = directory
+        self.timeformat = ROTATIONS.get(rotation, ROTATIONS['daily'])
+        if compression == 'gzip':
+            self.extension = '.nmea.gz'
+        else:
+            self.extension = '.nmea'
+        self.prefix = prefix
+        self.flushtime = flushtime
+        self.queue = Queue.Queue(maxqueue)
+        self.stats = {'archived': 0, 'dropped': 0}
+        self.thread = None
+
+    def FileName(self, timestamp):
+        # Return the archive file name for the given time
+        name = self.prefix + '-' + time.strftime(self.timeformat, time.gmtime(timestamp)) + self.extension
+        return os.path.join(self.directory, name)
+
+    def writer(self):
+        current_name = None
+        current_file = None
+        lastflush = time.time()
+        stop = False
+        while not stop:
+            # Wait for data, then take everything in the queue
+            lines = []
+            try:
+                item = self.queue.get(True, 1)
+                while True:
+                    if item == 'stop':
+                        stop = True
+                        break
+                    lines.append(item)
+                    item = self.queue.get_nowait()
+            except Queue.Empty:
+                pass
+            # Group the lines in batches, one for each file
+            batches = []
+            for (timestamp, source, data) in lines:
+                name = self.FileName(timestamp)
+                if not batches or batches[-1][0] != name:
+                    batches.append((name, []))
+                batches[-1][1].append("%.3f\t%s\t%s\n" %(timestamp, source, data.rstrip('\r\n')))
+            # Write the batches, switching file when needed
+            for (name, batch) in batches:
+                if name != current_name:
+                    if current_file:
+                        current_file.close()
+                    current_file = self.OpenFile(name)
+                    current_name = name
+                if not current_file:
+                    self.stats['dropped'] += len(batch)
+                    continue
+                try:
+                    current_file.write(''.join(batch))
+                    self.stats['archived'] += len(batch)
+                except IOError:
+                    logging.warning("Writing to raw data archive %(file)s failed" %{'file': name}, exc_info=True)
+                    self.stats['dropped'] += len(batch)
+            # Flush to disk at regular intervals
+            if current_file and lastflush + self.flushtime < time.time():
+                try:
+                    current_file.flush()
+                except IOError:
+                    pass
+                lastflush = time.time()
+        if current_file:
+            current_file.close()
+
+    def OpenFile(self, name):
+        # Open a file for appending, create the directory if needed
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            return openarchive(name, 'ab')
+        except (IOError, OSError):
+            logging.warning("Could not open raw data archive %(file)s" %{'file': name}, exc_info=True)
+            return None
+
+    def ArchiveFiles(self):
+        # Return the archive files in chronological order
+        return sorted(glob.glob(os.path.join(self.directory, self.prefix + '-*' + self.extension)))
+
+    def ReturnStats(self):
+        return self.stats
+
+    def put(self, source, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            self.queue.put_nowait((timestamp, source, data))
+        except Queue.Full:
+            self.stats['dropped'] += 1
+
+    def start(self):
+        try:
+            self.thread = threading.Thread(target=self.writer, name='RawArchive')
+            self.thread.setDaemon(1)
+            self.thread.start()
+            return True
+        except:
+            return False
+
+    def stop(self):
+        # Let the writer empty the queue before stopping
+        self.queue.put('stop')
+
+
+
+class TestRawArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sentence = '!AIVDM,1,1,,A,13uTAH002nJRLAHEwTi674rh04:8,0*2B\r\n'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testarchive(self):
+        archive = RawArchive(self.directory)
+        archive.start()
+        # 2009-05-05 17:20:35 and one day later
+        for day in (0, 1):
+            for i in range(100):
+                archive.put('Serial port a (/dev/ttyS0)', self.sentence, 1241544035 + day * 86400 + i)
+        archive.stop()
+        archive.thread.join(5)
+        files = archive.ArchiveFiles()
+        self.assertEqual([os.path.basename(f) for f in files], ['raw-20090505.nmea.gz', 'raw-20090506.nmea.gz'])
+        lines = openarchive(files[0]).readlines()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(lines[0], '1241544035.000\tSerial port a (/dev/ttyS0)\t' + self.sentence.rstrip() + '\n')
+        self.assertEqual(archive.ReturnStats(), {'archived': 200, 'dropped': 0})
+
+    def testhourlyuncompressed(self):
+        archive = RawArchive(self.directory, rotation='hourly', compression='none')
+        self.assertEqual(os.path.basename(archive.FileName(1241544035)), 'raw-20090505-17.nmea')
+
+    def testfullqueue(self):
+        archive = RawArchive(self.directory, maxqueue=10)
+        for i in range(20):
+            archive.put('Test', self.sentence)
+        self.assertEqual(archive.ReturnStats()['dropped'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# cpa.py (part of "AIS Logger")
+# Closest point of approach (CPA) and time to it (TCPA)
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import math
+import unittest
+import numpy
+
+import geo
+
+# Kilometers per nautical mile, and per minute of latitude
+NAUTICAL_MILE = 1.852
+
+
+def tovalues(values):
+    # Return the values as a float array, with NaN for values that
+    # aren't numbers (None, 'N/A')
+    result = numpy.empty(len(values))
+    for (i, value) in enumerate(values):
+        try:
+            result[i] = float(value)
+        except (TypeError, ValueError):
+            result[i] = numpy.nan
+    return result
+
+
+def cpa_array(ownlat, ownlon, ownsog, owncog, lats, lons, sogs, cogs):
+    # Return the distance at the closest point of approach (km) and
+    # the time to it (minutes) between own ship and many targets, as
+    # numpy arrays. Speeds are in knots and courses in degrees.
+    #
+    # Positions are projected to a plane tangent to the earth at own
+    # position, which is accurate enough within a few tens of km, and
+    # both ships are assumed to keep speed and course. A negative time
+    # means that the closest point has passed. Targets without a known
+    # speed or course get NaN.
+    ownlat, ownlon = float(ownlat), float(ownlon)
+    # Kilometers per degree of latitude and longitude at own position
+    km_lat = 60 * NAUTICAL_MILE
+    km_lon = km_lat * math.cos(math.radians(ownlat))
+    x = (tovalues(lons) - ownlon) * km_lon
+    y = (tovalues(lats) - ownlat) * km_lat
+    # Wrap across the 180th meridian
+    x = numpy.where(x > 180 * km_lon, x - 360 * km_lon, x)
+    x = numpy.where(x < -180 * km_lon, x + 360 * km_lon, x)
+    # Relative velocity in km/min
+    sogs = tovalues(sogs) * NAUTICAL_MILE / 60
+    cogs = numpy.radians(tovalues(cogs))
+    ownspeed = float(ownsog) * NAUTICAL_MILE / 60
+    owncourse = math.radians(float(owncog))
+    vx = sogs * numpy.sin(cogs) - ownspeed * math.sin(owncourse)
+    vy = sogs * numpy.cos(cogs) - ownspeed * math.cos(owncourse)
+    speed_sq = vx * vx + vy * vy
+    errors = numpy.seterr(divide='ignore', invalid='ignore')
+    try:
+        # Without relative motion the distance never changes
+        tcpa = numpy.where(speed_sq > 0, -(x * vx + y * vy) / speed_sq, 0.0)
+    finally:
+        numpy.seterr(**errors)
+    cpa = numpy.hypot(x + vx * tcpa, y + vy * tcpa)
+    return cpa, tcpa
+
+
+def ownmotion(lat1, lon1, time1, lat2, lon2, time2):
+    # Return own speed (knots) and course (degrees) from two positions
+    # and the times (in seconds) they were taken
+    distance, bearing = geo.inverse(lat1, lon1, lat2, lon2)
+    elapsed = time2 - time1
+    if elapsed <= 0:
+        raise ValueError("Positions must be in time order")
+    return distance / NAUTICAL_MILE / (elapsed / 3600.0), bearing
+
+
+
+class TestCPA(unittest.TestCase):
+    def testcpa(self):
+        # Own ship still at 57N 11E. A target 6 nm north heading south
+        # at 12 knots passes straight through in 30 minutes, one 6 nm
+        # north heading east doesn't come closer, and one 6 nm east
+        # heading north-west passes at about 4.24 nm (half-way).
+        lat = 57 + 6 / 60.0
+        lon = 11 + 6 / 60.0 / math.cos(math.radians(57))
+        cpa, tcpa = cpa_array(57, 11, 0, 0, [lat, lat, 57, 57], [11, 11, lon, 11],
+                              [12, 12, 12, None], [180, 90, 315, 0])
+        self.assertAlmostEqual(cpa[0], 0, 6)
+        self.assertAlmostEqual(tcpa[0], 30, 6)
+        self.assertAlmostEqual(cpa[1], 6 * NAUTICAL_MILE, 6)
+        self.assertAlmostEqual(tcpa[1], 0, 6)
+        self.assertAlmostEqual(cpa[2], 6 / math.sqrt(2) * NAUTICAL_MILE, 6)
+        self.assertAlmostEqual(tcpa[2], 21.2132, 3)
+        self.assertTrue(numpy.isnan(cpa[3]))
+
+    def testownmotion(self):
+        # Own ship heading north at 12 knots meets a still target
+        cpa, tcpa = cpa_array(57, 11, 12, 0, [57.1], [11], [0], [0])
+        self.assertAlmostEqual(cpa[0], 0, 6)
+        self.assertAlmostEqual(tcpa[0], 30, 6)
+        sog, cog = ownmotion(57, 11, 0, 57.1, 11, 1800)
+        self.assertAlmostEqual(sog, 12.0, 1)
+        self.assertAlmostEqual(cog, 0.0, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
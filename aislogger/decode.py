@@ -709,6 +709,36 @@ def telegramparser(inputstring):
         # Return a dictionary with descriptive keys
         return {'ownlatitude': latitude, 'ownlongitude': longitude, 'time': timestamp}
 
+    # If the sentence contains position, speed and course (from own GPS):
+    if telegram[0] == '$GPRMC':
+        # Check the checksum and that the fix is valid
+        if not checksum(inputstring) or telegram[2] != 'A':
+            return
+        # Latitude
+        degree = int(telegram[3][0:2])
+        minutes = decimal.Decimal(telegram[3][2:9])
+        if telegram[4] == 'N':
+            latitude = degree + (minutes / 60)
+        else:
+            latitude = -(degree + (minutes / 60))
+        latitude = latitude.quantize(decimal.Decimal('1E-6'))
+        # Longitude
+        degree = int(telegram[5][0:3])
+        minutes = decimal.Decimal(telegram[5][3:10])
+        if telegram[6] == 'E':
+            longitude = degree + (minutes / 60)
+        else:
+            longitude = -(degree + (minutes / 60))
+        longitude = longitude.quantize(decimal.Decimal('1E-6'))
+        # Speed over ground (knots) and course over ground (degrees),
+        # course is empty when not moving
+        sog = decimal.Decimal(telegram[7] or '0')
+        cog = decimal.Decimal(telegram[8] or '0')
+        # Timestamp the message with local time
+        timestamp = datetime.datetime.now()
+        # Return a dictionary with descriptive keys
+        return {'ownlatitude': latitude, 'ownlongitude': longitude, 'ownsog': sog, 'owncog': cog, 'time': timestamp}
+
 
 def binaryparser(dac,fi,data):
     # This function decodes known binary messages and returns the
@@ -1016,6 +1046,17 @@ class TestDecode(unittest.TestCase):
         del decoded['time'] # Delete the time key
         self.assertEqual(decoded, correct)
 
+    def testgprmc(self):
+        correct = {'ownlatitude': decimal.Decimal("57.6785"),
+                   'ownlongitude': decimal.Decimal("11.854333"),
+                   'ownsog': decimal.Decimal("5.2"),
+                   'owncog': decimal.Decimal("0")}
+        decoded = telegramparser('$GPRMC,123519,A,5740.710,N,01151.260,E,5.2,,191026,,*%02X' %makechecksum('$GPRMC,123519,A,5740.710,N,01151.260,E,5.2,,191026,,*'))
+        del decoded['time'] # Delete the time key
+        self.assertEqual(decoded, correct)
+        # No fix
+        self.assertEqual(telegramparser('$GPRMC,123519,V,,,,,,,191026,,*%02X' %makechecksum('$GPRMC,123519,V,,,,,,,191026,,*')), None)
+
     def testjointelegrams(self):
         correct = "!AIVDM,1,1,,,53u1V`01gnR5<DTn221>qB0thtJ222222222220l0pJ644b?e=kSlTRkl2CQp8888888880,0*4a"
         joined = jointelegrams("""!AIVDM,2,1,2,A,53u1V`01gnR5<DTn221>qB0thtJ222222222220l0pJ644b?e=kSlTRk,0*0E\n!AIVDM,2,2,2,A,l2CQp8888888880,2*22""")
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# expiry.py (part of "AIS Logger")
+# Time-ordered index for finding objects that have expired
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import heapq
+import unittest
+
+
+class TimeWheel(object):
+    # Keeps keys (such as MMSI numbers) in buckets by the time they were
+    # last touched, so that the keys not touched since a given time can
+    # be found without looking at all the other keys.
+    #
+    # Each bucket covers resolution seconds, and the bucket numbers in
+    # use are kept in a heap. Touching a key moves it between two sets
+    # and expiring only looks at the buckets that have expired, so the
+    # cost follows the number of expired keys and not the number of
+    # keys in the wheel. Keys may expire up to resolution seconds late.
+
+    def __init__(self, resolution=1.0):
+        self.resolution = resolution
+        # Bucket number -> set of keys
+        self.buckets = {}
+        # Key -> bucket number
+        self.bucket_of = {}
+        # Heap of bucket numbers in use
+        self.order = []
+
+    def touch(self, key, timestamp):
+        # Set the time the key was last touched
+        bucket = int(timestamp // self.resolution)
+        old_bucket = self.bucket_of.get(key)
+        if old_bucket == bucket:
+            return
+        if old_bucket is not None:
+            self.buckets[old_bucket].discard(key)
+        keys = self.buckets.get(bucket)
+        if keys is None:
+            keys = self.buckets[bucket] = set()
+            heapq.heappush(self.order, bucket)
+        keys.add(key)
+        self.bucket_of[key] = bucket
+
+    def remove(self, key):
+        bucket = self.bucket_of.pop(key, None)
+        if bucket is not None:
+            self.buckets[bucket].discard(key)
+
+    def expire(self, threshold):
+        # Remove and return the keys last touched before threshold
+        expired = []
+        limit = int(threshold // self.resolution)
+        order = self.order
+        while order and order[0] < limit:
+            bucket = heapq.heappop(order)
+            keys = self.buckets.pop(bucket)
+            for key in keys:
+                del self.bucket_of[key]
+            expired.extend(keys)
+        return expired
+
+    def __contains__(self, key):
+        return key in self.bucket_of
+
+    def __len__(self):
+        return len(self.bucket_of)
+
+
+
+class TestTimeWheel(unittest.TestCase):
+    def testexpire(self):
+        wheel = TimeWheel()
+        for key in range(100):
+            wheel.touch(key, 1000 + key)
+        self.assertEqual(len(wheel), 100)
+        self.assertEqual(sorted(wheel.expire(1010)), range(10))
+        self.assertEqual(wheel.expire(1010), [])
+        self.assertEqual(len(wheel), 90)
+        self.assertFalse(5 in wheel)
+        self.assertTrue(50 in wheel)
+
+    def testtouch(self):
+        wheel = TimeWheel()
+        wheel.touch('a', 1000)
+        wheel.touch('b', 1000)
+        # Touching again moves the key to a later bucket
+        wheel.touch('a', 2000)
+        self.assertEqual(wheel.expire(1500), ['b'])
+        self.assertEqual(wheel.expire(3000), ['a'])
+        # An expired key can be touched again
+        wheel.touch('b', 4000)
+        self.assertEqual(wheel.expire(5000), ['b'])
+        self.assertEqual(len(wheel.buckets), 0)
+        self.assertEqual(len(wheel.order), 0)
+
+    def testremove(self):
+        wheel = TimeWheel(resolution=10)
+        wheel.touch('a', 1000)
+        wheel.touch('b', 1001)
+        wheel.remove('a')
+        wheel.remove('c')
+        self.assertEqual(wheel.expire(2000), ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
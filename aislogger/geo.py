@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# geo.py (part of "AIS Logger")
+# Geodesic distance and bearing, for one or many positions
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import math
+import random
+import unittest
+import numpy
+
+# The WGS-84 ellipsoid: major and minor semiaxes (km) and flattening
+MAJOR = 6378.137
+MINOR = 6356.7523142
+FLATTENING = 1 / 298.257223563
+# Vincenty iterations and the change in lambda considered converged
+ITERATIONS = 20
+TOLERANCE = 1e-12
+# Mean earth radius (km) for the approximate distance on a sphere,
+# which is within APPROXIMATION_ERROR (a fraction) of the ellipsoid
+# distance. Add some margin to the 0.56% of the worst case.
+RADIUS = 6371.0088
+APPROXIMATION_ERROR = 0.01
+# The shortest degree of latitude (at the equator) in km
+DEGREE_LATITUDE = 110.574
+
+
+def inverse(lat1, lon1, lat2, lon2):
+    # Distance (km) and initial bearing (degrees) from the first to the
+    # second point, using Vincenty's inverse formula on the WGS-84
+    # ellipsoid. The same formula as util.VincentyDistance, but using
+    # plain floats. Positions may be given as Decimal or float.
+    # Raises ValueError for (nearly) antipodal points where the formula
+    # doesn't converge.
+    f = FLATTENING
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (lat1, lon1, lat2, lon2)))
+    delta_lon = lon2 - lon1
+    reduced1 = math.atan((1 - f) * math.tan(lat1))
+    reduced2 = math.atan((1 - f) * math.tan(lat2))
+    sin_u1, cos_u1 = math.sin(reduced1), math.cos(reduced1)
+    sin_u2, cos_u2 = math.sin(reduced2), math.cos(reduced2)
+
+    lambda_lon = delta_lon
+    for iteration in xrange(ITERATIONS):
+        sin_lambda, cos_lambda = math.sin(lambda_lon), math.cos(lambda_lon)
+        sin_sigma = math.sqrt((cos_u2 * sin_lambda) ** 2 +
+                              (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda) ** 2)
+        if sin_sigma == 0:
+            return 0.0, 0.0 # Coincident points
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_u1 * cos_u2 * sin_lambda / sin_sigma
+        cos_sq_alpha = 1 - sin_alpha ** 2
+        if cos_sq_alpha != 0:
+            cos2_sigma_m = cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha
+        else:
+            cos2_sigma_m = 0.0 # Equatorial line
+        C = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        lambda_prev = lambda_lon
+        lambda_lon = (delta_lon + (1 - C) * f * sin_alpha *
+                      (sigma + C * sin_sigma *
+                       (cos2_sigma_m + C * cos_sigma * (-1 + 2 * cos2_sigma_m ** 2))))
+        if abs(lambda_lon - lambda_prev) <= TOLERANCE:
+            break
+    else:
+        raise ValueError("Vincenty formula failed to converge")
+
+    u_sq = cos_sq_alpha * (MAJOR ** 2 - MINOR ** 2) / MINOR ** 2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (B * sin_sigma *
+                   (cos2_sigma_m + B / 4 *
+                    (cos_sigma * (-1 + 2 * cos2_sigma_m ** 2) -
+                     B / 6 * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) *
+                     (-3 + 4 * cos2_sigma_m ** 2))))
+    distance = MINOR * A * (sigma - delta_sigma)
+    sin_lambda, cos_lambda = math.sin(lambda_lon), math.cos(lambda_lon)
+    alpha = math.atan2(cos_u2 * sin_lambda,
+                       cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda)
+    return distance, math.degrees(alpha) % 360
+
+
+def inverse_array(lat1, lon1, lats, lons):
+    # Distances (km) and initial bearings (degrees) from one point to
+    # many, as numpy arrays. Each Vincenty iteration is done for all
+    # points at once, and points stop changing when they have
+    # converged. Points where the formula doesn't converge get NaN.
+    f = FLATTENING
+    lat1, lon1 = math.radians(float(lat1)), math.radians(float(lon1))
+    lats = numpy.radians(numpy.asarray(lats, dtype=float))
+    lons = numpy.radians(numpy.asarray(lons, dtype=float))
+    delta_lon = lons - lon1
+    reduced1 = math.atan((1 - f) * math.tan(lat1))
+    reduced2 = numpy.arctan((1 - f) * numpy.tan(lats))
+    sin_u1, cos_u1 = math.sin(reduced1), math.cos(reduced1)
+    sin_u2, cos_u2 = numpy.sin(reduced2), numpy.cos(reduced2)
+
+    # Coincident points give zeros, not a division by zero
+    errors = numpy.seterr(divide='ignore', invalid='ignore')
+    try:
+        lambda_lon = delta_lon.copy()
+        active = numpy.ones(lats.shape, dtype=bool)
+        for iteration in xrange(ITERATIONS):
+            sin_lambda, cos_lambda = numpy.sin(lambda_lon), numpy.cos(lambda_lon)
+            sin_sigma = numpy.sqrt((cos_u2 * sin_lambda) ** 2 +
+                                   (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda) ** 2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+            sigma = numpy.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = numpy.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lambda / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos2_sigma_m = numpy.where(cos_sq_alpha == 0, 0.0,
+                                       cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            C = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+            new_lambda = (delta_lon + (1 - C) * f * sin_alpha *
+                          (sigma + C * sin_sigma *
+                           (cos2_sigma_m + C * cos_sigma * (-1 + 2 * cos2_sigma_m ** 2))))
+            # Only move the points that haven't converged
+            active &= numpy.abs(new_lambda - lambda_lon) > TOLERANCE
+            lambda_lon = numpy.where(active, new_lambda, lambda_lon)
+            if not active.any():
+                break
+
+        u_sq = cos_sq_alpha * (MAJOR ** 2 - MINOR ** 2) / MINOR ** 2
+        A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = (B * sin_sigma *
+                       (cos2_sigma_m + B / 4 *
+                        (cos_sigma * (-1 + 2 * cos2_sigma_m ** 2) -
+                         B / 6 * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) *
+                         (-3 + 4 * cos2_sigma_m ** 2))))
+        distances = MINOR * A * (sigma - delta_sigma)
+        sin_lambda, cos_lambda = numpy.sin(lambda_lon), numpy.cos(lambda_lon)
+        bearings = numpy.degrees(numpy.arctan2(cos_u2 * sin_lambda,
+                                               cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda)) % 360
+    finally:
+        numpy.seterr(**errors)
+    distances[active] = numpy.nan
+    bearings[active] = numpy.nan
+    return distances, bearings
+
+
+
+def approximate(lat1, lon1, lat2, lon2):
+    # Distance (km) between two points on a sphere (the haversine
+    # formula), much faster than inverse() but only as accurate as
+    # APPROXIMATION_ERROR
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (lat1, lon1, lat2, lon2)))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def within_distance(lat1, lon1, lat2, lon2, limit):
+    # True if the points are at most limit km apart. Points far from
+    # the limit are decided by the difference in latitude or the
+    # approximate distance, only points near it need inverse().
+    lat1, lon1, lat2, lon2 = float(lat1), float(lon1), float(lat2), float(lon2)
+    if abs(lat2 - lat1) * DEGREE_LATITUDE > limit:
+        return False
+    distance = approximate(lat1, lon1, lat2, lon2)
+    if distance > limit * (1 + APPROXIMATION_ERROR):
+        return False
+    if distance < limit * (1 - APPROXIMATION_ERROR):
+        return True
+    try:
+        return inverse(lat1, lon1, lat2, lon2)[0] <= limit
+    except ValueError:
+        return distance <= limit
+
+
+class TestGeo(unittest.TestCase):
+    # Flinders Peak to Buninyong, the example in Vincenty's paper
+    flinders = (-37.95103342, 144.42486789)
+    buninyong = (-37.65282114, 143.92649554)
+
+    def testinverse(self):
+        distance, bearing = inverse(*(self.flinders + self.buninyong))
+        self.assertAlmostEqual(distance, 54.972271, 5)
+        self.assertAlmostEqual(bearing, 306.868159, 5)
+        self.assertEqual(inverse(57.5, 11.9, 57.5, 11.9), (0.0, 0.0))
+        self.assertRaises(ValueError, inverse, 0, 0, 0.5, 179.7)
+
+    def testinversearray(self):
+        lats = [self.buninyong[0], -37.95103342, -38.5, 10.0, 37.95]
+        lons = [self.buninyong[1], 144.42486789, 145.0, -20.0, -35.6]
+        distances, bearings = inverse_array(self.flinders[0], self.flinders[1], lats, lons)
+        for i in range(4):
+            distance, bearing = inverse(self.flinders[0], self.flinders[1], lats[i], lons[i])
+            self.assertAlmostEqual(distances[i], distance, 6)
+            self.assertAlmostEqual(bearings[i], bearing, 6)
+        # Nearly antipodal, doesn't converge
+        self.assertTrue(numpy.isnan(distances[4]))
+
+    def testapproximate(self):
+        random.seed(1)
+        for i in range(1000):
+            points = (random.uniform(-80, 80), random.uniform(-180, 180),
+                      random.uniform(-80, 80), random.uniform(-180, 180))
+            try:
+                distance = inverse(*points)[0]
+            except ValueError:
+                continue
+            self.assertTrue(abs(approximate(*points) - distance) <= distance * APPROXIMATION_ERROR)
+
+    def testwithindistance(self):
+        random.seed(2)
+        for i in range(1000):
+            points = (57.7, 11.9, 57.7 + random.uniform(-0.5, 0.5), 11.9 + random.uniform(-0.8, 0.8))
+            self.assertEqual(within_distance(*(points + (25,))), inverse(*points)[0] <= 25)
+        self.assertTrue(within_distance(57.7, 11.9, 57.7, 11.9, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
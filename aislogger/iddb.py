@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# iddb.py (part of "AIS Logger")
+# The identification database (IMO, name and callsign by MMSI)
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import logging
+import unittest
+import tempfile
+
+try:
+    from pysqlite2 import dbapi2 as sqlite
+except ImportError:
+    import sqlite3 as sqlite
+
+# The fields of an entry
+FIELDS = ('mmsi', 'imo', 'name', 'callsign')
+# Rows to write in each transaction
+BATCHSIZE = 500
+
+
+class IDDB(object):
+    # The identification database, stored in an SQLite file.
+    #
+    # Entries are read from the file the first time an MMSI is asked
+    # for and then kept in memory (an MMSI not in the file is
+    # remembered as missing), so startup doesn't load the whole file.
+    # Changed entries are kept in a dirty set and written in small
+    # batches by flush(). The file is opened once, by the thread that
+    # first uses the database, and kept open.
+    #
+    # Without a file name the database is kept in memory only.
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.connection = None
+        # MMSI -> entry dict, or None if not in the file
+        self.entries = {}
+        self.dirty = set()
+
+    def connect(self):
+        # Return the connection, open it if needed. If the file can't
+        # be used, the database is kept in memory only from then on.
+        if self.connection is None and self.filename:
+            try:
+                connection = sqlite.connect(self.filename)
+                connection.execute("CREATE TABLE IF NOT EXISTS iddb (mmsi PRIMARY KEY, imo, name, callsign);")
+                connection.commit()
+                self.connection = connection
+            except sqlite.Error:
+                logging.error("Could not open IDDB file %(file)s, the IDDB is only kept in memory" %{'file': self.filename}, exc_info=True)
+                self.filename = None
+        return self.connection
+
+    def get(self, mmsi):
+        # Return the entry of mmsi as a dict, None if there is none
+        if mmsi in self.entries:
+            return self.entries[mmsi]
+        entry = None
+        connection = self.connect()
+        if connection:
+            try:
+                row = connection.execute("SELECT mmsi, imo, name, callsign FROM iddb WHERE mmsi = ?;", (mmsi,)).fetchone()
+            except sqlite.Error:
+                logging.warning("Reading from IDDB file failed", exc_info=True)
+                return None
+            if row:
+                entry = dict(zip(FIELDS, row))
+                entry['mmsi'] = int(entry['mmsi'])
+        self.entries[mmsi] = entry
+        return entry
+
+    def update(self, mmsi, **fields):
+        # Set fields (imo, name, callsign) of the entry of mmsi,
+        # creating it if needed. Returns the entry.
+        entry = self.get(mmsi)
+        if entry is None:
+            entry = self.entries[mmsi] = {'mmsi': mmsi, 'imo': None, 'name': None, 'callsign': None}
+        for (field, value) in fields.iteritems():
+            if entry[field] != value:
+                entry[field] = value
+                self.dirty.add(mmsi)
+        return entry
+
+    def flush(self):
+        # Write the changed entries to the file, in batches. Returns the
+        # number of entries written.
+        connection = self.connect()
+        if not connection or not self.dirty:
+            return 0
+        dirty = list(self.dirty)
+        written = 0
+        try:
+            for start in xrange(0, len(dirty), BATCHSIZE):
+                rows = [ tuple(self.entries[mmsi][field] for field in FIELDS) for mmsi in dirty[start:start+BATCHSIZE] ]
+                connection.executemany("INSERT OR REPLACE INTO iddb (mmsi, imo, name, callsign) VALUES (?, ?, ?, ?)", rows)
+                connection.commit()
+                self.dirty.difference_update(dirty[start:start+BATCHSIZE])
+                written += len(rows)
+        except sqlite.Error:
+            logging.warning("Logging IDDB to disk failed", exc_info=True)
+        return written
+
+    def all(self):
+        # Return all entries, from the file and in memory
+        entries = {}
+        connection = self.connect()
+        if connection:
+            try:
+                for row in connection.execute("SELECT mmsi, imo, name, callsign FROM iddb;"):
+                    entry = dict(zip(FIELDS, row))
+                    entry['mmsi'] = int(entry['mmsi'])
+                    entries[entry['mmsi']] = entry
+            except sqlite.Error:
+                logging.warning("Reading from IDDB file failed", exc_info=True)
+        for (mmsi, entry) in self.entries.iteritems():
+            if entry is not None:
+                entries[mmsi] = entry.copy()
+        return entries.values()
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+
+
+class TestIDDB(unittest.TestCase):
+    def setUp(self):
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def testupdate(self):
+        iddb = IDDB(self.filename)
+        self.assertEqual(iddb.get(265547250), None)
+        iddb.update(265547250, imo=9999999, name=u'TEST')
+        self.assertEqual(iddb.flush(), 1)
+        self.assertEqual(iddb.flush(), 0)
+        # Unchanged fields don't make the entry dirty
+        iddb.update(265547250, imo=9999999)
+        self.assertEqual(iddb.flush(), 0)
+        iddb.update(265547250, imo=9999999, callsign=u'SABC')
+        self.assertEqual(iddb.flush(), 1)
+        iddb.close()
+        # Read back lazily
+        iddb = IDDB(self.filename)
+        self.assertEqual(iddb.entries, {})
+        self.assertEqual(iddb.get(265547250), {'mmsi': 265547250, 'imo': 9999999, 'name': u'TEST', 'callsign': u'SABC'})
+        iddb.update(265678000, imo=1234567)
+        self.assertEqual(sorted(e['mmsi'] for e in iddb.all()), [265547250, 265678000])
+        iddb.close()
+
+    def testbatches(self):
+        iddb = IDDB(self.filename)
+        for mmsi in xrange(BATCHSIZE * 2 + 10):
+            iddb.update(mmsi, imo=mmsi)
+        self.assertEqual(iddb.flush(), BATCHSIZE * 2 + 10)
+        self.assertEqual(len(IDDB(self.filename).all()), BATCHSIZE * 2 + 10)
+
+    def testbadfile(self):
+        # A file that can't be opened leaves the IDDB in memory
+        logging.disable(logging.ERROR)
+        try:
+            iddb = IDDB(os.path.join(self.filename, 'missing', 'id.idb'))
+            self.assertEqual(iddb.get(265547250), None)
+            iddb.update(265547250, imo=9999999)
+            self.assertEqual(iddb.flush(), 0)
+            self.assertEqual(len(iddb.all()), 1)
+            self.assertEqual(iddb.filename, None)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def testmemory(self):
+        iddb = IDDB()
+        iddb.update(265547250, imo=9999999)
+        self.assertEqual(iddb.flush(), 0)
+        self.assertEqual(iddb.get(265547250)['imo'], 9999999)
+        self.assertEqual(len(iddb.all()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
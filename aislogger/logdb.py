@@ -0,0 +1,812 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# logdb.py (part of "AIS Logger")
+# Writing of the position and metadata log to an SQLite file
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os, glob, optparse, logging
+import time, calendar
+import threading, Queue
+import decimal
+import unittest
+import tempfile
+import datetime
+
+try:
+    from pysqlite2 import dbapi2 as sqlite
+except ImportError:
+    import sqlite3 as sqlite
+
+# Version of the log file format, stored as user_version in the file.
+# Version 1 files (without user_version) have untyped columns, ISO
+# 8601 times and coordinates in degrees, and must be migrated.
+VERSION = 2
+# The log tables as {name: (create statement, insert statement)}
+TABLES = {'position': ("CREATE TABLE IF NOT EXISTS position (time INTEGER, mmsi INTEGER, latitude INTEGER, longitude INTEGER, georef TEXT, sog INTEGER, cog INTEGER);",
+                       "INSERT INTO position (time, mmsi, latitude, longitude, georef, sog, cog) VALUES (?, ?, ?, ?, ?, ?, ?)"),
+          'metadata': ("CREATE TABLE IF NOT EXISTS metadata (time INTEGER, mmsi INTEGER, imo INTEGER, name TEXT, type INTEGER, callsign TEXT, destination TEXT, eta TEXT, length INTEGER, width INTEGER);",
+                       "INSERT INTO metadata (time, mmsi, imo, name, type, callsign, destination, eta, length, width) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"),
+          'track': ("CREATE TABLE IF NOT EXISTS track (time INTEGER, mmsi INTEGER, latitude INTEGER, longitude INTEGER, sog INTEGER, cog INTEGER);",
+                    "INSERT INTO track (time, mmsi, latitude, longitude, sog, cog) VALUES (?, ?, ?, ?, ?, ?)")}
+# Every table is indexed on (mmsi, time) and on time
+INDEXES = ("CREATE INDEX IF NOT EXISTS %(table)s_mmsi_time ON %(table)s (mmsi, time);",
+           "CREATE INDEX IF NOT EXISTS %(table)s_time ON %(table)s (time);")
+# Coordinates are stored as integers in 1/10000 minutes (the AIS
+# resolution), speed and course in tenths
+COORDINATE_SCALE = 600000
+TENTHS = 10
+# Track rows to send to the writer at a time
+TRACKBATCH = 5000
+# Connection settings. With WAL the log file can be read while
+# it's written, and synchronous=NORMAL only syncs at checkpoints.
+PRAGMAS = ("PRAGMA journal_mode=WAL;",
+           "PRAGMA synchronous=NORMAL;",
+           "PRAGMA cache_size=-8192;")
+# Partition lengths (s) and file name time formats
+PARTITIONS = {'hourly': (3600, '%Y%m%d-%H'),
+              'daily': (86400, '%Y%m%d')}
+# Partition files to keep open, so that late rows for the previous
+# partition don't reopen it
+MAXOPEN = 2
+# Seconds a stopped writer waits for compactions to finish to write the
+# rows held back, and seconds to wait for a stopped writer to finish
+DEFERWAIT = 60
+STOPWAIT = DEFERWAIT + 10
+
+def scale(value, factor):
+    # Return value as an integer in 1/factor units, None if not a number
+    try:
+        return int(round(float(value) * factor))
+    except (TypeError, ValueError):
+        return None
+
+def integer(value):
+    # Return value as an integer, None if not a number
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def text(value):
+    # Return value, None if not known
+    if value == 'N/A':
+        return None
+    return value
+
+def epoch(timestamp):
+    # Return a (local) datetime as seconds since the epoch
+    return int(time.mktime(timestamp.timetuple()))
+
+def positionrow(r):
+    # Return a row for the position table from an object record
+    return (epoch(r['time']), r['mmsi'], scale(r['latitude'], COORDINATE_SCALE), scale(r['longitude'], COORDINATE_SCALE),
+            text(r['georef']), scale(r['sog'], TENTHS), scale(r['cog'], TENTHS))
+
+def metadatarow(r):
+    # Return a row for the metadata table from an object record
+    return (epoch(r['time']), r['mmsi'], integer(r['imo']), text(r['name']), integer(r['type']), text(r['callsign']),
+            text(r['destination']), text(r['eta']), integer(r['length']), integer(r['width']))
+
+def trackrow(timestamp, mmsi, latitude, longitude, sog, cog):
+    # Return a row for the track table. Timestamp is in seconds since
+    # the epoch, the other values as decoded (Decimal, None or 'N/A').
+    return (int(timestamp), mmsi, scale(latitude, COORDINATE_SCALE), scale(longitude, COORDINATE_SCALE),
+            scale(sog, TENTHS), scale(cog, TENTHS))
+
+def unscale(value, factor):
+    # Return an integer from the log in the original units
+    if value is None:
+        return None
+    return float(value) / factor
+
+def createtable(connection, table):
+    # Create a table and its indexes if they don't exist
+    connection.execute(TABLES[table][0])
+    for index in INDEXES:
+        connection.execute(index %{'table': table})
+
+def checkversion(connection):
+    # Make sure the file is in the current format, set the version of
+    # a new file. Raises ValueError for files in another format.
+    version = connection.execute("PRAGMA user_version;").fetchone()[0]
+    if version == VERSION:
+        return
+    tables = connection.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table';").fetchone()[0]
+    if version == 0 and tables == 0:
+        connection.execute("PRAGMA user_version = %d;" %VERSION)
+    elif version == 0:
+        raise ValueError("The log file is in the old format, convert it with aislogger-migratelog")
+    else:
+        raise ValueError("Unknown log file format version %d" %version)
+
+def v1coordinate(value):
+    # Return a coordinate from a version 1 log in degrees. Early
+    # versions logged them as text, N48083447 for N 48 08.3447'
+    # and W023596527 for W 023 59.6527'.
+    if isinstance(value, basestring) and value[:1] in ('N', 'S', 'E', 'W'):
+        try:
+            degrees = int(value[1:-6]) + int(value[-6:]) / 600000.0
+        except ValueError:
+            return None
+        if value[0] in ('S', 'W'):
+            degrees = -degrees
+        return degrees
+    return value
+
+def v1time(value):
+    # Return a time from a version 1 log (local time in ISO 8601 format)
+    # as seconds since the epoch
+    try:
+        return int(time.mktime(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')))
+    except (TypeError, ValueError):
+        return None
+
+def migrate(source, destination, batchsize=100000):
+    # Convert the version 1 log file source to a new file destination
+    # in the current format. Returns the number of rows copied as
+    # {table: rows}.
+    old = sqlite.connect(source)
+    if old.execute("PRAGMA user_version;").fetchone()[0] != 0:
+        raise ValueError("%s is not a version 1 log file" %source)
+    oldtables = [ row[0] for row in old.execute("SELECT name FROM sqlite_master WHERE type = 'table';") ]
+    if os.path.exists(destination) and os.path.getsize(destination) > 0:
+        raise ValueError("%s already exists" %destination)
+    new = sqlite.connect(destination)
+    new.execute("PRAGMA synchronous=OFF;")
+    new.execute("PRAGMA user_version = %d;" %VERSION)
+    conversions = {'position': ("SELECT time, mmsi, latitude, longitude, georef, sog, cog FROM position;",
+                                lambda r: (v1time(r[0]), integer(r[1]), scale(v1coordinate(r[2]), COORDINATE_SCALE),
+                                           scale(v1coordinate(r[3]), COORDINATE_SCALE), text(r[4]),
+                                           scale(r[5], TENTHS), scale(r[6], TENTHS))),
+                   'metadata': ("SELECT time, mmsi, imo, name, type, callsign, destination, eta, length, width FROM metadata;",
+                                lambda r: (v1time(r[0]), integer(r[1]), integer(r[2]), text(r[3]), integer(r[4]),
+                                           text(r[5]), text(r[6]), text(r[7]), integer(r[8]), integer(r[9]))),
+                   'track': ("SELECT time, mmsi, latitude, longitude, sog, cog FROM track;",
+                             lambda r: r)}
+    copied = {}
+    for (table, (select, convert)) in conversions.iteritems():
+        if table not in oldtables:
+            continue
+        new.execute(TABLES[table][0])
+        copied[table] = 0
+        rows = []
+        for row in old.execute(select):
+            rows.append(convert(row))
+            if len(rows) == batchsize:
+                new.executemany(TABLES[table][1], rows)
+                copied[table] += len(rows)
+                rows = []
+        new.executemany(TABLES[table][1], rows)
+        copied[table] += len(rows)
+        # Indexing after the copy is faster
+        createtable(new, table)
+        new.commit()
+    new.close()
+    old.close()
+    return copied
+
+def migratecommand(args):
+    # Command line interface to migrate()
+    parser = optparse.OptionParser(usage="%prog OLDFILE NEWFILE",
+                                   description="Convert an AIS Logger log file to the current format")
+    (options, args) = parser.parse_args(args)
+    if len(args) != 2:
+        parser.error("Give the old and the new log file")
+    try:
+        copied = migrate(args[0], args[1])
+    except (ValueError, sqlite.Error), error:
+        sys.exit("Migration failed: %s" %error)
+    for (table, rows) in sorted(copied.iteritems()):
+        print "%s: %d rows" %(table, rows)
+
+
+def partitionfiles(filename, partition):
+    # Return the partition files of the log file as a sorted list of
+    # (start, end, file name), times in seconds since the epoch
+    (length, timeformat) = PARTITIONS[partition]
+    (base, extension) = os.path.splitext(filename)
+    files = []
+    for name in glob.glob(base + '-*' + extension):
+        stamp = name[len(base)+1:len(name)-len(extension)]
+        try:
+            start = calendar.timegm(time.strptime(stamp, timeformat))
+        except ValueError:
+            continue
+        files.append((start, start + length, name))
+    files.sort()
+    return files
+
+def query(filename, table, start=None, end=None, mmsi=None, partition=None):
+    # Return the rows of table with start <= time < end (and for mmsi
+    # if given) in chronological order. For a partitioned log only the
+    # partitions that overlap the time range are read.
+    if table not in TABLES:
+        raise ValueError("Unknown table %s" %table)
+    if partition:
+        files = [ name for (first, last, name) in partitionfiles(filename, partition)
+                  if (start is None or last > start) and (end is None or first < end) ]
+    else:
+        files = [filename]
+    conditions = []
+    parameters = []
+    if mmsi is not None:
+        conditions.append("mmsi = ?")
+        parameters.append(mmsi)
+    if start is not None:
+        conditions.append("time >= ?")
+        parameters.append(start)
+    if end is not None:
+        conditions.append("time < ?")
+        parameters.append(end)
+    statement = "SELECT * FROM %s" %table
+    if conditions:
+        statement += " WHERE " + " AND ".join(conditions)
+    statement += " ORDER BY time;"
+    for name in files:
+        connection = sqlite.connect(name)
+        try:
+            # Partitions without the table have no rows for it
+            if connection.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?;", (table,)).fetchone()[0]:
+                for row in connection.execute(statement, parameters):
+                    yield row
+        finally:
+            connection.close()
+
+
+class LogWriter(object):
+    # Writes rows to the log file from a background thread, keeping
+    # the file open between writes.
+    #
+    # The put function never blocks: batches of rows are queued and
+    # the writer takes everything in the queue and writes it in one
+    # transaction. If the queue is full, the batch is dropped and its
+    # rows counted. Tables are created when rows are first written
+    # to them. A log file in the old format (version 1) is renamed,
+    # and left for the migration tool, and a new file is started in
+    # its place. Files in other formats are not written to.
+    #
+    # With partition set to 'hourly' or 'daily', rows are written to
+    # one file per hour or day (UTC) by their time, named after the
+    # log file (aislogger-20090505.db for aislogger.db). Partitions
+    # more than retention days older than the newest row are deleted,
+    # and with vacuum on, partitions are compacted by a second thread
+    # once they are closed.
+
+    def __init__(self, filename, maxqueue=100, partition=None, retention=0, vacuum=False):
+        self.filename = filename
+        self.queue = Queue.Queue(maxqueue)
+        self.stopped = False
+        self.stats = {'written': 0, 'dropped': 0, 'transactions': 0, 'deleted': 0, 'vacuumed': 0, 'renamed': 0}
+        if partition in PARTITIONS:
+            (self.partitionlength, self.timeformat) = PARTITIONS[partition]
+        else:
+            self.partitionlength = None
+        self.partition = partition
+        self.retention = retention
+        self.vacuum = vacuum
+        self.vacuumqueue = Queue.Queue()
+        # Partitions queued for or being compacted. They aren't written
+        # to or deleted until compacted, rows for them are held back.
+        self.vacuuming = set()
+        self.vacuumlock = threading.Lock()
+        self.deferred = {}
+        # Open files as {file name: (connection, created tables)}
+        self.connections = {}
+        self.opened = []
+        self.formaterrors = set()
+        # Time of the newest row written
+        self.newest = 0
+        self.thread = None
+        self.vacuumthread = None
+
+    def FileName(self, key):
+        # Return the file name of partition number key
+        (base, extension) = os.path.splitext(self.filename)
+        return base + '-' + time.strftime(self.timeformat, time.gmtime(key * self.partitionlength)) + extension
+
+    def Connect(self, filename):
+        # Open a file and set it up
+        connection = sqlite.connect(filename)
+        try:
+            checkversion(connection)
+        except ValueError:
+            version = connection.execute("PRAGMA user_version;").fetchone()[0]
+            connection.close()
+            if version != 0:
+                raise
+            # Keep the old file for migration and start a new one
+            oldname = self.Rename(filename)
+            logging.error("The log file %(file)s is in an old format. It was renamed to %(old)s and a new log file was started. Convert the old file with aislogger-migratelog." %{'file': filename, 'old': oldname})
+            connection = sqlite.connect(filename)
+            checkversion(connection)
+        except:
+            connection.close()
+            raise
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        connection.commit()
+        return connection
+
+    def Rename(self, filename):
+        # Rename an old format file to a free name, returns the name
+        (base, extension) = os.path.splitext(filename)
+        oldname = base + '-v1' + extension
+        number = 1
+        while os.path.exists(oldname):
+            number += 1
+            oldname = base + '-v1-%d' %number + extension
+        os.rename(filename, oldname)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(filename + suffix):
+                os.rename(filename + suffix, oldname + suffix)
+        self.stats['renamed'] += 1
+        return oldname
+
+    def Open(self, filename):
+        # Return the connection and created tables of a file, open it
+        # (and close the least recently opened file) if needed
+        if filename not in self.connections:
+            self.connections[filename] = (self.Connect(filename), set())
+            self.opened.append(filename)
+            while len(self.opened) > MAXOPEN:
+                self.Close(self.opened[0], self.vacuum)
+        return self.connections[filename]
+
+    def Close(self, filename, vacuum=False):
+        # Close a file if it's open
+        if filename in self.connections:
+            (connection, created) = self.connections.pop(filename)
+            self.opened.remove(filename)
+            try:
+                connection.close()
+            except sqlite.Error:
+                pass
+            if vacuum:
+                self.vacuumlock.acquire()
+                try:
+                    self.vacuuming.add(filename)
+                finally:
+                    self.vacuumlock.release()
+                self.vacuumqueue.put(filename)
+
+    def Vacuuming(self, filename):
+        # Return True if the file is queued for or being compacted
+        self.vacuumlock.acquire()
+        try:
+            return filename in self.vacuuming
+        finally:
+            self.vacuumlock.release()
+
+    def Expire(self):
+        # Delete partitions older than the retention time
+        if not self.partitionlength or not self.retention or not self.newest:
+            return
+        limit = self.newest - self.retention * 86400
+        for (start, end, name) in partitionfiles(self.filename, self.partition):
+            if end > limit:
+                break
+            if self.Vacuuming(name):
+                continue
+            self.Close(name)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(name + suffix):
+                    try:
+                        os.remove(name + suffix)
+                    except OSError:
+                        logging.warning("Could not delete log partition %(file)s" %{'file': name}, exc_info=True)
+            self.stats['deleted'] += 1
+
+    def Group(self, batches):
+        # Merge the batches and return them as {file name: {table: rows}}
+        files = {}
+        if not self.partitionlength:
+            rows = files[self.filename] = {}
+            for batch in batches:
+                for (table, tablerows) in batch.iteritems():
+                    rows.setdefault(table, []).extend(tablerows)
+            return files
+        length = self.partitionlength
+        partitions = {}
+        for batch in batches:
+            for (table, tablerows) in batch.iteritems():
+                for row in tablerows:
+                    key = row[0] // length
+                    if key not in partitions:
+                        partitions[key] = {}
+                    partitions[key].setdefault(table, []).append(row)
+                    if row[0] > self.newest:
+                        self.newest = row[0]
+        for (key, rows) in partitions.iteritems():
+            files[self.FileName(key)] = rows
+        return files
+
+    def Write(self, filename, rows):
+        # Write rows given as {table: [row, ...]} to a file in one
+        # transaction
+        count = sum(len(tablerows) for tablerows in rows.itervalues())
+        if filename in self.formaterrors:
+            self.stats['dropped'] += count
+            return
+        try:
+            (connection, created) = self.Open(filename)
+            for (table, tablerows) in rows.iteritems():
+                if table not in created:
+                    createtable(connection, table)
+                    created.add(table)
+                connection.executemany(TABLES[table][1], tablerows)
+            connection.commit()
+            self.stats['written'] += count
+            self.stats['transactions'] += 1
+        except sqlite.Error:
+            logging.warning("Logging to disk failed", exc_info=True)
+            self.stats['dropped'] += count
+            # Start over with a new connection next time
+            self.Close(filename)
+        except (ValueError, OSError):
+            logging.error("Not logging to %(file)s" %{'file': filename}, exc_info=True)
+            self.stats['dropped'] += count
+            self.formaterrors.add(filename)
+
+    def WriteFiles(self, files):
+        # Write rows given as {file name: {table: rows}}, holding back
+        # the rows for partitions being compacted. Returns True if a
+        # file that wasn't open was written to.
+        # Add the rows held back last time first
+        for (filename, rows) in self.deferred.iteritems():
+            tables = files.setdefault(filename, {})
+            for (table, tablerows) in rows.iteritems():
+                tables[table] = tablerows + tables.get(table, [])
+        self.deferred = {}
+        new = False
+        for (filename, rows) in sorted(files.iteritems()):
+            if self.Vacuuming(filename):
+                self.deferred[filename] = rows
+                continue
+            if filename not in self.connections:
+                new = True
+            self.Write(filename, rows)
+        return new
+
+    def writer(self):
+        stop = False
+        lastexpire = time.time()
+        while not stop:
+            # Wait for data, then take everything in the queue
+            batches = []
+            try:
+                item = self.queue.get(True, 1)
+                while True:
+                    if item == 'stop':
+                        stop = True
+                        break
+                    batches.append(item)
+                    item = self.queue.get_nowait()
+            except Queue.Empty:
+                # Stop once the queue is empty if the stop message
+                # didn't fit in it
+                if self.stopped:
+                    stop = True
+            if not batches and not self.deferred:
+                continue
+            new = self.WriteFiles(self.Group(batches))
+            # Delete old partitions when a new partition is started,
+            # and at least every hour
+            if new or lastexpire + 3600 < time.time():
+                self.Expire()
+                lastexpire = time.time()
+        # Wait (a while) for compactions to finish to write the rows
+        # held back
+        for i in range(DEFERWAIT * 10):
+            if not self.deferred:
+                break
+            time.sleep(0.1)
+            self.WriteFiles({})
+        for rows in self.deferred.itervalues():
+            self.stats['dropped'] += sum(len(tablerows) for tablerows in rows.itervalues())
+        self.deferred = {}
+        for filename in list(self.opened):
+            self.Close(filename)
+        self.vacuumqueue.put('stop')
+
+    def vacuumer(self):
+        # Compact closed partitions
+        while True:
+            filename = self.vacuumqueue.get()
+            if filename == 'stop':
+                break
+            try:
+                connection = sqlite.connect(filename)
+                connection.execute("VACUUM;")
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+                connection.close()
+                self.stats['vacuumed'] += 1
+            except sqlite.Error:
+                logging.warning("Compacting log partition %(file)s failed" %{'file': filename}, exc_info=True)
+            self.vacuumlock.acquire()
+            try:
+                self.vacuuming.discard(filename)
+            finally:
+                self.vacuumlock.release()
+
+    def ReturnStats(self):
+        return self.stats
+
+    def put(self, rows):
+        # Queue rows for writing, given as {table: [row, ...]}
+        try:
+            self.queue.put_nowait(rows)
+        except Queue.Full:
+            self.stats['dropped'] += sum(len(tablerows) for tablerows in rows.itervalues())
+
+    def start(self):
+        try:
+            self.thread = threading.Thread(target=self.writer, name='LogWriter')
+            self.thread.setDaemon(1)
+            self.thread.start()
+            if self.vacuum:
+                self.vacuumthread = threading.Thread(target=self.vacuumer, name='LogVacuum')
+                self.vacuumthread.setDaemon(1)
+                self.vacuumthread.start()
+            return True
+        except:
+            return False
+
+    def stop(self):
+        # Let the writer empty the queue before stopping, without
+        # waiting for room in it
+        self.stopped = True
+        try:
+            self.queue.put_nowait('stop')
+        except Queue.Full:
+            pass
+
+    def join(self, timeout=STOPWAIT):
+        # Wait for a stopped writer to finish, return False if it
+        # didn't in time
+        if self.thread is None:
+            return True
+        self.thread.join(timeout)
+        return not self.thread.isAlive()
+
+
+
+class TestLogWriter(unittest.TestCase):
+    def setUp(self):
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+    def testwrite(self):
+        record = {'time': datetime.datetime(2009, 5, 5, 17, 20, 35), 'mmsi': 265547250,
+                  'latitude': decimal.Decimal('57.7'), 'longitude': decimal.Decimal('11.9'), 'georef': 'PKGH1642',
+                  'sog': decimal.Decimal('12.5'), 'cog': 'N/A', 'imo': 9999999, 'name': u'TEST', 'type': 70,
+                  'callsign': u'SABC', 'destination': 'N/A', 'eta': '05052000', 'length': 100, 'width': 'N/A'}
+        writer = LogWriter(self.filename)
+        writer.start()
+        for i in range(10):
+            writer.put({'position': [positionrow(record)] * 100,
+                        'metadata': [metadatarow(record)]})
+        writer.stop()
+        writer.thread.join(5)
+        self.assertEqual(writer.ReturnStats()['written'], 1010)
+        self.assertEqual(writer.ReturnStats()['dropped'], 0)
+        connection = sqlite.connect(self.filename)
+        self.assertEqual(connection.execute("PRAGMA journal_mode;").fetchone()[0], 'wal')
+        self.assertEqual(connection.execute("PRAGMA user_version;").fetchone()[0], VERSION)
+        self.assertEqual(connection.execute("SELECT count(*) FROM position;").fetchone()[0], 1000)
+        self.assertEqual(connection.execute("SELECT * FROM position LIMIT 1;").fetchone(),
+                         (epoch(record['time']), 265547250, 34620000, 7140000, u'PKGH1642', 125, None))
+        self.assertEqual(connection.execute("SELECT * FROM metadata;").fetchone(),
+                         (epoch(record['time']), 265547250, 9999999, u'TEST', 70, u'SABC', None, u'05052000', 100, None))
+        # Queries by MMSI and time use the indexes
+        plan = connection.execute("EXPLAIN QUERY PLAN SELECT * FROM position WHERE mmsi = 265547250 AND time > 0;").fetchall()
+        self.assertTrue('position_mmsi_time' in str(plan))
+        connection.close()
+
+    def writev1(self, filename):
+        # Write a log file in the old format
+        connection = sqlite.connect(filename)
+        connection.execute("CREATE TABLE position (time, mmsi, latitude, longitude, georef, sog, cog);")
+        connection.execute("CREATE TABLE metadata (time, mmsi, imo, name, type, callsign, destination, eta, length, width);")
+        connection.executemany("INSERT INTO position VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [('2009-05-05T17:20:35', 265547250, 57.6843, 11.8432, 'PKGH1642', 12.3, None),
+                                ('2009-05-05T17:30:35', 265547250, 'N48083447', 'W023596527', None, 0, 359.9)])
+        connection.execute("INSERT INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           ('2009-05-05T17:20:35', 265547250, 9999999, u'TEST', 70, u'SABC', None, '05052000', 100, 20))
+        connection.commit()
+        connection.close()
+
+    def testmigrate(self):
+        self.writev1(self.filename)
+        newfile = self.filename + '.new'
+        try:
+            self.assertEqual(migrate(self.filename, newfile), {'position': 2, 'metadata': 1})
+            connection = sqlite.connect(newfile)
+            start = int(time.mktime((2009, 5, 5, 17, 20, 35, 0, 0, -1)))
+            self.assertEqual(connection.execute("SELECT * FROM position ORDER BY time;").fetchall(),
+                             [(start, 265547250, 34610580, 7105920, u'PKGH1642', 123, None),
+                              (start + 600, 265547250, 28883447, -14396527, None, 0, 3599)])
+            self.assertEqual(connection.execute("SELECT * FROM metadata;").fetchall(),
+                             [(start, 265547250, 9999999, u'TEST', 70, u'SABC', None, u'05052000', 100, 20)])
+            connection.close()
+            # The new file can be written to, the old one can't
+            self.assertEqual(checkversion(sqlite.connect(newfile)), None)
+            self.assertRaises(ValueError, checkversion, sqlite.connect(self.filename))
+            self.assertRaises(ValueError, migrate, newfile, self.filename + '.2')
+        finally:
+            os.remove(newfile)
+
+    def testoldformat(self):
+        # An old file is renamed and logging goes on in a new file
+        self.writev1(self.filename)
+        (base, extension) = os.path.splitext(self.filename)
+        oldname = base + '-v1' + extension
+        logging.disable(logging.ERROR)
+        try:
+            writer = LogWriter(self.filename)
+            writer.start()
+            writer.put({'track': [trackrow(1241544035, 265547250, None, None, None, None)]})
+            writer.put({'track': [trackrow(1241544035, 265547250, None, None, None, None)]})
+            writer.stop()
+            writer.thread.join(5)
+            self.assertEqual(writer.ReturnStats()['dropped'], 0)
+            self.assertEqual(writer.ReturnStats()['written'], 2)
+            self.assertEqual(writer.ReturnStats()['renamed'], 1)
+            connection = sqlite.connect(self.filename)
+            self.assertEqual(connection.execute("PRAGMA user_version;").fetchone()[0], VERSION)
+            self.assertEqual(connection.execute("SELECT count(*) FROM track;").fetchone()[0], 2)
+            connection.close()
+            # The old file is left as it was
+            self.assertEqual(migrate(oldname, oldname + '.new'), {'position': 2, 'metadata': 1})
+            os.remove(oldname + '.new')
+        finally:
+            logging.disable(logging.NOTSET)
+            if os.path.exists(oldname):
+                os.remove(oldname)
+
+    def testtrack(self):
+        writer = LogWriter(self.filename)
+        writer.start()
+        rows = [ trackrow(1241544035 + i, 265547250, decimal.Decimal('57.6843'), decimal.Decimal('11.8432'), decimal.Decimal('12.3'), None)
+                 for i in range(TRACKBATCH) ]
+        writer.put({'track': rows})
+        writer.put({'track': [trackrow(1241544035.7, 265547250, 'N/A', None, 0, 359.9)]})
+        writer.stop()
+        writer.thread.join(5)
+        connection = sqlite.connect(self.filename)
+        self.assertEqual(connection.execute("SELECT count(*) FROM track;").fetchone()[0], TRACKBATCH + 1)
+        row = connection.execute("SELECT * FROM track WHERE time = 1241544035;").fetchall()
+        self.assertEqual(len(row), 2)
+        self.assertEqual(row[0], (1241544035, 265547250, 34610580, 7105920, 123, None))
+        self.assertAlmostEqual(unscale(row[0][2], COORDINATE_SCALE), 57.6843)
+        self.assertEqual(row[1], (1241544035, 265547250, None, None, 0, 3599))
+        # Tables without rows are not created
+        self.assertEqual(connection.execute("SELECT count(*) FROM sqlite_master WHERE name = 'position';").fetchone()[0], 0)
+        connection.close()
+
+    def testpartitions(self):
+        writer = LogWriter(self.filename, partition='daily', vacuum=True)
+        writer.start()
+        # Positions every 10 minutes over four days, from 2009-05-05 00:00 UTC
+        start = 1241481600
+        rows = [ trackrow(start + i * 600, 265547250 + i % 2, 57.7, 11.9, 12.5, 180.0) for i in range(4 * 144) ]
+        for i in range(0, len(rows), 100):
+            writer.put({'track': rows[i:i+100]})
+        writer.stop()
+        writer.thread.join(5)
+        writer.vacuumthread.join(5)
+        files = partitionfiles(self.filename, 'daily')
+        (base, extension) = os.path.splitext(self.filename)
+        self.assertEqual([ name for (first, last, name) in files ],
+                         [ base + '-2009050%d' %day + extension for day in (5, 6, 7, 8) ])
+        self.assertEqual(files[0][:2], (start, start + 86400))
+        self.assertEqual(writer.ReturnStats()['written'], 4 * 144)
+        # The two partitions closed while writing were compacted
+        self.assertEqual(writer.ReturnStats()['vacuumed'], 2)
+        # Queries only read the partitions they need
+        result = list(query(self.filename, 'track', start + 86400 - 1800, start + 86400 + 1800, partition='daily'))
+        self.assertEqual([ row[0] for row in result ], range(start + 86400 - 1800, start + 86400 + 1800, 600))
+        result = list(query(self.filename, 'track', start + 3600, mmsi=265547250, partition='daily'))
+        self.assertEqual(len(result), 4 * 72 - 3)
+        self.assertEqual(list(query(self.filename, 'position', partition='daily')), [])
+        self.assertRaises(ValueError, list, query(self.filename, 'sqlite_master'))
+        for (first, last, name) in files:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(name + suffix):
+                    os.remove(name + suffix)
+
+    def testretention(self):
+        writer = LogWriter(self.filename, partition='hourly', retention=1)
+        writer.start()
+        start = 1241481600
+        for hour in range(30):
+            writer.put({'track': [trackrow(start + hour * 3600, 265547250, 57.7, 11.9, 12.5, 180.0)]})
+        writer.stop()
+        writer.thread.join(5)
+        files = partitionfiles(self.filename, 'hourly')
+        # 24 hours back from the newest row, the partition with the
+        # newest row included
+        self.assertEqual(len(files), 25)
+        self.assertEqual(files[0][0], start + 5 * 3600)
+        self.assertEqual(writer.ReturnStats()['deleted'], 5)
+        for (first, last, name) in files:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(name + suffix):
+                    os.remove(name + suffix)
+
+    def testvacuuming(self):
+        # Partitions being compacted are neither written to nor deleted
+        start = 1241481600
+        writer = LogWriter(self.filename, partition='daily')
+        writer.start()
+        writer.put({'track': [trackrow(start, 265547250, 57.7, 11.9, 12.5, 180.0)]})
+        writer.stop()
+        writer.thread.join(5)
+        first = writer.FileName(start // 86400)
+        writer = LogWriter(self.filename, partition='daily', retention=1)
+        writer.vacuuming.add(first)
+        writer.start()
+        writer.put({'track': [trackrow(start + 60, 265547250, 57.7, 11.9, 12.5, 180.0)]})
+        writer.put({'track': [trackrow(start + 3 * 86400, 265547250, 57.7, 11.9, 12.5, 180.0)]})
+        for i in range(500):
+            if writer.ReturnStats()['written']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(writer.ReturnStats()['written'], 1)
+        self.assertTrue(os.path.exists(first))
+        self.assertEqual(writer.ReturnStats()['deleted'], 0)
+        # When compacted, the rows held back are written and the old
+        # partition can be deleted
+        writer.vacuumlock.acquire()
+        writer.vacuuming.discard(first)
+        writer.vacuumlock.release()
+        writer.stop()
+        writer.thread.join(5)
+        self.assertEqual(writer.ReturnStats()['written'], 2)
+        self.assertEqual(writer.ReturnStats()['dropped'], 0)
+        self.assertEqual(writer.ReturnStats()['deleted'], 1)
+        self.assertFalse(os.path.exists(first))
+        for (first, last, name) in partitionfiles(self.filename, 'daily'):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(name + suffix):
+                    os.remove(name + suffix)
+
+    def testfullqueue(self):
+        writer = LogWriter(self.filename, maxqueue=2)
+        for i in range(5):
+            writer.put({'track': [trackrow(1241544035 + i, 265547250, 57.7, 11.9, 12.5, 180.0)] * 10})
+        self.assertEqual(writer.ReturnStats()['dropped'], 30)
+        # Stopping doesn't wait for room in the queue, and the queued
+        # rows are still written
+        writer.stop()
+        writer.start()
+        self.assertTrue(writer.join())
+        self.assertEqual(writer.ReturnStats()['written'], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,15 +30,13 @@ version = 'VERSION_TAG'
 import sys, os, glob, optparse, logging
 import time, datetime
 import threading, Queue, collections
-import socket, SocketServer
+import socket
 import pickle, codecs, csv, string
-import hashlib
 import decimal
 import time, random
 import gettext
 
 # Import add-on Python packages
-from pysqlite2 import dbapi2 as sqlite
 import numpy
 import serial
 import wx
@@ -47,11 +45,24 @@ from wx.lib.floatcanvas import NavCanvas, FloatCanvas, Resources, Utilities
 import wx.lib.colourdb
 
 # Import external (bundled) packages
-import external.pydblite as pydblite
 from external.configobj import ConfigObj
 
 # Import own modules
 import decode
+import replay
+import archive
+import relay
+import vesselstore
+import expiry
+import geo
+import spatial
+import zones
+import rules
+import tracks
+import cpa
+import predict
+import iddb
+import logdb
 from util import *
 
 
@@ -77,6 +88,9 @@ cmdlineparser = optparse.OptionParser()
 # Add an option for supplying a different config file than the default one
 cmdlineparser.add_option("-c", "--config", dest="configfile", help="Specify a config file other than the default")
 cmdlineparser.add_option("-n", "--nogui", action="store_true", dest="nogui", default=False, help="Run without GUI, i.e. as a server and logger")
+# Add options for replaying a raw data file at program start
+cmdlineparser.add_option("-r", "--replay", dest="replayfile", help="Replay a file containing raw data")
+cmdlineparser.add_option("-s", "--replay-speed", dest="replayspeed", type="float", default=0, help="Replay speed: 0 for as fast as possible (default), 1 for real time or N for N times real time")
 # Parse the arguments
 (cmdlineoptions, cmdlineargs) = cmdlineparser.parse_args()
 if cmdlineoptions.configfile:
@@ -125,6 +139,8 @@ columnsetup = {'mmsi': [_("MMSI"), 80],
                'transponder_type': [_("Transponder type"), 90],
                'bearing': [_("Bearing"), 65],
                'distance': [_("Distance"), 70],
+               'cpa': [_("CPA"), 60],
+               'tcpa': [_("TCPA"), 60],
                'remark': [_("Remark"), 150]}
 
 # Set default keys and values
@@ -134,13 +150,24 @@ defaultconfig = {'common': {'listmakegreytime': 600,
                             'showclassbstations': True,
                             'showafterupdates': 3,
                             'updatetime': 2,
+                            'trackpoints': 100,
+                            'trackmemory': 20,
                             'listcolumns': 'mmsi, mid, name, typename, callsign, georef, creationtime, time, sog, cog, destination, navstatus, bearing, distance, remark',
                             'alertlistcolumns': 'mmsi, mid, name, typename, callsign, georef, creationtime, time, sog, cog, destination, navstatus, bearing, distance, remark'},
                  'logging': {'logging_on': False,
                              'logtime': '600',
                              'logfile': 'aislogger.db',
                              'logbasestations': False,
-                             'logexceptions': False},
+                             'logexceptions': False,
+                             'fullresolution_on': False,
+                             'partition': 'none',
+                             'retention': '0',
+                             'vacuum_on': False},
+                 'raw_archive': {'archive_on': False,
+                                 'directory': 'archive',
+                                 'rotation': 'daily',
+                                 'compression': 'gzip',
+                                 'sources': ''},
                  'iddb_logging': {'logging_on': False,
                                   'logtime': '600',
                                   'logfile': 'id.idb'},
@@ -149,12 +176,21 @@ defaultconfig = {'common': {'listmakegreytime': 600,
                            'alertsound_on': False,
                            'alertsoundfile': '',
                            'maxdistance_on': False,
-                           'maxdistance': '0'},
+                           'maxdistance': '0',
+                           'zonefile_on': False,
+                           'zonefile': '',
+                           'rulefile_on': False,
+                           'rulefile': '',
+                           'cpa_range': '50',
+                           'cpa_alert_on': False,
+                           'cpa_alert_distance': '1',
+                           'cpa_alert_time': '15'},
                  'position': {'override_on': False,
                               'latitude': '0',
                               'longitude': '0',
                               'position_format': 'dms',
-                              'use_position_from': 'any'},
+                              'use_position_from': 'any',
+                              'distance_update': '0.1'},
                  'serial_a': {'serial_on': False,
                               'port': '',
                               'baudrate': '38400',
@@ -166,10 +202,15 @@ defaultconfig = {'common': {'listmakegreytime': 600,
                                    'port': '',
                                    'baudrate': '38400',
                                    'rtscts': False,
-                                   'xonxoff': False},
+                                   'xonxoff': False,
+                                   'priority': 'position, static, other, binary',
+                                   'buffer_time': '10',
+                                   'transforms': ''},
                  'network': {'server_on': False,
                              'server_address': 'localhost',
                              'server_port': '23000',
+                             'server_filter': '',
+                             'server_transforms': '',
                              'clients_on': "",
                              'client_addresses': "",
                              'clients_to_serial': "",
@@ -180,6 +221,8 @@ defaultconfig = {'common': {'listmakegreytime': 600,
                          'alerted_object_color': 'Indian Red',
                          'background_color': 'Cornflower blue',
                          'shoreline_color': 'White',
+                         'predict_on': True,
+                         'predict_maxage': 300,
                          'mapfile': os.path.join(package_home(globals()), 'data/world.dat')}}
 
 # Create a ConfigObj based on dict defaultconfig
@@ -192,6 +235,7 @@ config.initial_comment = ['Autogenerated config file for AIS Logger', "You may e
 # Set comments for each section and key - only used in config file
 config.comments['common'] = ['', 'Common settings for the GUI']
 config.comments['logging'] = ['', 'Settings for logging to file']
+config.comments['raw_archive'] = ['', 'Settings for archiving all raw data to file']
 config.comments['iddb_logging'] = ['', 'Settings for logging the identification database to file']
 config.comments['alert'] = ['', 'Settings for alerts and remarks']
 config.comments['position'] = ['', 'Set manual position (overrides decoded own position)']
@@ -207,11 +251,25 @@ config['common'].comments['showafterupdates'] = ['Number of updates to an object
 config['common'].comments['listcolumns'] = ['Define visible columns in list view using db column names']
 config['common'].comments['alertlistcolumns'] = ['Define visible columns in alert list view using db column names']
 config['common'].comments['updatetime'] = ['Number of s between updating the GUI with new data']
+config['common'].comments['trackpoints'] = ['Number of positions to keep in memory for the track of each object']
+config['common'].comments['trackmemory'] = ['Maximum memory (MB) for object tracks, the tracks updated longest ago are removed first']
 config['logging'].comments['logging_on'] = ['Enable file logging']
 config['logging'].comments['logtime'] = ['Number of s between writes to log file']
 config['logging'].comments['logfile'] = ['Filename of log file']
 config['logging'].comments['logbasestations'] = ['Enable logging of base stations']
 config['logging'].comments['logexceptions'] = ['Enable exception logging to file (for debugging)']
+config['logging'].comments['fullresolution_on'] = ['Log every position report to the track table']
+config['logging'].comments['partition'] = ['Split the log file in partitions: none, hourly or daily']
+config['logging'].comments['retention'] = ['Number of days to keep log partitions (0 to keep all)']
+config['logging'].comments['vacuum_on'] = ['Compact log partitions when they are closed']
+config['serial_server'].comments['priority'] = ['Message classes to keep when the port is too slow (highest priority first)']
+config['serial_server'].comments['buffer_time'] = ['Number of s of data to buffer at the port speed before dropping messages']
+config['serial_server'].comments['transforms'] = ['List of transforms applied to sent data (e.g. dedup)']
+config['raw_archive'].comments['archive_on'] = ['Enable archiving of raw data']
+config['raw_archive'].comments['directory'] = ['Directory to write archive files to']
+config['raw_archive'].comments['rotation'] = ['Start a new archive file hourly or daily']
+config['raw_archive'].comments['compression'] = ['Compression of archive files, gzip or none']
+config['raw_archive'].comments['sources'] = ['List of sources to archive (leave empty for all sources)']
 config['iddb_logging'].comments['logging_on'] = ['Enable IDDB file logging']
 config['iddb_logging'].comments['logtime'] = ['Number of s between writes to log file']
 config['iddb_logging'].comments['logfile'] = ['Filename of log file']
@@ -221,14 +279,25 @@ config['alert'].comments['alertsound_on'] = ['Enable audio alert']
 config['alert'].comments['alertsoundfile'] = ['Filename of wave sound file for audio alert']
 config['alert'].comments['maxdistance_on'] = ['Enable use of maximum distance for alerts']
 config['alert'].comments['maxdistance'] = ['The maximum distance to an object before marking it']
+config['alert'].comments['zonefile_on'] = ['Enable loading of zone file at program start']
+config['alert'].comments['zonefile'] = ['Filename of zone file (alert zones)']
+config['alert'].comments['rulefile_on'] = ['Enable loading of rule file at program start']
+config['alert'].comments['rulefile'] = ['Filename of rule file (alert rules)']
+config['alert'].comments['cpa_range'] = ['Calculate CPA and TCPA for objects within this distance (km)']
+config['alert'].comments['cpa_alert_on'] = ['Enable alerts on objects passing close to own position']
+config['alert'].comments['cpa_alert_distance'] = ['Alert if the CPA is at most this distance (km)']
+config['alert'].comments['cpa_alert_time'] = ['Alert if the TCPA is at most this time (minutes)']
 config['position'].comments['override_on'] = ['Enable manual position override']
 config['position'].comments['position_format'] = ['Define the position presentation format in DD, DM or DMS']
 config['position'].comments['latitude'] = ['Latitude in decimal degrees (DD)']
 config['position'].comments['longitude'] = ['Longitude in decimal degrees (DD)']
 config['position'].comments['use_position_from'] = ['Define the source to get GPS position from']
+config['position'].comments['distance_update'] = ['Recalculate the distance to all objects when own position has moved this far (km)']
 config['network'].comments['server_on'] = ['Enable network server']
 config['network'].comments['server_address'] = ['Server hostname or IP (server side)']
 config['network'].comments['server_port'] = ['Server port (server side)']
+config['network'].comments['server_filter'] = ['Filter for data sent to clients, e.g. types=1,2,3 mmsi=... bbox=S,W,N,E (server side)']
+config['network'].comments['server_transforms'] = ['List of transforms applied to sent data, e.g. dedup (server side)']
 config['network'].comments['clients_on'] = ['List of server:port to enable reading from']
 config['network'].comments['client_addresses'] = ['List of server:port to connect and use data from']
 config['network'].comments['clients_to_serial'] = ['List of server:port to send data to serial out']
@@ -240,6 +309,8 @@ config['map'].comments['alerted_object_color'] = ['Color of a alerted map object
 config['map'].comments['background_color'] = ['Color of map background']
 config['map'].comments['shoreline_color'] = ['Color of map shorelines']
 config['map'].comments['mapfile'] = ['Filename of map in MapGen format']
+config['map'].comments['predict_on'] = ['Enable moving map objects along their course between reports']
+config['map'].comments['predict_maxage'] = ['Number of s after a report to keep moving a map object']
 
 
 ## Define global variables (somewhat ugly)
@@ -303,6 +374,12 @@ class MainWindow(wx.Frame):
     active_set = set()
     grey_dict = {}
     last_own_pos = []
+    # Full data of each object, updated with the changed fields in
+    # update messages, and objects we have asked a full update for
+    object_data = {}
+    resync_set = set()
+    # Fields that the position prediction depends on
+    predict_fields = frozenset(('latitude', 'longitude', 'sog', 'cog', 'rot'))
 
     def __init__(self, parent, id, title):
         wx.Frame.__init__(self, parent, id, title, size=(800,500))
@@ -407,12 +484,46 @@ class MainWindow(wx.Frame):
         # A dict for keeping track of open Detail Windows
         self.detailwindow_dict = {}
 
+        # Predicts positions of moving objects between reports
+        self.predictor = predict.Predictor(config['map'].as_int('predict_maxage'))
+
+    def ReportPosition(self, data):
+        # Give the last report of an object to the predictor
+        try:
+            reporttime = time.mktime(data['time'].timetuple())
+        except:
+            reporttime = time.time()
+        self.predictor.report(data['mmsi'], reporttime, data['latitude'], data['longitude'],
+                              data['sog'], data['cog'], data.get('rot'))
+
     def GetMessages(self, event):
         # Get messages from main thread
         messages = main_thread.ReturnOutgoing()
         # See what to do with them
         for message in messages:
             if 'update' in message:
+                data = message['update']
+                mmsi = data['mmsi']
+                if message.get('full', False):
+                    # A full update, replace our data
+                    self.object_data[mmsi] = data
+                    self.resync_set.discard(mmsi)
+                elif mmsi in self.object_data and message['since'] == self.object_data[mmsi]['__version__']:
+                    # Apply the changed fields (possibly merged from
+                    # several updates) and pass on all data
+                    message['changed'] = set(data)
+                    self.object_data[mmsi].update(data)
+                    message['update'] = self.object_data[mmsi]
+                else:
+                    # We have missed the insert or an update, ask the
+                    # main thread for all data (once)
+                    if mmsi not in self.resync_set:
+                        self.resync_set.add(mmsi)
+                        main_thread.put({'resync': mmsi})
+                    continue
+                # Give new positions to the predictor
+                if message.get('full', False) or message['changed'] & self.predict_fields:
+                    self.ReportPosition(message['update'])
                 # "Move" from grey_dict to active_set
                 if message['update']['mmsi'] in self.grey_dict:
                     del self.grey_dict[message['update']['mmsi']]
@@ -429,6 +540,8 @@ class MainWindow(wx.Frame):
             elif 'insert' in message:
                 # Insert to active_set
                 self.active_set.add(message['insert']['mmsi'])
+                self.object_data[message['insert']['mmsi']] = message['insert']
+                self.ReportPosition(message['insert'])
                 # Refresh status row
                 self.OnRefreshStatus()
                 # Update lists
@@ -440,6 +553,7 @@ class MainWindow(wx.Frame):
             elif 'old' in message:
                 # "Move" from active_set to grey_dict
                 distance = message['old'].get('distance', None)
+                self.predictor.remove(message['old']['mmsi'])
                 if message['old']['mmsi'] in self.active_set:
                     self.active_set.discard(message['old']['mmsi'])
                     self.grey_dict[message['old']['mmsi']] = distance
@@ -454,6 +568,9 @@ class MainWindow(wx.Frame):
             elif 'remove' in message:
                 # Remove from grey_dict (and active_set to be sure)
                 self.active_set.discard(message['remove'])
+                self.object_data.pop(message['remove'], None)
+                self.predictor.remove(message['remove'])
+                self.resync_set.discard(message['remove'])
                 if message['remove'] in self.grey_dict:
                     del self.grey_dict[message['remove']]
                 # Refresh status row
@@ -488,8 +605,11 @@ class MainWindow(wx.Frame):
         # Refresh the listctrls (by sorting)
         self.splist.Refresh()
         self.spalert.Refresh()
-        # Update the map if shown
+        # Update the map if shown, move objects to their predicted
+        # positions first
         if self.map.IsShown():
+            if config['map'].as_bool('predict_on'):
+                self.map.UpdateMap({'predicted': self.predictor.predict(time.time())})
             self.map.Canvas.Draw()
         # See if we should fetch statistics data from CommHubThread
         # Also add data in grey_dict and nbr of items
@@ -595,8 +715,24 @@ class MainWindow(wx.Frame):
             path = open_dlg.GetPath()
         open_dlg.Destroy()
         if len(path) > 0:
+            # Ask for the replay speed
+            choices = [_("As fast as possible"), _("Real time"), _("Faster than real time...")]
+            speed_dlg = wx.SingleChoiceDialog(self, message=_("Choose how fast to replay the file.\nTimed replays use the timestamps in the file."), caption=_("Replay speed"), choices=choices)
+            if speed_dlg.ShowModal() != wx.ID_OK:
+                speed_dlg.Destroy()
+                return
+            selection = speed_dlg.GetSelection()
+            speed_dlg.Destroy()
+            if selection == 0:
+                speed = 0
+            elif selection == 1:
+                speed = 1
+            else:
+                speed = wx.GetNumberFromUser(_("Replay the file at N times real time."), _("N:"), _("Replay speed"), 10, 2, 1000, self)
+                if speed == -1:
+                    return
             try:
-                self.rawfileloader(path)
+                self.rawfileloader(path, speed)
             except IOError, error:
                 dlg = wx.MessageDialog(self, _("Could not open file") + "\n" + str(error), style=wx.OK|wx.ICON_ERROR)
                 dlg.ShowModal()
@@ -606,39 +742,39 @@ class MainWindow(wx.Frame):
                 dlg.ShowModal()
                 dlg.Destroy()
 
-    def rawfileloader(self, filename):
+    def rawfileloader(self, filename, speed=0):
         # Load raw data from file and queue it to the CommHubThread
+        # The CommHubThread is fed with backpressure so no data is lost
+        raw_replay = replay.RawReplay(filename, lambda item: comm_hub_thread.put(item, block=True), speed)
+
+        # Make sure that we can open the file before continuing
+        open(filename, 'r').close()
+
+        # Timed replays run in the background
+        if speed > 0:
+            def runner():
+                raw_replay.run()
+                wx.CallAfter(self.SetStatusText, _("Replay finished: ") + raw_replay.Throughput(), 0)
+            r = threading.Thread(target=runner)
+            r.setDaemon(1)
+            r.start()
+            return
 
-        # Open file
-        f=open(filename, 'r')
-
-        # Get total number of lines in file
-        num_lines = 0
-        for line in f:
-            num_lines += 1
-        f.seek(0)
-
-        # Create a progress dialog
-        progress = wx.ProgressDialog(_("Loading file..."), _("Loading file..."), num_lines)
-
-        # Step through each row in the file
-        name = 'File'
-        lastupdate_line = 0
-        for linenumber, line in enumerate(f):
-
-            # If indata contains raw data, pass it along
-            if line[0] == '!' or line[0] == '$':
-                # Put it in CommHubThread's queue
-                comm_hub_thread.put([name,line])
+        # Create a progress dialog (progress is estimated in per mille
+        # of the file size)
+        progress = wx.ProgressDialog(_("Loading file..."), _("Loading file...") + "\n", 1000, style=wx.PD_AUTO_HIDE|wx.PD_APP_MODAL|wx.PD_CAN_ABORT|wx.PD_ELAPSED_TIME)
 
-            # Update the progress dialog for each 100 rows
-            if lastupdate_line + 100 < linenumber:
-                progress.Update(linenumber)
-                lastupdate_line = linenumber
+        # Update the progress dialog, abort if the user wants to
+        def update(fraction):
+            keepgoing = progress.Update(int(fraction * 1000), _("Loading file...") + "\n" + raw_replay.Throughput())
+            # Depending on wx version a bool or a tuple is returned
+            if isinstance(keepgoing, tuple):
+                keepgoing = keepgoing[0]
+            return keepgoing
 
-        # Close file
-        f.close()
+        raw_replay.run(update)
         progress.Destroy()
+        self.SetStatusText(_("Replay finished: ") + raw_replay.Throughput(), 0)
 
     def Quit(self, event):
         for window in self.detailwindow_dict.itervalues():
@@ -749,6 +885,8 @@ class MapFrame(wx.Frame):
         self.grey_dict = parent.grey_dict
         # Set no selected object
         self.selected = None
+        # Set no track line for the selected object
+        self.track_line = None
         # Set "own" object
         self.own_object = None
         # Set variable to see if the map is loaded
@@ -838,6 +976,8 @@ class MapFrame(wx.Frame):
         # the original color)
         self.itemMap[self.selected][0].SetColor(config['map']['selected_object_color'])
         self.itemMap[self.selected][1].SetLineColor(config['map']['selected_object_color'])
+        # Draw the recent track of the object
+        self.DrawTrack()
         # Make window enabled
         self.ObjectWindow.Enable(True)
         # Enable detail window button
@@ -862,6 +1002,8 @@ class MapFrame(wx.Frame):
                 obj_color = config['map']['old_object_color']
             self.itemMap[self.selected][0].SetColor(obj_color)
             self.itemMap[self.selected][1].SetLineColor(obj_color)
+            # Remove the track line
+            self.RemoveTrack()
             # Disable detail window button
             self.detail_button.Enable(False)
             # Set selected to None
@@ -922,6 +1064,7 @@ class MapFrame(wx.Frame):
             # (contains heading, speed, position)
             if self.selected and self.selected == mmsi:
                 self.UpdateObjectWindow(self.itemMap[mmsi][1])
+                self.DrawTrack()
         elif 'insert' in message:
             data = message['insert']
             mmsi = data['mmsi']
@@ -949,6 +1092,13 @@ class MapFrame(wx.Frame):
                 self.itemMap[mmsi][1].SetLineColor(config['map']['old_object_color'])
         elif 'own_position' in message:
             self.SetOwnObject(message['own_position'])
+        elif 'predicted' in message:
+            # Move objects to their predicted positions
+            for (mmsi, lat, long, course) in message['predicted']:
+                if mmsi in self.itemMap:
+                    self.MoveObject(self.itemMap[mmsi], lat, long, course)
+                    if self.selected == mmsi:
+                        self.UpdateObjectWindow(self.itemMap[mmsi][1])
         # See if we need to zoom to bounding box
         # (workaround after drawing map)
         if self.zoomNext:
@@ -1015,6 +1165,9 @@ class MapFrame(wx.Frame):
             georef_v = georef(pos[1], pos[0])
         except:
             lat = '-'; long = '-'; georef_v = '-'
+        # Mark predicted positions
+        if getattr(map_object, 'predicted', False):
+            georef_v += _(" (predicted)")
         # Set labels
         self.box_mmsi.SetLabel(_("MMSI: ") + str(mmsi))
         self.box_name.SetLabel(_("Name: ") + name)
@@ -1090,6 +1243,33 @@ class MapFrame(wx.Frame):
         setattr(Arrow, 'name', name)
         setattr(Arrow, 'bearing', bearing)
         setattr(Arrow, 'distance', distance)
+        setattr(Arrow, 'predicted', False)
+
+    def DrawTrack(self):
+        # Draw a line along the recent track of the selected object
+        self.RemoveTrack()
+        track = main_thread.GetTrack(self.selected)
+        if len(track) > 1:
+            points = [ (long, lat) for (t, lat, long, sog, cog) in track ]
+            self.track_line = self.Canvas.AddLine(points, LineColor=config['map']['selected_object_color'], LineStyle='Dot', InForeground=True)
+
+    def RemoveTrack(self):
+        # Remove the track line if there is one
+        if self.track_line:
+            self.Canvas.RemoveObject(self.track_line)
+            self.track_line = None
+
+    def MoveObject(self, Object, y, x, heading):
+        # Move the Object to a predicted position
+
+        # Map objects
+        Point = Object[0]
+        Arrow = Object[1]
+
+        Point.SetPoint((x,y))
+        Arrow.SetPoint((x,y))
+        Arrow.SetLengthDirection(Arrow.Length, heading)
+        setattr(Arrow, 'predicted', True)
 
     def RemoveObject(self, Object):
         # Remove the Object
@@ -1390,8 +1570,12 @@ class VirtualList(wx.ListCtrl, listmix.ListCtrlAutoWidthMixin, listmix.ColumnSor
                 self.alertitems.add(mmsi)
             else:
                 self.alertitems.discard(mmsi)
-            # Get the data formatted
-            self.itemDataMap[mmsi] = self.FormatData(data)
+            # Get the data formatted, only the changed columns if we
+            # know what has changed
+            if mmsi in self.itemDataMap and 'changed' in message:
+                self.UpdateData(self.itemDataMap[mmsi], data, message['changed'])
+            else:
+                self.itemDataMap[mmsi] = self.FormatData(data)
         elif 'insert' in message:
             # Set a new item count in the listctrl
             self.SetItemCount(self.GetItemCount()+1)
@@ -1426,61 +1610,60 @@ class VirtualList(wx.ListCtrl, listmix.ListCtrlAutoWidthMixin, listmix.ColumnSor
     def FormatData(self, data):
         # Create a temporary dict to hold data in the order of
         # self.columnlist so that the virtual listctrl can use it
-        new = []
-        latpos = None
-        longpos = None
-        # Loop over the columns we will show
+        return [ self.FormatColumn(col, data) for col in self.columnlist ]
+
+    def UpdateData(self, row, data, changed):
+        # Format only the columns of row that have changed in data
+        # A new position changes both latitude and longitude columns
+        if 'latitude' in changed or 'longitude' in changed:
+            changed = changed.union(('latitude', 'longitude'))
         for i, col in enumerate(self.columnlist):
-            # Append the list
-            new.append(None)
-            # If we have the data, fine!
-            if col in data:
-                # Set new[position] to the info in data
-                # If Nonetype, set an empty string (for sorting reasons)
-                if not data[col] == None:
-                    new[i] = data[col]
+            if col in changed:
+                row[i] = self.FormatColumn(col, data)
+
+    def FormatColumn(self, col, data):
+        # Return the value to show in column col
+        # If we don't have the data, return None
+        if not col in data:
+            return None
+        # If Nonetype, set an empty string (for sorting reasons)
+        value = data[col]
+        if value == None:
+            value = u''
+        # Some special formatting cases
+        if col == 'creationtime' or col == 'time':
+            try: value = data[col].isoformat()[11:19]
+            except: value = ''
+        elif col == 'latitude' or col == 'longitude':
+            # Get position in a more human-readable format
+            if data.get('latitude',False) and data.get('longitude',False) and data['latitude'] != 'N/A' and data['longitude'] != 'N/A':
+                pos = PositionConversion(data['latitude'],data['longitude']).default
+                if col == 'latitude':
+                    value = pos[0]
                 else:
-                    new[i] = u''
-                # Some special formatting cases
-                if col == 'creationtime':
-                    try: new[i] = data[col].isoformat()[11:19]
-                    except: new[i] = ''
-                elif col == 'time':
-                    try: new[i] = data[col].isoformat()[11:19]
-                    except: new[i] = ''
-                elif col == 'latitude':
-                    latpos = i
-                elif col == 'longitude':
-                    longpos = i
-                elif col == 'navstatus':
-                    navstatus = data[col]
-                    if navstatus == None: navstatus = ''
-                    elif navstatus == 0: navstatus = _("Under Way")
-                    elif navstatus == 1: navstatus = _("At Anchor")
-                    elif navstatus == 2: navstatus = _("Not Under Command")
-                    elif navstatus == 3: navstatus = _("Restricted Manoeuvrability")
-                    elif navstatus == 4: navstatus = _("Constrained by her draught")
-                    elif navstatus == 5: navstatus = _("Moored")
-                    elif navstatus == 6: navstatus = _("Aground")
-                    elif navstatus == 7: navstatus = _("Engaged in Fishing")
-                    elif navstatus == 8: navstatus = _("Under way sailing")
-                    new[i] = navstatus
-                elif col == 'posacc':
-                    if data[col] == 0: new[i] = _('GPS')
-                    elif data[col] == 1: new[i] = _('DGPS')
-                    else: new[i] = ''
-                elif col == 'transponder_type':
-                    if data[col] == 'A': new[i] = _('Class A')
-                    elif data[col] == 'B': new[i] = _('Class B')
-                    elif data[col] == 'base': new[i] = _('Base station')
-        # Get position in a more human-readable format
-        if data.get('latitude',False) and data.get('longitude',False) and data['latitude'] != 'N/A' and data['longitude'] != 'N/A':
-            pos = PositionConversion(data['latitude'],data['longitude']).default
-            if latpos:
-                new[latpos] = pos[0]
-            if longpos:
-                new[longpos] = pos[1]
-        return new
+                    value = pos[1]
+        elif col == 'navstatus':
+            navstatus = data[col]
+            if navstatus == None: navstatus = ''
+            elif navstatus == 0: navstatus = _("Under Way")
+            elif navstatus == 1: navstatus = _("At Anchor")
+            elif navstatus == 2: navstatus = _("Not Under Command")
+            elif navstatus == 3: navstatus = _("Restricted Manoeuvrability")
+            elif navstatus == 4: navstatus = _("Constrained by her draught")
+            elif navstatus == 5: navstatus = _("Moored")
+            elif navstatus == 6: navstatus = _("Aground")
+            elif navstatus == 7: navstatus = _("Engaged in Fishing")
+            elif navstatus == 8: navstatus = _("Under way sailing")
+            value = navstatus
+        elif col == 'posacc':
+            if data[col] == 0: value = _('GPS')
+            elif data[col] == 1: value = _('DGPS')
+            else: value = ''
+        elif col == 'transponder_type':
+            if data[col] == 'A': value = _('Class A')
+            elif data[col] == 'B': value = _('Class B')
+            elif data[col] == 'base': value = _('Base station')
+        return value
 
     def OnGetItemText(self, item, col):
         # Return the text in item, col
@@ -3548,8 +3731,29 @@ class GUI(wx.App):
 
 class SerialThread:
     queue = Queue.Queue()
-    # Define a queue for inserting data to send
-    comqueue = Queue.Queue(500)
+
+    def __init__(self):
+        # Define a buffer for data to send, holding buffer_time
+        # seconds of data at the port speed
+        try:
+            self.byterate = relay.baudrate_budget(config['serial_server'].as_int('baudrate'))
+        except ValueError:
+            self.byterate = relay.baudrate_budget(38400)
+        try:
+            buffer_time = config['serial_server'].as_int('buffer_time')
+        except ValueError:
+            logging.warning("Invalid buffer_time for the serial server, using %(default)s s" %{'default': defaultconfig['serial_server']['buffer_time']}, exc_info=True)
+            buffer_time = int(defaultconfig['serial_server']['buffer_time'])
+        # The priority list may be read as a list or a string
+        priority = config['serial_server']['priority']
+        try:
+            if isinstance(priority, basestring):
+                priority = priority.split(',')
+            priority = [c.strip() for c in priority]
+        except (AttributeError, TypeError):
+            logging.warning("Invalid priority for the serial server, using the default order", exc_info=True)
+            priority = relay.PRIORITY
+        self.output = relay.OutputBuffer(self.byterate * buffer_time, priority)
 
     def reader(self, name, s):
         # Set empty queueitem
@@ -3602,6 +3806,9 @@ class SerialThread:
         else:
             # Server is not on, exit thread
             return False
+        # Only write as much as the port can send, the rest is kept
+        # in the output buffer where the drop policy applies
+        budget = relay.ByteBudget(self.byterate)
         # Set empty queueitem
         queueitem = ''
         # Start loop
@@ -3618,32 +3825,32 @@ class SerialThread:
                 break
             # Do we have carrier?
             if serial_server.getCD():
-                lines = []
-                # Try to get data from queue
-                while True:
-                    try:
-                        lines.append(self.comqueue.get_nowait())
-                    except Queue.Empty:
-                        break
+                # Get as much data as the budget allows
+                data = self.output.take(budget.available(), budget.full())
+                if not data:
+                    continue
+                budget.spend(len(data))
                 # Write to port
                 try:
-                    serial_server.write(''.join(lines))
+                    serial_server.write(data)
+                    self.output.Written(len(data))
                 except serial.SerialException:
                     # Don't handle error, port should be open
                     pass
-        
+            else:
+                # Don't save up a burst while without carrier
+                budget.available()
+
     def ReturnStats(self):
-        return self.stats
+        # Return the output statistics (bytes queued, written and
+        # buffered, and dropped messages per message class)
+        return self.output.ReturnStats()
 
     def put(self, item):
         self.queue.put(item)
 
     def put_send(self, item):
-        try:
-            self.comqueue.put_nowait(item)
-        except Queue.Full:
-            self.comqueue.get_nowait()
-            self.comqueue.put_nowait(item)
+        self.output.put(item)
 
     def start(self):
         try:
@@ -3699,118 +3906,36 @@ class SerialThread:
             while True:
                 self.queue.get_nowait()
         except Queue.Empty:
-            try:
-                while True:
-                    self.comqueue.get_nowait()
-            except Queue.Empty:
-                for i in range(0,100):
-                    self.put('stop')
-                    self.put_send('stop')
+            self.output.clear()
+            for i in range(0,100):
+                self.put('stop')
 
 
 class NetworkServerThread:
-    # Define a queue for inserting data to send
-    comqueue = Queue.Queue(500)
-
-    class NetworkClientHandler(SocketServer.BaseRequestHandler):
-        def handle(self):
-            message = ''
-            # Define an instance collection
-            self.indata = collections.deque()
-            # Notify the NetworkFeeder that we have liftoff...
-            NetworkServerThread().put(('started', self))
-            while True:
-                try:
-                    # Try to pop message from the collection
-                    message = self.indata.popleft()
-                except IndexError:
-                    # If no data in collection, sleep (prevents 100% CPU drain)
-                    time.sleep(0.05)
-                    continue
-                except: pass
-                # If someone tells us to stop, stop.
-                if message == 'stop': break
-                # If message length is > 1, send message to socket
-                if len(message) > 1:
-                    try:
-                        self.request.send(str(message))
-                    except:
-                        break
-            # Stop, please.
-            NetworkServerThread().put(('stopped', self))
-            self.indata.clear()
-            self.request.close()
-
+    # A network server relays raw data to all connected clients
+    # from a single thread, see relay.RelayServer. Besides the
+    # network server there may be any number of relay servers,
+    # configured in relay_* sections.
 
-    def server(self):
-        # Spawn network servers as clients request connection
-        server_address = config['network']['server_address']
-        server_port = config['network'].as_int('server_port')
+    def __init__(self, address, port, server_filter='', name='NetworkServer'):
         try:
-            server = SocketServer.ThreadingTCPServer((server_address, server_port), self.NetworkClientHandler)
-            server.serve_forever()
-        except:
-            logging.error("Could not start the network server on address %(address)s and port %(port)s" %{'address': server_address, 'port': server_port}, exc_info=True)
-
-    def feeder(self):
-        # This function tracks each server thread and feeds them
-        # with data from the queue
-        queueitem = ''
-        servers = []
-        while True:
-            try:
-                queueitem = self.comqueue.get_nowait()
-                # If a server started, add to servers
-                if queueitem[0] == 'started':
-                    servers.append(queueitem[1])
-                # If a server stopped, remove from servers
-                elif queueitem[0] == 'stopped':
-                    servers.remove(queueitem[1])
-                # If someone wants to stop us, send stop to servers
-                elif queueitem == 'stop':
-                    for server in servers:
-                        for i in range(0,100):
-                            server.indata.append('stop')
-                    break
-            # If no data in queue, sleep (prevents 100% CPU drain)
-            except Queue.Empty:
-                time.sleep(0.05)
-                continue
-            # If something in queue, but not in form of a list, pass
-            except IndexError: pass
+            relay.RelayFilter(server_filter)
+        except ValueError:
+            logging.error("Invalid filter %(filter)s for %(name)s, sending all data" %{'filter': server_filter, 'name': name}, exc_info=True)
+            server_filter = ''
+        self.server = relay.RelayServer(address, port, server_filter, name=name)
 
-            # If queueitem length is > 1, send message to socket
-            if len(queueitem) > 1:
-                for server in servers:
-                    server.indata.append(queueitem)
+    def ReturnStats(self):
+        return self.server.ReturnStats()
 
     def start(self):
-        try:
-            feeder = threading.Thread(target=self.feeder, name='NetworkFeeder')
-            feeder.setDaemon(1)
-            feeder.start()
-            server = threading.Thread(target=self.server, name='NetworkServer')
-            server.setDaemon(1)
-            server.start()
-            return True
-        except:
-            return False
+        return self.server.start()
 
     def stop(self):
-        # Get everything in queue and send stop string
-        try:
-            while True:
-                self.comqueue.get_nowait()
-        except Queue.Empty:
-            for i in range(0,100):
-                self.put('stop')
+        self.server.stop()
 
-    def put(self, item):
-        try:
-            self.comqueue.put_nowait(item)
-        except Queue.Full:
-            self.comqueue.get_nowait()
-            self.comqueue.put_nowait(item)
+    def put(self, item, message={}):
+        self.server.put(item, message)
 
 
 class NetworkClientThread:
@@ -3920,6 +4045,14 @@ class CommHubThread:
         # The routing matrix consists of a dict with key 'input'
         # and value 'output list'
         routing_matrix = self.CreateRoutingMatrix()
+        # The outputs dict has the output name as key and the output
+        # (with its transforms) as value
+        outputs = self.CreateOutputs()
+        # Resolve the outputs for each source in advance, other
+        # sources are resolved once when first seen
+        source_outputs = {}
+        for source in routing_matrix.iterkeys():
+            source_outputs[source] = self.SourceOutputs(source, routing_matrix, outputs)
         # The message parts dict has 'input' as key and
         # and a list of previous messages as value
         message_parts = {}
@@ -3945,6 +4078,9 @@ class CommHubThread:
             # Set some variables
             source = incoming_item[0]
             data = incoming_item[1]
+            # Items put with backpressure (e.g. file replays) carry a
+            # third element and must not be dropped later on either
+            block = len(incoming_item) > 2
 
             # See if we got source in stats dict
             if not source in self.stats:
@@ -3952,25 +4088,28 @@ class CommHubThread:
                 self.stats[source]['received'] = 0
                 self.stats[source]['parsed'] = 0
 
-            # See if we should route the data
-            outputs = routing_matrix.get(source,[])
-            # Route the raw data
-            for output in outputs:
-                if output == 'serial':
-                    serial_thread.put_send(data)
-                elif output == 'network':
-                    network_server_thread.put(data)
+            # See where we should route the data
+            if source not in source_outputs:
+                source_outputs[source] = self.SourceOutputs(source, routing_matrix, outputs)
+            raw_outputs, decoded_outputs = source_outputs[source]
+            # Route the raw data to outputs that take each line as
+            # received, the others get the data after it has been
+            # decoded (for filtering)
+            for output in raw_outputs:
+                output.put(source, data, None)
+            # Lines to relay, all parts of a split message are relayed
+            # together when the message is complete
+            relay_lines = data
 
             # Check if message is split on several lines
             lineinfo = data.split(',')
             if lineinfo[0] == '!AIVDM':
                 try:
                     nbr_of_lines = int(lineinfo[1])
-                except: continue
-                try:
-                    line_nbr = int(lineinfo[2])
-                    line_seq_id = int(lineinfo[3])
-                except: pass
+                except ValueError:
+                    # Can't be decoded, relay it as it is
+                    self.Abandon(source, data, decoded_outputs)
+                    continue
                 # If message is split, check that they belong together
                 if nbr_of_lines > 1:
                     # Get previous parts if they exist
@@ -3981,26 +4120,40 @@ class CommHubThread:
                     else:
                         seq_id = 10
                         total_data = ''
+                    try:
+                        line_nbr = int(lineinfo[2])
+                        line_seq_id = int(lineinfo[3])
+                    except (IndexError, ValueError):
+                        # Give up the message, relaying the parts so far
+                        message_parts[source] = [10, '']
+                        self.Abandon(source, total_data + data, decoded_outputs)
+                        continue
                     # If first message, set seq_id to the sequential message ID
+                    # (relaying the parts of an unfinished message)
                     if line_nbr == 1:
+                        if total_data:
+                            self.Abandon(source, total_data, decoded_outputs)
                         total_data = ''
                         seq_id = line_seq_id
                     # If not first message, check that the seq ID matches seq_id
-                    # If not true, reset variables and continue
+                    # If not true, relay the parts, reset variables and continue
                     elif line_seq_id != seq_id:
                         message_parts[source] = [10, '']
+                        self.Abandon(source, total_data + data, decoded_outputs)
                         continue
                     # Add data to variable total_data
                     total_data += data
                     # If the final message has been received, join messages and decode
                     if len(total_data.splitlines()) == nbr_of_lines:
                         data = decode.jointelegrams(total_data)
+                        relay_lines = total_data
                         message_parts[source] = [10, '']
                     else:
                         message_parts[source] = [seq_id, total_data]
                         continue
 
             # Set the telegramparser result in dict parser and queue it
+            parser = {}
             try:
                 # Add one to stats dict
                 self.stats[source]['received'] += 1
@@ -4011,16 +4164,16 @@ class CommHubThread:
                 # See if we should send it, and if so: do it!
                 if 'mmsi' in parser:
                     # Send data to main thread
-                    main_thread.put(parser)
+                    main_thread.put(parser, block)
                     # Add to stats dict if we have decoded message
                     # (see if 'decoded' is True)
                     if parser.get('decoded',True):
                         self.stats[source]['parsed'] += 1
                 # See if we have a position and if we should use it
                 elif 'ownlatitude' in parser and 'ownlongitude' in parser:
-                    if position_source.lowercase() == 'any' or position_source == source:
+                    if position_source.lower() == 'any' or position_source == source:
                         # Send data to main thread
-                        main_thread.put(parser)
+                        main_thread.put(parser, block)
                         # Add to stats dict
                         self.stats[source]['parsed'] += 1
 
@@ -4035,7 +4188,11 @@ class CommHubThread:
                 except Queue.Full:
                     self.raw_queue.get_nowait()
                     self.raw_queue.put_nowait(raw)
-            except: continue
+            except: pass
+
+            # Relay the raw lines along with the decoded message
+            for output in decoded_outputs:
+                output.put(source, relay_lines, parser)
 
     def CreateRoutingMatrix(self):
         # Creates a routing matrix dict from the set config options
@@ -4085,8 +4242,80 @@ class CommHubThread:
                         matrix[portname] = send_list
                 except: pass
 
+        # Add the raw data archive, either for the listed sources or
+        # for all sources (using the key '*')
+        if config['raw_archive'].as_bool('archive_on'):
+            archive_sources = [ s.strip() for s in config['raw_archive']['sources'].split(',')
+                                if s.strip() ]
+            if not archive_sources:
+                archive_sources = ['*']
+            for archive_source in archive_sources:
+                send_list = matrix.get(archive_source,[])
+                send_list.append('archive')
+                matrix[archive_source] = send_list
+
+        # Add the relay servers, for the listed sources or for all
+        # sources in the same way as the archive
+        for relay_name in relay_server_threads.iterkeys():
+            relay_sources = [ s.strip() for s in config[relay_name].get('sources', '').split(',')
+                              if s.strip() ]
+            if not relay_sources:
+                relay_sources = ['*']
+            for relay_source in relay_sources:
+                send_list = matrix.get(relay_source,[])
+                send_list.append(relay_name)
+                matrix[relay_source] = send_list
+
         return matrix
 
+    def CreateOutputs(self):
+        # Creates a dict of all outputs with the output name as key.
+        # Each output is called with put(source, data, message), raw
+        # outputs with each line as received and no message.
+        def transforms(spec, name):
+            try:
+                # Forget vessels when they are removed from memory
+                return relay.maketransforms(spec, expiry=config['common'].as_int('deleteitemtime'))
+            except ValueError:
+                logging.error("Invalid transforms %(spec)s for %(name)s, not using any" %{'spec': spec, 'name': name}, exc_info=True)
+                return []
+        outputs = {}
+        outputs['serial'] = relay.Output(lambda source, data, message: serial_thread.put_send(data),
+                                         transforms(config['serial_server']['transforms'], 'serial server'))
+        # Network clients may set their own filters
+        outputs['network'] = relay.Output(lambda source, data, message: network_server_thread.put(data, message),
+                                          transforms(config['network']['server_transforms'], 'network server'),
+                                          filtered=True)
+        outputs['archive'] = relay.Output(lambda source, data, message: raw_archive.put(source, data))
+        for (relay_name, relay_server_thread) in relay_server_threads.iteritems():
+            outputs[relay_name] = relay.Output(lambda source, data, message, server=relay_server_thread: server.put(data, message),
+                                               transforms(config[relay_name].get('transforms', ''), relay_name),
+                                               filtered=True)
+        return outputs
+
+    def Abandon(self, source, lines, outputs):
+        # Relay lines that couldn't be joined into a message, with an
+        # empty message so that they only pass empty filters
+        for output in outputs:
+            output.put(source, lines, {})
+
+    def SourceOutputs(self, source, routing_matrix, outputs):
+        # Return the raw and the decoded outputs to send data from the
+        # source to, including the outputs for all sources ('*')
+        raw_outputs = []
+        decoded_outputs = []
+        names = routing_matrix.get(source,[])
+        if source != '*':
+            names = names + routing_matrix.get('*',[])
+        for name in names:
+            if name not in outputs:
+                continue
+            if outputs[name].raw:
+                raw_outputs.append(outputs[name])
+            else:
+                decoded_outputs.append(outputs[name])
+        return raw_outputs, decoded_outputs
+
     def ReturnStats(self):
         return self.stats
 
@@ -4100,7 +4329,13 @@ class CommHubThread:
                 break
         return temp
             
-    def put(self, item):
+    def put(self, item, block=False):
+        # A blocking put waits for room in the queue instead of
+        # dropping the oldest item, and marks the item so that it
+        # is passed on to the main thread in the same way
+        if block:
+            self.incoming_queue.put([item[0], item[1], True])
+            return
         try:
             self.incoming_queue.put_nowait(item)
         except Queue.Full:
@@ -4126,20 +4361,57 @@ class CommHubThread:
 
 
 class MainThread:
-    # Create an incoming and an outgoing queue
-    # Set a limit on how large the outgoing queue can get
+    # Create an incoming queue
     queue = Queue.Queue(1000)
-    outgoing = Queue.Queue(1000)
+    # Most control messages kept for the GUI before the oldest are dropped
+    maxoutgoing = 1000
+    # Seconds of own positions to estimate own speed and course from,
+    # and the change in speed (knots) or course (degrees) that makes
+    # the CPA of all objects be recalculated
+    ownmotion_baseline = 60
+    ownmotion_sog = 0.5
+    ownmotion_cog = 5
+    # Fields logged in the metadata table
+    metadata_fields = frozenset(('imo', 'name', 'type', 'callsign', 'destination', 'eta', 'length', 'width'))
 
     def __init__(self):
+        # Outgoing messages are kept in two lanes: control messages
+        # (insert, remove, old, errors...) in order, dropping the
+        # oldest if the GUI doesn't keep up, and object updates in a
+        # dict that only keeps the latest update of each object until
+        # the GUI gets them. Without a GUI nothing is kept.
+        self.gui = not cmdlineoptions.nogui
+        self.outgoing = collections.deque()
+        self.outgoing_updates = {}
+        self.outgoing_lock = threading.Lock()
+        self.stats = {'dropped': 0}
+
         # Set an empty incoming dict
         self.incoming_packet = {}
 
-        # Define a dict to store the metadata hashes
-        self.hashdict = {}
+        # Objects with position or metadata changes not logged yet
+        self.log_positions = set()
+        self.log_metadata = set()
+        # Position reports not yet sent to the log writer (full
+        # resolution logging)
+        self.track_rows = []
 
         # Define a dict to store own position data in
         self.ownposition = {}
+        # Own position when distances to all objects were last calculated
+        self.distance_origin = None
+        # Own positions and times used to estimate own speed and
+        # course, and when the GPS last gave them
+        self.ownmotion = collections.deque()
+        self.ownmotion_reported = 0
+
+        # Objects to calculate CPA for (or all objects in range) at the
+        # next calculation, objects with a CPA, and objects alerted for
+        # their CPA
+        self.cpa_dirty = set()
+        self.cpa_all = True
+        self.cpa_set = set()
+        self.cpa_alerted = set()
 
         # Define a dict to store remarks/alerts in
         self.remarkdict = {}
@@ -4154,39 +4426,53 @@ class MainThread:
                 owngeoref = None
             self.ownposition.update({'ownlatitude': ownlatitude, 'ownlongitude': ownlongitude, 'owngeoref': owngeoref})
 
-        # Create main database
-        self.db_main = pydblite.Base('dummy')
-        self.dbfields = ('mmsi', 'mid', 'imo',
-                         'name', 'type', 'typename',
-                         'callsign', 'latitude', 'longitude',
-                         'georef', 'creationtime', 'time',
-                         'sog', 'cog', 'heading',
-                         'destination', 'eta', 'length',
-                         'width', 'draught', 'rot',
-                         'navstatus', 'posacc', 'distance',
-                         'bearing', 'source', 'transponder_type'
-                         'old', 'soundalerted')
-        self.db_main.create(*self.dbfields, mode="override")
-        self.db_main.create_index('mmsi')
-
-        # Create ID database
-        self.db_iddb = pydblite.Base('dummy2')
-        self.db_iddb.create('mmsi', 'imo', 'name', 'callsign', mode="override")
-        self.db_iddb.create_index('mmsi')
-
-        # Try to load ID database
-        self.loadiddb()
+        # Create main database (the live vessels, by MMSI)
+        self.db_main = vesselstore.VesselStore()
+        self.dbfields = vesselstore.FIELDS
+
+        # Keep track of when objects were last updated, one wheel for
+        # objects that aren't old (to mark them as old) and one for
+        # all objects (to remove them)
+        self.active_wheel = expiry.TimeWheel()
+        self.all_wheel = expiry.TimeWheel()
+
+        # Keep track of where objects are, for area queries
+        self.positions = spatial.GridIndex()
+
+        # Keep the recent track of each object in memory
+        self.tracks = tracks.TrackStore(config['common'].as_int('trackpoints'),
+                                        config['common'].as_int('trackmemory') * 1024 * 1024)
+
+        # Create ID database, entries are read from the IDDB file when
+        # they are first needed
+        iddbfile = os.path.join(package_home(globals()), unicode(config['iddb_logging']['logfile'], 'utf-8'))
+        if config['iddb_logging'].as_bool('logging_on') or os.path.isfile(iddbfile):
+            self.iddb = iddb.IDDB(iddbfile)
+        else:
+            self.iddb = iddb.IDDB()
+
+        # The log file writer is started when first needed
+        self.logwriter = None
+        self.logwriter_settings = None
 
         # Try to load remark file
         self.loadremarkfile()
 
+        # Try to load zone file
+        self.zones = zones.ZoneIndex()
+        self.loadzonefile()
+
+        # Try to load rule file
+        self.rules = rules.RuleEngine()
+        self.loadrulefile()
+
     def DbUpdate(self, incoming_packet):
         self.incoming_packet = incoming_packet
         incoming_mmsi = self.incoming_packet['mmsi']
         new = False
 
         # Fetch the current data in DB for MMSI (if exists)
-        currentdata = self.db_main._mmsi[incoming_mmsi]
+        main_record = self.db_main.get(incoming_mmsi)
 
         # Define a dictionary to hold update data
         update_dict = {}
@@ -4217,7 +4503,7 @@ class MainThread:
                 return None
 
         # If not currently in DB, add the mmsi number, creation time and MID code
-        if len(currentdata) == 0:
+        if main_record is None:
             # Set variable to indicate a new object
             new = True
             # Map MMSI nbr to nation from MID list
@@ -4225,36 +4511,22 @@ class MainThread:
                 mid_code = mid[str(self.incoming_packet['mmsi'])[0:3]]
             else:
                 mid_code = None
-            self.db_main.insert(mmsi=incoming_mmsi,mid=mid_code,creationtime=self.incoming_packet['time'],
-                                time=self.incoming_packet['time'])
-            currentdata = self.db_main._mmsi[incoming_mmsi]
-
-        # Get the record so that we can address it
-        main_record = currentdata[0]
-
-        # Fetch current data in IDDB
-        iddb = self.db_iddb._mmsi[incoming_mmsi]
+            main_record = self.db_main.insert(incoming_mmsi,mid=mid_code,creationtime=self.incoming_packet['time'],
+                                              time=self.incoming_packet['time'])
 
         # Can we update the IDDB (is IMO in the incoming packet?)
         if 'imo' in self.incoming_packet:
-            # See if we have to insert first
-            if len(iddb) == 0:
-                self.db_iddb.insert(mmsi=incoming_mmsi)
-                # Fetch the newly inserted entry
-                iddb = self.db_iddb._mmsi[incoming_mmsi]
-            # Get the record so that we can address it
-            iddb_record = iddb[0]
             # Check if we have callsign or name in incoming_packet
             iddb_update = {}
             if 'callsign' in self.incoming_packet:
                 iddb_update['callsign'] = self.incoming_packet['callsign']
             if 'name' in self.incoming_packet:
                 iddb_update['name'] = self.incoming_packet['name']
-            # Make the update
-            # We know that we already have IMO, don't check for it
-            self.db_iddb.update(iddb_record,imo=self.incoming_packet['imo'],**iddb_update)
-            # We don't update iddb och iddb_record because there is no need, the info
-            # will not be used later anyway
+            # Make the update (only changed entries are written to file)
+            iddb_entry = self.iddb.update(incoming_mmsi,imo=self.incoming_packet['imo'],**iddb_update)
+        else:
+            # Fetch current data in IDDB
+            iddb_entry = self.iddb.get(incoming_mmsi)
 
         # Iterate over incoming and copy matching fields to update_dict
         for key, value in self.incoming_packet.iteritems():
@@ -4279,9 +4551,10 @@ class MainThread:
         # Calculate bearing and distance to object
         if 'ownlatitude' in self.ownposition and 'ownlongitude' in self.ownposition and 'latitude' in self.incoming_packet and 'longitude' in self.incoming_packet:
             try:
-                dist = VincentyDistance((self.ownposition['ownlatitude'],self.ownposition['ownlongitude']), (self.incoming_packet['latitude'],self.incoming_packet['longitude'])).all
-                update_dict['distance'] = decimal.Decimal(str(dist['km'])).quantize(decimal.Decimal('0.1'))
-                update_dict['bearing'] = decimal.Decimal(str(dist['bearing'])).quantize(decimal.Decimal('0.1'))
+                distance, bearing = geo.inverse(self.ownposition['ownlatitude'], self.ownposition['ownlongitude'],
+                                                self.incoming_packet['latitude'], self.incoming_packet['longitude'])
+                update_dict['distance'] = round(distance, 1)
+                update_dict['bearing'] = round(bearing, 1)
             except: pass
 
         # Filter destination field for numbers
@@ -4291,21 +4564,53 @@ class MainThread:
                 if not letter.isdigit():
                     update_dict['destination'] += letter
 
+        # See what fields change
+        changed = {}
+        for key, value in update_dict.iteritems():
+            if main_record[key] != value:
+                changed[key] = value
+        if main_record['old']:
+            changed['old'] = False
+
         # Update the DB with new data
         self.db_main.update(main_record,old=False,**update_dict)
+        # Update the expiry times
+        now = time.time()
+        self.active_wheel.touch(incoming_mmsi, now)
+        self.all_wheel.touch(incoming_mmsi, now)
+        # Calculate CPA again if the object has moved (or was old)
+        if 'latitude' in changed or 'longitude' in changed or 'sog' in changed or 'cog' in changed or 'old' in changed:
+            self.cpa_dirty.add(incoming_mmsi)
+        # Log the object at next log time
+        self.log_positions.add(incoming_mmsi)
+        if self.metadata_fields.intersection(changed):
+            self.log_metadata.add(incoming_mmsi)
+        # Update the position index
+        if update_dict.get('latitude') not in (None, 'N/A') and update_dict.get('longitude') not in (None, 'N/A'):
+            self.positions.update(incoming_mmsi, update_dict['latitude'], update_dict['longitude'])
+            self.tracks.add(incoming_mmsi, now, update_dict['latitude'], update_dict['longitude'],
+                            main_record['sog'], main_record['cog'])
+            # Log every position if full resolution logging is on
+            if config['logging'].as_bool('logging_on') and config['logging'].as_bool('fullresolution_on'):
+                if main_record['transponder_type'] != 'base' or config['logging'].as_bool('logbasestations'):
+                    self.track_rows.append(logdb.trackrow(now, incoming_mmsi, update_dict['latitude'], update_dict['longitude'],
+                                                          main_record['sog'], main_record['cog']))
 
         # Return a dictionary of iddb
-        if len(iddb) == 0:
-            iddb = {}
-        elif len(iddb) > 0:
-            iddb = iddb[0]
+        if iddb_entry is None:
+            iddb_entry = {}
 
-        # Return the updated object and the iddb entry
-        return self.db_main[main_record['__id__']].copy(), iddb.copy(), new
+        # Return the updated object, the iddb entry and the changed fields
+        return main_record, iddb_entry.copy(), new, False, changed
+
+    def UpdateMsg(self, record, iddb, new=False, query=False, changed=None):
+        # Send an insert, query or update message for the record.
+        # Updates only contain the changed fields (and MMSI, version and
+        # remark). Without changed fields a full update is sent, to
+        # resync the GUI's copy of the object.
 
-    def UpdateMsg(self, object_info, iddb, new=False, query=False):
         # See if we not should send message
-        transponder_type = object_info.get('transponder_type',None)
+        transponder_type = record.get('transponder_type',None)
         # See if we know the transponder type
         if transponder_type:
             # See if we display base stations
@@ -4319,58 +4624,115 @@ class MainThread:
             return
 
         # See if we have enough updates
-        if object_info['__version__'] < config['common'].as_int('showafterupdates'):
+        if record['__version__'] < config['common'].as_int('showafterupdates'):
             return
-        elif object_info['__version__'] == config['common'].as_int('showafterupdates') and query == False:
+        elif record['__version__'] == config['common'].as_int('showafterupdates') and query == False and changed is not None:
             new=True
 
+        # The fields that really changed (before MMSI and version are
+        # added to the message)
+        if changed is None:
+            changed_fields = None
+        else:
+            changed_fields = set(changed)
+
+        # See if the object has entered or left a zone. Queries only
+        # show the alert state, they don't change it.
+        entered = left = ()
+        if not query and len(self.zones) and (changed is None or 'latitude' in changed or 'longitude' in changed) \
+           and record['latitude'] not in (None, 'N/A') and record['longitude'] not in (None, 'N/A'):
+            entered, left = self.zones.check(record['mmsi'], record['latitude'], record['longitude'])
+
         # Define the dict we're going to send
         message = {}
 
+        # Get the data to send, all of it or only what has changed
+        if new or query or changed is None:
+            object_info = record.copy()
+        else:
+            object_info = changed
+            object_info['mmsi'] = record['mmsi']
+            object_info['__version__'] = record['__version__']
+
         # See if we need to use data from iddb
-        if object_info['imo'] is None and 'imo' in iddb and not iddb['imo'] is None:
+        if object_info.get('imo', 0) is None and 'imo' in iddb and not iddb['imo'] is None:
             object_info['imo'] = str(iddb['imo']) + "'"
-        if object_info['callsign'] is None and 'callsign' in iddb and not iddb['callsign'] is None:
+        if object_info.get('callsign', 0) is None and 'callsign' in iddb and not iddb['callsign'] is None:
             object_info['callsign'] = iddb['callsign'] + "'"
-        if object_info['name'] is None and 'name' in iddb and not iddb['name'] is None:
+        if object_info.get('name', 0) is None and 'name' in iddb and not iddb['name'] is None:
             object_info['name'] = iddb['name'] + "'"
 
         # Match against set alerts
-        remarks = self.remarkdict.get(object_info['mmsi'], [])
+        remarks = self.remarkdict.get(record['mmsi'], [])
         # Set initial values to False
         message['alert'] = False
         message['soundalert'] = False
+        # The soundalerted flag is set directly in the record, it
+        # isn't an update of the object (doesn't change the version)
+        soundalerted = record['soundalerted']
         # Check if we have silent alerts or sound alerts
         if len(remarks) == 2 and remarks[0] == 'A':
             # See if we need to compare the distance to the object
             if config['alert'].as_bool('maxdistance_on'):
-                if object_info['distance'] and object_info['distance'] <= config['alert'].as_int('maxdistance'):
+                if record['distance'] and record['distance'] <= config['alert'].as_int('maxdistance'):
                     message['alert'] = True
             else:
                 message['alert'] = True
         elif len(remarks) == 2 and remarks[0] == 'AS':
             # See if we need to compare the distance to the object
             if config['alert'].as_bool('maxdistance_on'):
-                if object_info['distance'] and object_info['distance'] <= config['alert'].as_int('maxdistance'):
+                if record['distance'] and record['distance'] <= config['alert'].as_int('maxdistance'):
                     message['alert'] = True
                 else:
                     # Update the DB with soundalerted flag set to false -
                     # we want it to alert the next time the object is within range
-                    main_record = self.db_main._mmsi[object_info['mmsi']][0]
-                    self.db_main.update(main_record,soundalerted=False)
-                if not object_info['soundalerted']:
+                    record['soundalerted'] = False
+                if not soundalerted:
                     message['soundalert'] = True
                     # Update the DB with soundalerted flag
-                    main_record = self.db_main._mmsi[object_info['mmsi']][0]
-                    self.db_main.update(main_record,soundalerted=True)
+                    record['soundalerted'] = True
             else:
                 message['alert'] = True
                 # If new object, set sound alert,
                 if new:
                     message['soundalert'] = True
                     # Update the DB with soundalerted flag
-                    main_record = self.db_main._mmsi[object_info['mmsi']][0]
-                    self.db_main.update(main_record,soundalerted=True)
+                    record['soundalerted'] = True
+
+        # Alert while the object is in a zone, and sound an alert when
+        # it enters a zone with sound alerts
+        if self.zones.zonesof(record['mmsi']):
+            message['alert'] = True
+        for zone in entered:
+            if zone.alert == 'AS':
+                message['soundalert'] = True
+
+        # Alert on objects that will pass close to own position
+        if config['alert'].as_bool('cpa_alert_on') and record['cpa'] is not None \
+           and record['cpa'] <= config['alert'].as_float('cpa_alert_distance') \
+           and 0 <= record['tcpa'] <= config['alert'].as_float('cpa_alert_time'):
+            message['alert'] = True
+            if not query and record['mmsi'] not in self.cpa_alerted:
+                self.cpa_alerted.add(record['mmsi'])
+                message['soundalert'] = True
+        elif not query:
+            self.cpa_alerted.discard(record['mmsi'])
+
+        # Evaluate the alert rules that depend on what has changed
+        if len(self.rules) and query:
+            if self.rules.matching.get(record['mmsi']):
+                message['alert'] = True
+        elif len(self.rules):
+            fields = changed_fields
+            if fields is not None and (entered or left):
+                fields.add('zones')
+            zonenames = set(zone.name for zone in self.zones.zonesof(record['mmsi']))
+            (matching, started) = self.rules.evaluate(record['mmsi'], record, fields, zonenames)
+            if matching or started:
+                message['alert'] = True
+            for rule in started:
+                if rule.alert == 'AS':
+                    message['soundalert'] = True
 
         # Match against set remarks
         if len(remarks) == 2 and len(remarks[1]):
@@ -4385,27 +4747,169 @@ class MainThread:
             message['query'] = object_info
         else:
             message['update'] = object_info
+            # Mark full updates, the others only have changed fields
+            if changed is None:
+                message['full'] = True
 
         # Call function to send message
         self.SendMsg(message)
 
+    def CheckDistanceOrigin(self, ownlatitude, ownlongitude):
+        # Recalculate distance and bearing to all objects if own
+        # position has moved more than the configured distance since
+        # the last time
+        if self.distance_origin is not None:
+            try:
+                moved = geo.inverse(self.distance_origin[0], self.distance_origin[1], ownlatitude, ownlongitude)[0]
+            except ValueError:
+                moved = None
+            if moved is not None and moved <= config['position'].as_float('distance_update'):
+                return
+        self.distance_origin = (ownlatitude, ownlongitude)
+        self.UpdateDistances()
+        # Own position affects the CPA of all objects
+        self.cpa_all = True
+
+    def UpdateDistances(self):
+        # Calculate distance and bearing from own position to all
+        # objects that aren't old in one go, and send updates for the
+        # objects where they changed
+        records = [ r for r in self.db_main if not r.old
+                    and r.latitude not in (None, 'N/A') and r.longitude not in (None, 'N/A') ]
+        if not records:
+            return
+        distances, bearings = geo.inverse_array(self.ownposition['ownlatitude'], self.ownposition['ownlongitude'],
+                                                [ r.latitude for r in records ], [ r.longitude for r in records ])
+        for (record, distance, bearing) in zip(records, distances.tolist(), bearings.tolist()):
+            if numpy.isnan(distance):
+                continue
+            changed = {'distance': round(distance, 1), 'bearing': round(bearing, 1)}
+            if record.distance == changed['distance'] and record.bearing == changed['bearing']:
+                continue
+            self.db_main.update(record, **changed)
+            self.UpdateMsg(record, self.GetIddb(record.mmsi), changed=changed)
+
+    def UpdateOwnMotion(self, ownlatitude, ownlongitude):
+        # Estimate own speed and course from the positions over the
+        # baseline, long enough for GPS jitter not to matter. Only
+        # used when the GPS doesn't give speed and course itself.
+        now = time.time()
+        self.ownmotion.append((ownlatitude, ownlongitude, now))
+        # Keep the newest position older than the baseline and the
+        # positions after it
+        while len(self.ownmotion) > 1 and now - self.ownmotion[1][2] >= self.ownmotion_baseline:
+            self.ownmotion.popleft()
+        (latitude, longitude, then) = self.ownmotion[0]
+        if now - then < self.ownmotion_baseline or now - self.ownmotion_reported < self.ownmotion_baseline:
+            return
+        try:
+            (ownsog, owncog) = cpa.ownmotion(latitude, longitude, then, ownlatitude, ownlongitude, now)
+        except ValueError:
+            return
+        self.SetOwnMotion(ownsog, owncog)
+
+    def SetOwnMotion(self, ownsog, owncog):
+        # Use a new own speed and course for CPA if it differs enough
+        # from the one used now
+        sog = self.ownposition.get('ownsog')
+        cog = self.ownposition.get('owncog')
+        if sog is not None and cog is not None:
+            turned = abs((owncog - cog + 180) % 360 - 180)
+            if abs(ownsog - sog) < self.ownmotion_sog and turned < self.ownmotion_cog:
+                return
+        self.ownposition.update({'ownsog': ownsog, 'owncog': owncog})
+        # Own motion affects the CPA of all objects
+        self.cpa_all = True
+
+    def UpdateCPA(self):
+        # Calculate CPA and TCPA for the objects within range that have
+        # moved since the last time (or all of them if own position
+        # has changed), and clear them for objects out of range
+        if self.ownposition.get('ownlatitude') is None or self.ownposition.get('ownlongitude') is None:
+            return
+        ownlatitude = self.ownposition['ownlatitude']
+        ownlongitude = self.ownposition['ownlongitude']
+        inrange = set(self.positions.radius(ownlatitude, ownlongitude, config['alert'].as_float('cpa_range')))
+        if self.cpa_all:
+            candidates = inrange
+        else:
+            candidates = inrange & self.cpa_dirty
+        self.cpa_all = False
+        self.cpa_dirty = set()
+        updates = {}
+        for mmsi in self.cpa_set - inrange:
+            updates[mmsi] = (None, None)
+        records = [ r for r in (self.db_main.get(mmsi) for mmsi in candidates) if r is not None ]
+        if records:
+            (cpas, tcpas) = cpa.cpa_array(ownlatitude, ownlongitude,
+                                          self.ownposition.get('ownsog', 0), self.ownposition.get('owncog', 0),
+                                          [ r.latitude for r in records ], [ r.longitude for r in records ],
+                                          [ r.sog for r in records ], [ r.cog for r in records ])
+            for (record, distance, time_to) in zip(records, cpas.tolist(), tcpas.tolist()):
+                if numpy.isnan(distance):
+                    updates[record.mmsi] = (None, None)
+                else:
+                    updates[record.mmsi] = (round(distance, 1), round(time_to, 1))
+        # Update the objects where CPA or TCPA changed
+        for (mmsi, (distance, time_to)) in updates.iteritems():
+            if distance is None:
+                self.cpa_set.discard(mmsi)
+            else:
+                self.cpa_set.add(mmsi)
+            record = self.db_main.get(mmsi)
+            if record is None or (record.cpa == distance and record.tcpa == time_to):
+                continue
+            # Old objects aren't sent to the GUI, so they aren't updated
+            # either (a new version would make the GUI resync them).
+            # They are calculated again when they are updated.
+            if record.old:
+                continue
+            changed = {'cpa': distance, 'tcpa': time_to}
+            self.db_main.update(record, **changed)
+            self.UpdateMsg(record, self.GetIddb(mmsi), changed=changed)
+
+    def GetTrack(self, mmsi):
+        # Return the recent track of the object as a list of (time,
+        # latitude, longitude, sog, cog), oldest first. Safe to call
+        # from the GUI thread.
+        return self.tracks.get(mmsi)
+
+    def GetIddb(self, mmsi):
+        # Return the IDDB entry for mmsi as a dict (empty if none)
+        entry = self.iddb.get(mmsi)
+        if entry is None:
+            return {}
+        return entry.copy()
+
     def CheckDBForOld(self):
         # Go through the DB and see if we can create 'remove' or
         # 'old' messages
 
-        # Calculate datetime objects to compare with
-        old_limit = datetime.datetime.now()-datetime.timedelta(seconds=config['common'].as_int('listmakegreytime'))
-        remove_limit = datetime.datetime.now()-datetime.timedelta(seconds=config['common'].as_int('deleteitemtime'))
+        # Calculate times to compare with
+        old_limit = time.time() - config['common'].as_int('listmakegreytime')
+        remove_limit = time.time() - config['common'].as_int('deleteitemtime')
 
-        # Compare objects in db against old_limit and remove_limit
-        old_objects = [ r for r in self.db_main
-                        if not r['old'] and r['time'] < old_limit ]
-        remove_objects = [ r for r in self.db_main
-                           if r['time'] < remove_limit ]
+        # Get the objects not updated since old_limit and remove_limit
+        # (only the expired objects are looked at)
+        old_objects = [ self.db_main.get(mmsi) for mmsi in self.active_wheel.expire(old_limit)
+                        if mmsi in self.db_main ]
+        remove_objects = [ self.db_main.get(mmsi) for mmsi in self.all_wheel.expire(remove_limit)
+                           if mmsi in self.db_main ]
+        for object in remove_objects:
+            self.active_wheel.remove(object['mmsi'])
+            self.positions.remove(object['mmsi'])
+            self.zones.remove(object['mmsi'])
+            self.rules.remove(object['mmsi'])
+            self.tracks.remove(object['mmsi'])
+            self.cpa_dirty.discard(object['mmsi'])
+            self.cpa_set.discard(object['mmsi'])
+            self.cpa_alerted.discard(object['mmsi'])
+            self.log_positions.discard(object['mmsi'])
+            self.log_metadata.discard(object['mmsi'])
 
         # Mark old as old in the DB and send messages
         for object in old_objects:
-            self.db_main[object['__id__']]['old'] = True
+            object['old'] = True
             self.SendMsg({'old': {'mmsi': object['mmsi'], 'distance': object['distance']}})
         # Delete removable objects in db
         self.db_main.delete(remove_objects)
@@ -4414,27 +4918,78 @@ class MainThread:
             self.SendMsg({'remove': object['mmsi']})
 
     def SendMsg(self, message):
-        # Puts message in queue for consumers to get
+        # Puts message in the outgoing lanes for consumers to get
+        if not self.gui:
+            return
+        self.outgoing_lock.acquire()
         try:
-            self.outgoing.put_nowait(message)
-        except Queue.Full:
-            self.outgoing.get_nowait()
-            self.outgoing.put_nowait(message)
+            if 'update' in message:
+                self.CoalesceUpdate(message)
+            else:
+                # Send a pending update for the same object first to
+                # keep the order of the messages
+                mmsi = None
+                for key in ('insert', 'old', 'query'):
+                    if key in message:
+                        mmsi = message[key]['mmsi']
+                if 'remove' in message:
+                    mmsi = message['remove']
+                if mmsi in self.outgoing_updates:
+                    self.AppendControl(self.outgoing_updates.pop(mmsi))
+                self.AppendControl(message)
+        finally:
+            self.outgoing_lock.release()
+
+    def AppendControl(self, message):
+        # Add a message to the control lane, dropping the oldest
+        # message if it is full. Call with outgoing_lock held.
+        if len(self.outgoing) >= self.maxoutgoing:
+            self.outgoing.popleft()
+            self.stats['dropped'] += 1
+        self.outgoing.append(message)
+
+    def CoalesceUpdate(self, message):
+        # Merge an update message with a pending update of the same
+        # object. A merged update has the changed fields of both, the
+        # latest version and in 'since' the version the first update
+        # applies to. Call with outgoing_lock held.
+        data = message['update']
+        pending = self.outgoing_updates.get(data['mmsi'])
+        if pending is None:
+            if not message.get('full', False):
+                message['since'] = data['__version__'] - 1
+            self.outgoing_updates[data['mmsi']] = message
+            return
+        if message.get('full', False):
+            # A full update replaces the pending one
+            pending['update'] = data
+            pending['full'] = True
+        else:
+            pending['update'].update(data)
+        # Use the latest alert state but don't lose a sound alert
+        pending['alert'] = message.get('alert', False)
+        if message.get('soundalert', False):
+            pending['soundalert'] = True
 
     def ReturnOutgoing(self):
-        # Return all messages in the outgoing queue
-        templist = []
+        # Return all outgoing messages, control messages first
+        self.outgoing_lock.acquire()
         try:
-            while True:
-                templist.append(self.outgoing.get_nowait())
-        except Queue.Empty:
-            return templist
+            templist = list(self.outgoing)
+            templist.extend(self.outgoing_updates.itervalues())
+            self.outgoing = collections.deque()
+            self.outgoing_updates = {}
+        finally:
+            self.outgoing_lock.release()
+        return templist
 
     def Main(self):
         # Set some timers
         lastchecktime = time.time()
         lastlogtime = time.time()
         lastiddblogtime = time.time()
+        lastcpatime = time.time()
+        lasttracklogtime = time.time()
         incoming = {}
         # See if we should send a own position before looping
         if self.ownposition:
@@ -4447,12 +5002,27 @@ class MainThread:
                 # Prevent CPU drain if nothing to do
                 time.sleep(0.05)
                 incoming = {}
-            if incoming == 'stop': break
+            if incoming == 'stop':
+                # Write the last IDDB changes
+                if config['iddb_logging'].as_bool('logging_on'):
+                    self.iddblog()
+                # Let the log writer finish
+                if self.track_rows:
+                    self.tracklog()
+                if self.logwriter:
+                    self.logwriter.stop()
+                    self.logwriter.join()
+                break
             # Check if incoming contains a MMSI number
             if 'mmsi' in incoming and incoming['mmsi'] > 1:
                 update = self.DbUpdate(incoming)
                 if update:
                     self.UpdateMsg(*update)
+            # If the GUI has lost track of an object, send all of it
+            elif 'resync' in incoming:
+                record = self.db_main.get(incoming['resync'])
+                if record:
+                    self.UpdateMsg(record, self.GetIddb(incoming['resync']))
             # If incoming got own position data, use it
             elif 'ownlatitude' in incoming and 'ownlongitude' in incoming and not config['position'].as_bool('override_on'):
                 ownlatitude = incoming['ownlatitude']
@@ -4464,33 +5034,30 @@ class MainThread:
                 self.ownposition.update({'ownlatitude': ownlatitude, 'ownlongitude': ownlongitude, 'owngeoref': owngeoref})
                 # Send a position update
                 self.SendMsg({'own_position': self.ownposition})
+                # Recalculate distances if we have moved far enough
+                if ownlatitude is not None and ownlongitude is not None:
+                    self.CheckDistanceOrigin(ownlatitude, ownlongitude)
+                    # Use speed and course from the GPS if it gives them
+                    if 'ownsog' in incoming and 'owncog' in incoming:
+                        self.ownmotion_reported = time.time()
+                        self.SetOwnMotion(float(incoming['ownsog']), float(incoming['owncog']))
+                    else:
+                        self.UpdateOwnMotion(ownlatitude, ownlongitude)
             # If incoming has special attributes
             elif 'query' in incoming and incoming['query'] > 0:
                 # Fetch the current data in DB for MMSI
-                query = self.db_main._mmsi[incoming['query']]
-                # Return a dictionary of query
-                if len(query) == 0:
-                    query = {}
-                elif len(query) > 0:
-                    query = query[0]
-                # Fetch current data in IDDB
-                iddb = self.db_iddb._mmsi[incoming['query']]
-                # Return a dictionary of iddb
-                if len(iddb) == 0:
-                    iddb = {}
-                elif len(iddb) > 0:
-                    iddb = iddb[0]
+                query = self.db_main.get(incoming['query'])
                 # Send the message
-                self.UpdateMsg(query, iddb, query=True)
+                if query:
+                    self.UpdateMsg(query, self.GetIddb(incoming['query']), query=True)
             # If the remark/alert dict is asked for
             elif 'remarkdict_query' in incoming:
                 # Send a copy of the remark/alert dict
                 self.SendMsg({'remarkdict': self.remarkdict.copy()})
             # If the IDDB is asked for
             elif 'iddb_query' in incoming:
-                iddb = [ r for r in self.db_iddb ]
-                # Send a copy of the remark/alert dict
-                self.SendMsg({'iddb': iddb})
+                # Send all entries in the IDDB
+                self.SendMsg({'iddb': self.iddb.all()})
             # If we should update our remark/alert dict
             elif 'update_remarkdict' in incoming:
                 self.remarkdict = incoming['update_remarkdict']
@@ -4498,6 +5065,11 @@ class MainThread:
             elif 'error' in incoming:
                 self.SendMsg(incoming)
 
+            # Calculate CPA for objects that have moved
+            if lastcpatime + config['common'].as_int('updatetime') < time.time():
+                self.UpdateCPA()
+                lastcpatime = time.time()
+
             # Remove or mark objects as old if last update time is above threshold
             if lastchecktime + 10 < time.time():
                 self.CheckDBForOld()
@@ -4510,6 +5082,13 @@ class MainThread:
                     self.dblog()
                     lastlogtime = time.time()
 
+            # Send full resolution positions to the log writer when a
+            # batch is full, or at least every second
+            if self.track_rows:
+                if len(self.track_rows) >= logdb.TRACKBATCH or lasttracklogtime + 1 < time.time():
+                    self.tracklog()
+                    lasttracklogtime = time.time()
+
             # Initiate iddb logging if current time is > (lastlogtime + logtime)
             if config['iddb_logging'].as_bool('logging_on'):
                 if config['iddb_logging'].as_int('logtime') == 0: pass
@@ -4518,133 +5097,62 @@ class MainThread:
                     lastiddblogtime = time.time()
 
     def dblog(self):
-        # Make a query for the metadata, but return only rows where IMO
-        # has a value, and make a MD5 hash out of the data
-        newhashdict = {}
-        for r in self.db_main:
-            if r['imo']:
-                # If base station, see if we should log it
-                if r['transponder_type'] == 'base' and not config['logging'].as_bool('logbasestations'):
-                    continue
-                # Make of string of these fields
-                infostring = str((r['imo'], r['name'], r['type'],
-                                  r['callsign'], r['destination'],
-                                  r['eta'], r['length'], r['width']))
-                # Add info in dict as {mmsi: MD5-hash}
-                hash = hashlib.md5()
-                hash.update(infostring)
-                newhashdict[r['mmsi']] = hash.digest()
-        # Check what objects we should update in the metadata table
-        update_mmsi = []
-        for (key, value) in newhashdict.iteritems():
-            # Check if we have logged this MMSI number before
-            if key in self.hashdict:
-                # Compare the hashes, if different: add to update list
-                if cmp(value, self.hashdict[key]):
-                    update_mmsi.append(key)
-            else:
-                # The MMSI was new, add to update list
-                update_mmsi.append(key)
-        # Set self.hashdict to the new hash dict
-        self.hashdict = newhashdict
-        # Query the memory DB
+        # Log the objects that have changed since last time. Positions
+        # are logged for all updated objects, metadata only for objects
+        # with an IMO number.
+        logbasestations = config['logging'].as_bool('logbasestations')
         positionquery = []
-        # Calculate the oldest time we allow an object to have
-        threshold = datetime.datetime.now() - datetime.timedelta(seconds=config['logging'].as_int('logtime'))
-        # Iterate over all objects in db_main
-        for r in self.db_main:
+        for mmsi in self.log_positions:
+            r = self.db_main.get(mmsi)
             # If base station, see if we should log it
-            if r['transponder_type'] == 'base' and not config['logging'].as_bool('logbasestations'):
+            if r is None or (r['transponder_type'] == 'base' and not logbasestations):
                 continue
-            # If object is newer than threshold, get data
-            if r['time'] > threshold:
-                data = [r['time'].replace(microsecond=0).isoformat(), r['mmsi'], r['latitude'],
-                        r['longitude'], r['georef'], r['sog'],
-                        r['cog']]
-                # Set all fields contaning value 'N/A' to Nonetype
-                # (it's ugly, I know...)
-                # Also convert decimal type to float
-                for (i, v) in enumerate(data):
-                    if v == 'N/A':
-                        data[i] = None
-                    elif type(v) == decimal.Decimal:
-                        data[i] = float(v)
-                positionquery.append(data)
+            positionquery.append(logdb.positionrow(r))
         # Sort in chronological order (by time)
         positionquery.sort()
         metadataquery = []
-        # Iterate over the objects we should update in metadata
-        for mmsi in update_mmsi:
-            # Get only the first list (should be only one anyway)
-            r = self.db_main._mmsi[mmsi][0]
-            data = [r['time'].replace(microsecond=0).isoformat(), r['mmsi'], r['imo'],
-                    r['name'], r['type'], r['callsign'],
-                    r['destination'], r['eta'], r['length'],
-                    r['width']]
-            # Remove any 'N/A' with Nonetype (ugly, I know...)
-            for (i, v) in enumerate(data):
-                if v == 'N/A':
-                    data[i] = None
-            metadataquery.append(data)
+        for mmsi in self.log_metadata:
+            r = self.db_main.get(mmsi)
+            if r is None or not r['imo']:
+                continue
+            if r['transponder_type'] == 'base' and not logbasestations:
+                continue
+            metadataquery.append(logdb.metadatarow(r))
         # Sort in chronological order (by time)
         metadataquery.sort()
-        # Open the file and log
-        try:
-            # Open file with filename in config['logging']['logfile']
-            connection = sqlite.connect(os.path.join(package_home(globals()), unicode(config['logging']['logfile'], 'utf-8')))
-            cursor = connection.cursor()
-            # Create tables if they don't exist
-            cursor.execute("CREATE TABLE IF NOT EXISTS position (time, mmsi, latitude, longitude, georef, sog, cog);")
-            cursor.execute("CREATE TABLE IF NOT EXISTS metadata (time, mmsi, imo, name, type, callsign, destination, eta, length, width);")
-            # Log to the two tables
-            cursor.executemany("INSERT INTO position (time, mmsi, latitude, longitude, georef, sog, cog) VALUES (?, ?, ?, ?, ?, ?, ?)", positionquery)
-            cursor.executemany("INSERT INTO metadata (time, mmsi, imo, name, type, callsign, destination, eta, length, width) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", metadataquery)
-            # Commit changes and close file
-            connection.commit()
-            connection.close()
-        except:
-            logging.warning("Logging to disk failed", exc_info=True)
+        # Start over with the next changes
+        self.log_positions = set()
+        self.log_metadata = set()
+        # Hand the rows to the log writer thread
+        self.GetLogWriter().put({'position': positionquery, 'metadata': metadataquery})
+
+    def tracklog(self):
+        # Hand the collected position reports to the log writer thread
+        self.GetLogWriter().put({'track': self.track_rows})
+        self.track_rows = []
+
+    def GetLogWriter(self):
+        # Return the log writer, (re)start it if the log file settings
+        # have changed
+        settings = {'filename': os.path.join(package_home(globals()), unicode(config['logging']['logfile'], 'utf-8')),
+                    'partition': config['logging']['partition'],
+                    'retention': config['logging'].as_int('retention'),
+                    'vacuum': config['logging'].as_bool('vacuum_on')}
+        if self.logwriter and self.logwriter_settings != settings:
+            # Let the old writer finish before the file is opened again
+            self.logwriter.stop()
+            if not self.logwriter.join():
+                logging.warning("The old log writer didn't finish in %(seconds)d seconds" %{'seconds': logdb.STOPWAIT})
+            self.logwriter = None
+        if not self.logwriter:
+            self.logwriter = logdb.LogWriter(**settings)
+            self.logwriter_settings = settings
+            self.logwriter.start()
+        return self.logwriter
 
     def iddblog(self):
-        # Query the memory iddb
-        iddbquery = []
-        for r in self.db_iddb:
-            iddbquery.append((r['mmsi'], r['imo'], r['name'], r['callsign']))
-        # Open the file and log
-        try:
-            # Open file with filename in config['iddb_logging']['logfile']
-            connection = sqlite.connect(os.path.join(package_home(globals()), unicode(config['iddb_logging']['logfile'], 'utf-8')))
-            cursor = connection.cursor()
-            # Create table if it doesn't exist
-            cursor.execute("CREATE TABLE IF NOT EXISTS iddb (mmsi PRIMARY KEY, imo, name, callsign);")
-            # Log
-            cursor.executemany("INSERT OR REPLACE INTO iddb (mmsi, imo, name, callsign) VALUES (?, ?, ?, ?)", iddbquery)
-            # Commit changes and close file
-            connection.commit()
-            connection.close()
-        except:
-            logging.warning("Logging IDDB to disk failed", exc_info=True)
-
-    def loadiddb(self):
-        # See if an iddb logfile exists, if not, return
-        try:
-            dbfile = open(os.path.join(package_home(globals()), unicode(config['iddb_logging']['logfile'], 'utf-8')))
-            dbfile.close()
-        except: return
-        try:
-            # Open the db
-            connection = sqlite.connect(os.path.join(package_home(globals()), unicode(config['iddb_logging']['logfile'], 'utf-8')))
-            cursor = connection.cursor()
-            # Select data from table iddb
-            cursor.execute("SELECT * FROM iddb;",())
-            iddb_data = cursor.fetchall()
-            # Close connection
-            connection.close()
-            # Put iddb_data in the memory db
-            for ship in iddb_data:
-                self.db_iddb.insert(mmsi=int(ship[0]), imo=ship[1], name=ship[2], callsign=ship[3])
-        except:
-            logging.warning("Reading from IDDB file failed", exc_info=True)
+        # Write the IDDB entries that have changed since last time
+        self.iddb.flush()
 
     def loadremarkfile(self):
         # This function will try to read a remark/alert file, if defined in config
@@ -4665,13 +5173,43 @@ class MainThread:
             except:
                 logging.warning("Reading from remark file failed", exc_info=True)
 
-    def put(self, item):
+    def loadzonefile(self):
+        # This function will try to read a zone file, if defined in config
+        path = unicode(config['alert']['zonefile'], 'utf-8')
+        if config['alert'].as_bool('zonefile_on') and len(path) > 0:
+            try:
+                file = open(os.path.join(package_home(globals()), path), 'rb')
+                self.zones = zones.ZoneIndex(zones.readzones(file))
+                file.close()
+            except:
+                logging.warning("Reading from zone file failed", exc_info=True)
+
+    def loadrulefile(self):
+        # This function will try to read a rule file, if defined in config
+        path = unicode(config['alert']['rulefile'], 'utf-8')
+        if config['alert'].as_bool('rulefile_on') and len(path) > 0:
+            try:
+                file = open(os.path.join(package_home(globals()), path), 'rb')
+                self.rules = rules.RuleEngine(rules.readrules(file), self.dbfields)
+                file.close()
+            except:
+                logging.warning("Reading from rule file failed", exc_info=True)
+
+    def put(self, item, block=False):
+        # A blocking put waits for room in the queue instead of
+        # dropping the oldest item
+        if block:
+            self.queue.put(item)
+            return
         try:
             self.queue.put_nowait(item)
         except Queue.Full:
             self.queue.get_nowait()
             self.queue.put_nowait(item)
 
+    def ReturnStats(self):
+        return self.stats
+
     def start(self):
         try:
             r = threading.Thread(target=self.Main)
@@ -4694,8 +5232,26 @@ class MainThread:
 main_thread = MainThread()
 comm_hub_thread = CommHubThread()
 serial_thread = SerialThread()
-network_server_thread = NetworkServerThread()
+network_server_thread = NetworkServerThread(config['network']['server_address'],
+                                            config['network'].as_int('server_port'),
+                                            config['network']['server_filter'])
+# Relay servers, with the config section as name
+relay_server_threads = {}
+for section in config.iterkeys():
+    if section.startswith('relay_'):
+        try:
+            if not config[section].as_bool('relay_on'):
+                continue
+            relay_server_threads[section] = NetworkServerThread(config[section]['address'],
+                                                                config[section].as_int('port'),
+                                                                config[section].get('filter', ''),
+                                                                'Relay ' + section[6:])
+        except (KeyError, ValueError):
+            logging.error("Invalid settings for relay server %(relay)s" %{'relay': section[6:]}, exc_info=True)
 network_client_thread = NetworkClientThread()
+raw_archive = archive.RawArchive(os.path.join(package_home(globals()), unicode(config['raw_archive']['directory'], 'utf-8')),
+                                 config['raw_archive']['rotation'],
+                                 config['raw_archive']['compression'])
 
 # Set up loggers and logging handling
 logger = logging.getLogger()
@@ -4741,7 +5297,24 @@ comm_hub_thread.start()
 serial_thread.start()
 if config['network'].as_bool('server_on'):
     network_server_thread.start()
+for relay_server_thread in relay_server_threads.itervalues():
+    relay_server_thread.start()
 network_client_thread.start()
+if config['raw_archive'].as_bool('archive_on'):
+    raw_archive.start()
+
+# See if we should replay a raw data file
+if cmdlineoptions.replayfile:
+    def replayrunner():
+        raw_replay = replay.RawReplay(cmdlineoptions.replayfile, lambda item: comm_hub_thread.put(item, block=True), cmdlineoptions.replayspeed)
+        try:
+            raw_replay.run()
+            logging.info("Replay of %(file)s finished: %(throughput)s" %{'file': cmdlineoptions.replayfile, 'throughput': raw_replay.Throughput()})
+        except IOError:
+            logging.error("Could not replay file %(file)s" %{'file': cmdlineoptions.replayfile}, exc_info=True)
+    replay_thread = threading.Thread(target=replayrunner, name='Replay')
+    replay_thread.setDaemon(1)
+    replay_thread.start()
 
 # Start the GUI
 # Wait some time before initiating, to let the threads settle
@@ -4764,10 +5337,20 @@ else:
 sys.stderr = open(os.devnull)
 # Stop threads
 comm_hub_thread.stop()
+# Report messages the serial server had to drop
+serial_stats = serial_thread.ReturnStats()
+if sum(serial_stats['dropped'].values()):
+    logging.warning("Serial server dropped messages (position: %(position)d, static: %(static)d, other: %(other)d, binary: %(binary)d)" %serial_stats['dropped'])
 serial_thread.stop()
 network_server_thread.stop()
+for relay_server_thread in relay_server_threads.itervalues():
+    relay_server_thread.stop()
 network_client_thread.stop()
+# Report messages the GUI didn't get in time
+if main_thread.ReturnStats()['dropped']:
+    logging.warning("Dropped %(dropped)d messages to the GUI" %main_thread.ReturnStats())
 main_thread.stop()
+raw_archive.stop()
 
 # Set exit time
 exittime = time.time()
@@ -4782,7 +5365,7 @@ while True:
     # Check for exit conditions, either that only one thread remains
     # or that we have timed out. The timeout prevents the process from
     # not terminating properly.
-    if nrofthreads > 1 and (exittime + 30) > time.time():
+    if nrofthreads > 1 and (exittime + max(30, logdb.STOPWAIT)) > time.time():
         pass
     else:
         break
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# predict.py (part of "AIS Logger")
+# Dead reckoning of object positions between reports
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import math
+import unittest
+import numpy
+
+# Kilometers per degree of latitude (60 nautical miles)
+KM_PER_DEGREE = 60 * 1.852
+# Below this turn rate (degrees per minute) objects go straight
+MIN_TURN = 0.1
+# Turn rates from this up are the decoder's "turning fast, rate
+# unknown" values (708 for ROTais 126, 720 for a full turn indicator),
+# not real rates, so such objects go straight
+MAX_TURN = 708
+
+
+def number(value):
+    # Return the value as a float, None if it isn't a number
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Predictor(object):
+    # Predicts the positions of moving objects from their last reported
+    # position, speed, course and rate of turn.
+    #
+    # The reports are kept in numpy arrays, one slot for each object,
+    # so that the positions of all objects are predicted in one go.
+    # Objects going slower than minspeed (knots) aren't predicted, and
+    # no object is predicted more than maxage seconds after its report.
+
+    def __init__(self, maxage=300, minspeed=0.5, size=1024):
+        self.maxage = maxage
+        self.minspeed = minspeed
+        # Key -> slot, and the free slots
+        self.slots = {}
+        self.free = range(size - 1, -1, -1)
+        self.keys = [None] * size
+        self.times = numpy.zeros(size)
+        self.lats = numpy.zeros(size)
+        self.lons = numpy.zeros(size)
+        self.sogs = numpy.zeros(size)
+        self.cogs = numpy.zeros(size)
+        self.rots = numpy.zeros(size)
+        self.used = numpy.zeros(size, dtype=bool)
+
+    def report(self, key, time, latitude, longitude, sog, cog, rot=None):
+        # Set the last report of an object, time in seconds
+        latitude, longitude = number(latitude), number(longitude)
+        sog, cog, rot = number(sog), number(cog), number(rot)
+        if latitude is None or longitude is None or sog is None or cog is None or sog < self.minspeed:
+            self.remove(key)
+            return
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.allocate(key)
+        self.times[slot] = time
+        self.lats[slot] = latitude
+        self.lons[slot] = longitude
+        self.sogs[slot] = sog
+        self.cogs[slot] = cog
+        if rot is None or abs(rot) >= MAX_TURN:
+            rot = 0.0
+        self.rots[slot] = rot
+
+    def allocate(self, key):
+        # Return a free slot for the key, grow the arrays if needed
+        if not self.free:
+            size = len(self.keys)
+            self.free = range(size * 2 - 1, size - 1, -1)
+            self.keys.extend([None] * size)
+            for name in ('times', 'lats', 'lons', 'sogs', 'cogs', 'rots', 'used'):
+                array = getattr(self, name)
+                setattr(self, name, numpy.concatenate((array, numpy.zeros_like(array))))
+        slot = self.free.pop()
+        self.slots[key] = slot
+        self.keys[slot] = key
+        self.used[slot] = True
+        return slot
+
+    def remove(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.keys[slot] = None
+            self.used[slot] = False
+            self.free.append(slot)
+
+    def predict(self, now):
+        # Return the predicted positions at time now (seconds) as a list
+        # of (key, latitude, longitude, course) for the objects reported
+        # less than maxage seconds ago
+        age = now - self.times
+        (slots,) = numpy.nonzero(self.used & (age >= 0) & (age <= self.maxage))
+        if not len(slots):
+            return []
+        minutes = age[slots] / 60
+        # Distance travelled in km per minute
+        speed = self.sogs[slots] * 1.852 / 60
+        course = numpy.radians(self.cogs[slots])
+        turn = numpy.radians(self.rots[slots])
+        turning = numpy.abs(self.rots[slots]) >= MIN_TURN
+        newcourse = course + numpy.where(turning, turn, 0) * minutes
+        # Straight line, or an arc with the rate of turn
+        safeturn = numpy.where(turning, turn, 1.0)
+        east = numpy.where(turning, speed / safeturn * (numpy.cos(course) - numpy.cos(newcourse)),
+                           speed * minutes * numpy.sin(course))
+        north = numpy.where(turning, speed / safeturn * (numpy.sin(newcourse) - numpy.sin(course)),
+                            speed * minutes * numpy.cos(course))
+        lats = self.lats[slots] + north / KM_PER_DEGREE
+        lons = self.lons[slots] + east / (KM_PER_DEGREE * numpy.cos(numpy.radians(self.lats[slots])))
+        lons = (lons + 180) % 360 - 180
+        courses = numpy.degrees(newcourse) % 360
+        keys = self.keys
+        return [ (keys[slot], lat, lon, c) for (slot, lat, lon, c) in
+                 zip(slots.tolist(), lats.tolist(), lons.tolist(), courses.tolist()) ]
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+
+
+class TestPredictor(unittest.TestCase):
+    def testpredict(self):
+        predictor = Predictor(maxage=1800)
+        # North at 12 knots: 6 nm (0.1 degrees) in 30 minutes
+        predictor.report('north', 0, 57.0, 11.0, 12, 0)
+        # East at 12 knots at the equator
+        predictor.report('east', 0, 0.0, 11.0, 12, 90)
+        predictor.report('still', 0, 57.0, 11.0, 0, 0)
+        predictor.report('unknown', 0, 57.0, 11.0, None, 0)
+        predicted = dict((p[0], p[1:]) for p in predictor.predict(1800))
+        self.assertEqual(sorted(predicted), ['east', 'north'])
+        self.assertAlmostEqual(predicted['north'][0], 57.1, 6)
+        self.assertAlmostEqual(predicted['north'][1], 11.0, 6)
+        self.assertAlmostEqual(predicted['east'][1], 11.1, 6)
+        # Too old
+        self.assertEqual(predictor.predict(1801), [])
+
+    def testturn(self):
+        # Turning 6 degrees a minute for 30 minutes, half a circle
+        predictor = Predictor(maxage=1800)
+        predictor.report(1, 0, 0.0, 0.0, 12, 0, 6)
+        (key, lat, lon, course) = predictor.predict(1800)[0]
+        self.assertAlmostEqual(course, 180, 6)
+        # Back at the start latitude, twice the radius east
+        radius = 12 * 1.852 / 60 / math.radians(6)
+        self.assertAlmostEqual(lat, 0, 6)
+        self.assertAlmostEqual(lon * KM_PER_DEGREE, 2 * radius, 6)
+
+    def testunknownturn(self):
+        # Full turn rates and missing values go straight
+        predictor = Predictor(maxage=1800)
+        for (key, rot) in enumerate((720, -720, 708, 'N/A', None)):
+            predictor.report(key, 0, 0.0, 0.0, 12, 90, rot)
+        for (key, lat, lon, course) in predictor.predict(600):
+            self.assertAlmostEqual(course, 90, 6)
+            self.assertAlmostEqual(lat, 0, 6)
+            self.assertAlmostEqual(lon * KM_PER_DEGREE, 12 * 1.852 / 6, 6)
+
+    def testslots(self):
+        predictor = Predictor(size=2)
+        for key in range(5):
+            predictor.report(key, 0, 57.0, 11.0, 10, 0)
+        self.assertEqual(len(predictor), 5)
+        predictor.report(2, 0, 57.0, 11.0, 0, 0)
+        self.assertFalse(2 in predictor)
+        predictor.report(5, 0, 57.0, 11.0, 10, 0)
+        self.assertEqual(sorted(p[0] for p in predictor.predict(10)), [0, 1, 3, 4, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,912 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# relay.py (part of "AIS Logger")
+# Relaying of raw (unparsed) data to outputs
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import time
+import logging
+import threading
+import collections
+import socket, select, errno
+import decimal
+import unittest
+
+import geo
+
+# Message classes, keyed on the first character of the AIVDM payload
+# (which gives the message number)
+MESSAGE_CLASSES = {'1': 'position', '2': 'position', '3': 'position',
+                   '4': 'position', '9': 'position', 'B': 'position',
+                   'C': 'position', 'K': 'position',
+                   '5': 'static', 'H': 'static',
+                   '6': 'binary', '7': 'binary', '8': 'binary',
+                   'I': 'binary', 'J': 'binary'}
+
+# Default priority of message classes, highest priority first
+PRIORITY = ('position', 'static', 'other', 'binary')
+
+
+class MessageClassifier(object):
+    # Classifies raw sentences as position, static, binary or other
+    # messages. Fragments of multipart messages only carry the message
+    # number in the first fragment, so the class is remembered by
+    # sequential message id and channel for the following fragments.
+
+    def __init__(self):
+        self.multipart = {}
+
+    def classify(self, data):
+        if not data.startswith('!AIVD'):
+            return 'other'
+        fields = data.split(',')
+        try:
+            count, number, seqid, channel, payload = fields[1:6]
+        except ValueError:
+            return 'other'
+        if number == '1' or count == '1':
+            message_class = MESSAGE_CLASSES.get(payload[:1], 'other')
+            if count != '1':
+                self.multipart[(seqid, channel)] = message_class
+            return message_class
+        else:
+            return self.multipart.get((seqid, channel), 'other')
+
+
+class OutputBuffer(object):
+    # A byte budgeted buffer for a slow output such as a serial port.
+    #
+    # Sentences are queued per message class. When more than maxbytes
+    # are buffered, the oldest sentences of the lowest priority class
+    # are dropped first, so a slow link keeps sending what matters
+    # most. take() returns queued sentences in arrival order, up to a
+    # given number of bytes, to be written in one go.
+    #
+    # Statistics are kept on bytes queued, written and buffered and on
+    # dropped sentences per message class.
+
+    def __init__(self, maxbytes, priority=PRIORITY):
+        self.maxbytes = maxbytes
+        # Use the default order for classes not in the priority list
+        self.priority = [c for c in priority if c in PRIORITY] + [c for c in PRIORITY if c not in priority]
+        self.classifier = MessageClassifier()
+        self.queues = dict((c, collections.deque()) for c in PRIORITY)
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.buffered = 0
+        self.stats = {'queued': 0, 'written': 0, 'buffered': 0,
+                      'dropped': dict((c, 0) for c in PRIORITY)}
+
+    def put(self, data):
+        self.lock.acquire()
+        try:
+            message_class = self.classifier.classify(data)
+            self.sequence += 1
+            self.queues[message_class].append((self.sequence, data))
+            self.buffered += len(data)
+            self.stats['queued'] += len(data)
+            # Drop from the lowest priority classes until below limit
+            for drop_class in reversed(self.priority):
+                queue = self.queues[drop_class]
+                while queue and self.buffered > self.maxbytes:
+                    self.buffered -= len(queue.popleft()[1])
+                    self.stats['dropped'][drop_class] += 1
+                if self.buffered <= self.maxbytes:
+                    break
+        finally:
+            self.lock.release()
+
+    def take(self, budget, atleastone=False):
+        # Return buffered sentences in arrival order, at most budget
+        # bytes. With atleastone, the first sentence is returned even
+        # if it's longer than the budget.
+        lines = []
+        size = 0
+        self.lock.acquire()
+        try:
+            heads = [q for q in self.queues.itervalues() if q]
+            while heads:
+                queue = min(heads, key=lambda q: q[0][0])
+                length = len(queue[0][1])
+                if size + length > budget and (lines or not atleastone):
+                    break
+                lines.append(queue.popleft()[1])
+                size += length
+                if not queue:
+                    heads.remove(queue)
+            self.buffered -= size
+        finally:
+            self.lock.release()
+        return ''.join(lines)
+
+    def Written(self, nbytes):
+        # Record bytes successfully written to the output
+        self.stats['written'] += nbytes
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            for queue in self.queues.itervalues():
+                queue.clear()
+            self.buffered = 0
+        finally:
+            self.lock.release()
+
+    def ReturnStats(self):
+        self.stats['buffered'] = self.buffered
+        return self.stats
+
+
+class ByteBudget(object):
+    # Keeps track of how many bytes may be written to a link at the
+    # given rate (bytes per second), allowing bursts of up to burst
+    # seconds worth of data
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.maximum = rate * burst
+        self.allowance = self.maximum
+        self.last = time.time()
+
+    def available(self):
+        now = time.time()
+        self.allowance = min(self.maximum, self.allowance + (now - self.last) * self.rate)
+        self.last = now
+        return int(self.allowance)
+
+    def spend(self, nbytes):
+        self.allowance -= nbytes
+
+    def full(self):
+        # True if a whole burst may be sent. Then a sentence longer than
+        # the burst should be let through (going into debt), or it
+        # would never be sent.
+        return self.allowance >= self.maximum
+
+
+def baudrate_budget(baudrate):
+    # Bytes per second on a serial link (8N1 uses ten bits per byte)
+    return int(baudrate) / 10
+
+
+
+def payload(line):
+    # Return the payload of an AIVDM sentence, or the whole line for
+    # other sentences
+    fields = line.split(',')
+    if line.startswith('!') and len(fields) > 5:
+        return fields[5]
+    return line
+
+
+class Deduplicator(object):
+    # Transform that drops messages already relayed within the last
+    # window seconds, such as the same message heard by two receivers.
+    # Messages are compared on their payload only, so the channel and
+    # sequential message id may differ.
+
+    def __init__(self, window=10, maxsize=100000):
+        self.window = window
+        self.maxsize = maxsize
+        self.seen = collections.OrderedDict()
+
+    def __call__(self, data, message):
+        now = time.time()
+        # Forget payloads seen before the window (the oldest first)
+        seen = self.seen
+        while seen:
+            key, first = next(seen.iteritems())
+            if first > now - self.window and len(seen) < self.maxsize:
+                break
+            del seen[key]
+        key = ''.join([payload(line) for line in data.splitlines()])
+        if key in seen:
+            return False
+        seen[key] = now
+        return True
+
+
+# Decoded message numbers that are position reports
+POSITION_MESSAGES = set(['1', '2', '3', '4', '9', '18', '19', '27'])
+
+
+class RateLimiter(object):
+    # Transform that passes at most one position report per vessel
+    # every interval seconds. Other messages (such as static data) and
+    # the first position report from a vessel always pass.
+    #
+    # The time of the last passed position report is kept per MMSI in
+    # the order it was passed, so vessels not heard from in expiry
+    # seconds (normally the time before objects are deleted) can be
+    # forgotten from the front. Both checks and expiry are O(1).
+
+    def __init__(self, interval=30, expiry=3600):
+        self.interval = interval
+        self.expiry = expiry
+        self.forwarded = collections.OrderedDict()
+
+    def __call__(self, data, message):
+        if message is None or message.get('message') not in POSITION_MESSAGES:
+            return True
+        return self.check(message.get('mmsi'), time.time())
+
+    def check(self, mmsi, now):
+        # See if a position report from mmsi at time now should pass
+        forwarded = self.forwarded
+        # Forget vessels not forwarded within the expiry time
+        while forwarded:
+            oldest_mmsi, oldest = next(forwarded.iteritems())
+            if oldest > now - self.expiry:
+                break
+            del forwarded[oldest_mmsi]
+        last = forwarded.get(mmsi)
+        if last is not None:
+            if last > now - self.interval:
+                return False
+            del forwarded[mmsi]
+        forwarded[mmsi] = now
+        return True
+
+
+# Transforms that can be used in a transform chain, with the type of
+# their optional argument and the options they take
+TRANSFORMS = {'dedup': (Deduplicator, float, ()),
+              'ratelimit': (RateLimiter, float, ('expiry',))}
+
+def maketransforms(spec, **options):
+    # Create a transform chain from a spec such as "dedup, ratelimit:30",
+    # a comma separated list of transform names with optional
+    # arguments. Options (such as expiry) are given to the transforms
+    # that take them.
+    transforms = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, argument = part.partition(':')
+        if name not in TRANSFORMS:
+            raise ValueError("Unknown transform: %s" %name)
+        transform, argtype, names = TRANSFORMS[name]
+        kwargs = dict((key, value) for (key, value) in options.iteritems() if key in names)
+        if argument:
+            transforms.append(transform(argtype(argument), **kwargs))
+        else:
+            transforms.append(transform(**kwargs))
+    return transforms
+
+
+class Output(object):
+    # An output with a chain of transforms in front of it. The put
+    # function is called with (source, data, message) for the data
+    # that passes all transforms. An output that filters on the
+    # message is marked as filtered. Outputs that neither transform
+    # nor filter are raw and can take each line as it is received.
+
+    def __init__(self, put, transforms=[], filtered=False):
+        self.output = put
+        self.transforms = transforms
+        self.raw = not transforms and not filtered
+
+    def put(self, source, data, message):
+        for transform in self.transforms:
+            if not transform(data, message):
+                return
+        self.output(source, data, message)
+
+
+class RelayFilter(object):
+    # Filters relayed messages on message number, MMSI and position
+    # using the decoded message from the comm hub. A filter is given
+    # as a string such as
+    #
+    #   types=1,2,3,18 mmsi=265547250,265678000 bbox=57.0,11.0,58.5,12.5
+    #
+    # where bbox is south latitude, west longitude, north latitude and
+    # east longitude. A circle is given as radius=latitude,longitude,km.
+    # Messages without a position (such as static data) pass the bbox
+    # and radius tests if the vessel was last seen inside the area.
+    # Messages that couldn't be decoded only pass an empty filter.
+
+    def __init__(self, spec=''):
+        self.types = set()
+        self.mmsi = set()
+        self.bbox = None
+        self.radius = None
+        # MMSI numbers last seen inside the area
+        self.inside = set()
+        for part in spec.split():
+            try:
+                key, value = part.split('=', 1)
+            except ValueError:
+                raise ValueError("Invalid filter part: %s" %part)
+            values = [v.strip() for v in value.split(',') if v.strip()]
+            key = key.lower()
+            if key == 'types':
+                self.types = set(values)
+            elif key == 'mmsi':
+                self.mmsi = set(int(v) for v in values)
+            elif key == 'bbox' and len(values) == 4:
+                self.bbox = tuple(float(v) for v in values)
+            elif key == 'radius' and len(values) == 3:
+                self.radius = tuple(float(v) for v in values)
+            else:
+                raise ValueError("Invalid filter part: %s" %part)
+        # A canonical form, equal filters share evaluation
+        self.key = (tuple(sorted(self.types)), tuple(sorted(self.mmsi)), self.bbox, self.radius)
+        # Number of clients using the filter (see RelayServer)
+        self.users = 0
+
+    def match(self, message):
+        if self.types and message.get('message') not in self.types:
+            return False
+        if self.mmsi and message.get('mmsi') not in self.mmsi:
+            return False
+        if self.bbox or self.radius:
+            mmsi = message.get('mmsi')
+            latitude = message.get('latitude')
+            longitude = message.get('longitude')
+            if latitude is None or longitude is None:
+                return mmsi is not None and mmsi in self.inside
+            if self.InsideArea(float(latitude), float(longitude)):
+                self.inside.add(mmsi)
+                return True
+            self.inside.discard(mmsi)
+            return False
+        return True
+
+    def InsideArea(self, latitude, longitude):
+        if self.bbox:
+            south, west, north, east = self.bbox
+            if not (south <= latitude <= north and west <= longitude <= east):
+                return False
+        if self.radius:
+            return geo.within_distance(self.radius[0], self.radius[1], latitude, longitude, self.radius[2])
+        return True
+
+    def empty(self):
+        return not (self.types or self.mmsi or self.bbox or self.radius)
+
+
+class RelayClient(object):
+    # A connected client of the relay server, with a buffer of data
+    # that hasn't been sent yet
+
+    def __init__(self, sock, address):
+        self.socket = sock
+        self.address = address
+        self.buffer = ''
+        # Data received from the client, waiting for a full line
+        self.incoming = ''
+        self.filter = None
+        # Keep the descriptor, the socket has none once closed
+        self.fd = sock.fileno()
+
+    def fileno(self):
+        return self.fd
+
+    def send(self):
+        # Send as much of the buffer as the socket takes without
+        # blocking. Returns False if the connection is broken.
+        try:
+            sent = self.socket.send(self.buffer)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return True
+            return False
+        self.buffer = self.buffer[sent:]
+        return True
+
+
+class RelayServer(object):
+    # Relays raw data to any number of network clients from a single
+    # thread. Data put to the server is collected and sent as one
+    # buffer to each client per loop, using select() to find the
+    # clients that can take more data.
+    #
+    # Each client has a bounded buffer. A client that doesn't keep up
+    # (has more than maxbuffer bytes waiting) is disconnected, so one
+    # slow client can't hold back the others.
+    #
+    # Clients get the data that passes a filter (see RelayFilter), the
+    # one given for the server or one the client sends as a line
+    # "FILTER <filter>" after connecting. Each distinct filter is only
+    # evaluated once per message, however many clients use it, and is
+    # forgotten when no client uses it any more.
+
+    def __init__(self, address, port, filter='', maxbuffer=262144, maxqueue=10000, interval=0.05, name='NetworkServer'):
+        self.address = address
+        self.port = port
+        self.maxbuffer = maxbuffer
+        self.interval = interval
+        self.name = name
+        self.queue = collections.deque(maxlen=maxqueue)
+        self.clients = {}
+        self.filters = {}
+        self.filter = self.Filter(filter)
+        self.listener = None
+        self.stopped = False
+        self.thread = None
+        self.stats = {'clients': 0, 'connected': 0, 'evicted': 0, 'sent': 0}
+
+    def serve(self):
+        while not self.stopped:
+            try:
+                self.ServeOnce()
+            except Exception:
+                # Keep serving the other clients
+                logging.warning("Error in %(name)s" %{'name': self.name}, exc_info=True)
+                time.sleep(self.interval)
+        # Close all connections
+        for client in self.clients.values():
+            self.Disconnect(client)
+        self.listener.close()
+
+    def Drop(self, client):
+        # Disconnect a client that caused an error
+        logging.warning("Disconnecting network client %(address)s after an error" %{'address': client.address}, exc_info=True)
+        self.Disconnect(client)
+
+    def ServeOnce(self):
+        # Wait for new clients, incoming data or sockets ready to
+        # write to, at most interval seconds
+        writers = [c for c in self.clients.itervalues() if c.buffer]
+        try:
+            readable, writable, error = select.select([self.listener] + self.clients.values(), writers, [], self.interval)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for sock in readable:
+            if sock is self.listener:
+                self.Accept()
+            else:
+                try:
+                    self.Read(sock)
+                except Exception:
+                    self.Drop(sock)
+        # Take everything in the queue and make one buffer for
+        # each filter in use
+        items = []
+        try:
+            while True:
+                items.append(self.queue.popleft())
+        except IndexError:
+            pass
+        if items:
+            batches = {}
+            for client in self.clients.values():
+                try:
+                    if client.filter not in batches:
+                        if client.filter is None:
+                            batches[None] = ''.join([data for (data, message) in items])
+                        else:
+                            match = client.filter.match
+                            batches[client.filter] = ''.join([data for (data, message) in items if match(message)])
+                    client.buffer += batches[client.filter]
+                except Exception:
+                    self.Drop(client)
+        # Send to all clients with data waiting
+        for client in self.clients.values():
+            if not client.buffer or client.fileno() not in self.clients:
+                continue
+            before = len(client.buffer)
+            try:
+                sent = client.send()
+            except Exception:
+                self.Drop(client)
+                continue
+            if not sent:
+                self.Disconnect(client)
+                continue
+            self.stats['sent'] += before - len(client.buffer)
+            if len(client.buffer) > self.maxbuffer:
+                logging.warning("Disconnecting network client %(address)s, too slow to keep up" %{'address': client.address})
+                self.stats['evicted'] += 1
+                self.Disconnect(client)
+
+    def Accept(self):
+        # Accept all pending connections
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except socket.error:
+                break
+            sock.setblocking(0)
+            client = RelayClient(sock, '%s:%s' %address[:2])
+            client.filter = self.UseFilter(self.filter)
+            self.clients[sock.fileno()] = client
+            self.stats['connected'] += 1
+        self.stats['clients'] = len(self.clients)
+
+    def Read(self, client):
+        # Clients may send a filter line, anything else is ignored
+        try:
+            data = client.socket.recv(4096)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            self.Disconnect(client)
+            return
+        client.incoming = (client.incoming + data)[-4096:]
+        while '\n' in client.incoming:
+            line, client.incoming = client.incoming.split('\n', 1)
+            if line[:6].upper() == 'FILTER':
+                try:
+                    relay_filter = self.Filter(line[6:])
+                    self.ReleaseFilter(client.filter)
+                    client.filter = relay_filter
+                except ValueError:
+                    logging.debug("Invalid filter from network client %(address)s" %{'address': client.address}, exc_info=True)
+
+    def Filter(self, spec):
+        # Return the shared filter for the spec, or None for no filter.
+        # The filter is counted as used until ReleaseFilter is called.
+        relay_filter = RelayFilter(spec)
+        if relay_filter.empty():
+            return None
+        return self.UseFilter(self.filters.setdefault(relay_filter.key, relay_filter))
+
+    def UseFilter(self, relay_filter):
+        # Count one more user of a shared filter
+        if relay_filter is not None:
+            relay_filter.users += 1
+        return relay_filter
+
+    def ReleaseFilter(self, relay_filter):
+        # Count one user less, forget the filter when nobody uses it
+        if relay_filter is None:
+            return
+        relay_filter.users -= 1
+        if relay_filter.users <= 0:
+            self.filters.pop(relay_filter.key, None)
+
+    def Disconnect(self, client):
+        if self.clients.pop(client.fileno(), None) is None:
+            return
+        self.ReleaseFilter(client.filter)
+        client.filter = None
+        try:
+            client.socket.close()
+        except socket.error:
+            pass
+        self.stats['clients'] = len(self.clients)
+
+    def ReturnStats(self):
+        return self.stats
+
+    def put(self, data, message={}):
+        # Put raw data with the decoded message (used for filtering)
+        # Thread safe, the oldest data is dropped if the queue is full
+        self.queue.append((data, message))
+
+    def start(self):
+        try:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind((self.address, self.port))
+            self.listener.listen(50)
+            self.listener.setblocking(0)
+            self.port = self.listener.getsockname()[1]
+        except socket.error:
+            logging.error("Could not start the network server on address %(address)s and port %(port)s" %{'address': self.address, 'port': self.port}, exc_info=True)
+            return False
+        self.thread = threading.Thread(target=self.serve, name=self.name)
+        self.thread.setDaemon(1)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stopped = True
+
+
+
+class TestOutputBuffer(unittest.TestCase):
+    def setUp(self):
+        self.position = '!AIVDM,1,1,,A,13uTAH002nJRLAHEwTi674rh04:8,0*2B\r\n'
+        self.static = ['!AIVDM,2,1,3,B,55P5TL01VIaAL@7WKO@mBplU@<PDhh000000001S;AJ::4A80?4i@E53,0*3E\r\n',
+                       '!AIVDM,2,2,3,B,1@0000000000000,2*55\r\n']
+        self.binary = '!AIVDM,1,1,,A,85Mwp`1Kf3aCnsNvBWLi=wQuNhA5t43N`5nCuI=p<IBfVqnMgPGs,0*47\r\n'
+
+    def testclassify(self):
+        classifier = MessageClassifier()
+        self.assertEqual(classifier.classify(self.position), 'position')
+        self.assertEqual([classifier.classify(d) for d in self.static], ['static', 'static'])
+        self.assertEqual(classifier.classify(self.binary), 'binary')
+        self.assertEqual(classifier.classify('$GPGGA,,,,,,,,,,,,,,*66\r\n'), 'other')
+
+    def testorder(self):
+        output = OutputBuffer(10000)
+        lines = [self.binary, self.position] + self.static + [self.position]
+        for line in lines:
+            output.put(line)
+        self.assertEqual(output.take(10000), ''.join(lines))
+        self.assertEqual(output.take(10000), '')
+
+    def testbudget(self):
+        output = OutputBuffer(10000)
+        for i in range(10):
+            output.put(self.position)
+        data = output.take(len(self.position) * 3 + 10)
+        self.assertEqual(data, self.position * 3)
+        self.assertEqual(output.ReturnStats()['buffered'], len(self.position) * 7)
+
+    def testdroppolicy(self):
+        # Room for ten sentences, binary messages should go first
+        output = OutputBuffer(len(self.binary) * 10)
+        for i in range(10):
+            output.put(self.binary)
+        for i in range(5):
+            output.put(self.position)
+        stats = output.ReturnStats()
+        self.assertTrue(stats['dropped']['binary'] > 0)
+        self.assertEqual(stats['dropped']['position'], 0)
+        self.assertTrue(output.take(100000).count(self.position) == 5)
+        # With binary messages given the highest priority
+        output = OutputBuffer(len(self.binary) * 10, ('binary', 'position'))
+        for i in range(10):
+            output.put(self.binary)
+        for i in range(5):
+            output.put(self.position)
+        self.assertEqual(output.ReturnStats()['dropped']['position'], 5)
+
+    def testbytebudget(self):
+        budget = ByteBudget(baudrate_budget(4800))
+        self.assertEqual(budget.available(), 480)
+        budget.spend(480)
+        self.assertTrue(budget.available() < 10)
+        self.assertFalse(budget.full())
+
+    def testlongsentence(self):
+        # A burst shorter than a sentence still lets it through
+        output = OutputBuffer(10000)
+        output.put(self.position)
+        budget = ByteBudget(10, burst=1.0)
+        self.assertEqual(output.take(budget.available(), budget.full()), self.position)
+        budget.spend(len(self.position))
+        output.put(self.position)
+        self.assertEqual(output.take(budget.available(), budget.full()), '')
+
+    def testfragments(self):
+        # Fragments are sent as received, also when a message is
+        # never completed
+        output = OutputBuffer(10000)
+        lines = [self.static[0], self.position] + self.static + ['!AIVDM,2,2,x,B,garbled\r\n']
+        for line in lines:
+            output.put(line)
+        self.assertEqual(output.take(10000), ''.join(lines))
+        self.assertEqual(output.ReturnStats()['queued'], len(''.join(lines)))
+
+
+class TestTransforms(unittest.TestCase):
+    def setUp(self):
+        self.sentence = '!AIVDM,1,1,,A,13uTAH002nJRLAHEwTi674rh04:8,0*2B\r\n'
+
+    def testdedup(self):
+        dedup = Deduplicator(window=0.05)
+        self.assertTrue(dedup(self.sentence, {}))
+        # The same payload on the other channel
+        self.assertFalse(dedup(self.sentence.replace(',A,', ',B,'), {}))
+        time.sleep(0.1)
+        self.assertTrue(dedup(self.sentence, {}))
+        # Memory is bounded
+        self.assertTrue(dedup('!AIVDM,1\r\n', {}))
+        dedup = Deduplicator(maxsize=10)
+        for i in range(100):
+            dedup('$GPGGA,%d\r\n' %i, {})
+        self.assertEqual(len(dedup.seen), 10)
+
+    def testratelimit(self):
+        ratelimit = RateLimiter(interval=0.05, expiry=0.2)
+        position = {'mmsi': 265547250, 'message': '1'}
+        static = {'mmsi': 265547250, 'message': '5'}
+        self.assertTrue(ratelimit(self.sentence, position))
+        self.assertFalse(ratelimit(self.sentence, position))
+        self.assertTrue(ratelimit(self.sentence, static))
+        self.assertTrue(ratelimit(self.sentence, {'mmsi': 366730000, 'message': '3'}))
+        self.assertTrue(ratelimit(self.sentence, {}))
+        time.sleep(0.1)
+        self.assertTrue(ratelimit(self.sentence, position))
+        # Vessels are forgotten after the expiry time
+        time.sleep(0.3)
+        ratelimit(self.sentence, position)
+        self.assertEqual(ratelimit.forwarded.keys(), [265547250])
+
+    def testratelimitbytes(self):
+        # One report every 10 s from 500 vessels over 10 minutes,
+        # limited to one report per minute and vessel
+        ratelimit = RateLimiter(interval=60)
+        sent = 0
+        passed = 0
+        start = time.time()
+        for t in range(0, 600, 10):
+            for mmsi in range(500):
+                sent += 1
+                if ratelimit.check(mmsi, start + t):
+                    passed += 1
+        self.assertEqual(passed, 500 * 10)
+        self.assertEqual(sent, 6 * passed)
+
+    def testchain(self):
+        self.assertEqual(maketransforms(''), [])
+        self.assertEqual(maketransforms(' dedup:30 ')[0].window, 30)
+        self.assertEqual(maketransforms('dedup, ratelimit:60', expiry=600)[1].expiry, 600)
+        self.assertRaises(ValueError, maketransforms, 'compress')
+        received = []
+        output = Output(lambda source, data, message: received.append(data), maketransforms('dedup'))
+        for i in range(3):
+            output.put('Test', self.sentence, {})
+        self.assertEqual(received, [self.sentence])
+        self.assertFalse(output.raw)
+        self.assertTrue(Output(received.append).raw)
+        self.assertFalse(Output(received.append, filtered=True).raw)
+
+
+class TestRelayServer(unittest.TestCase):
+    def setUp(self):
+        self.sentence = '!AIVDM,1,1,,A,13uTAH002nJRLAHEwTi674rh04:8,0*2B\r\n'
+        self.server = RelayServer('localhost', 0, interval=0.01)
+        self.assertTrue(self.server.start())
+
+    def tearDown(self):
+        self.server.stop()
+        self.server.thread.join(5)
+
+    def connect(self):
+        clients = self.server.stats['connected']
+        client = socket.create_connection(('localhost', self.server.port))
+        client.settimeout(5)
+        # Wait for the server to accept the connection
+        for i in range(500):
+            if self.server.stats['connected'] > clients:
+                break
+            time.sleep(0.01)
+        return client
+
+    def receive(self, client, size):
+        data = ''
+        while len(data) < size:
+            data += client.recv(size - len(data))
+        return data
+
+    def testfanout(self):
+        clients = [self.connect() for i in range(20)]
+        for i in range(100):
+            self.server.put(self.sentence)
+        for client in clients:
+            self.assertEqual(self.receive(client, len(self.sentence) * 100), self.sentence * 100)
+            client.close()
+        self.assertEqual(self.server.ReturnStats()['sent'], len(self.sentence) * 100 * 20)
+
+    def testslowclient(self):
+        self.server.maxbuffer = 65536
+        slow = self.connect()
+        fast = self.connect()
+        chunk = 'x' * 65536
+        received = 0
+        # The slow client never reads and should be disconnected
+        for i in range(400):
+            self.server.put(chunk)
+            received += len(fast.recv(1000000))
+            if self.server.stats['evicted']:
+                break
+        self.assertEqual(self.server.stats['evicted'], 1)
+        self.assertEqual(self.server.stats['clients'], 1)
+        slow.close()
+        fast.close()
+
+    def testfilter(self):
+        other = '!AIVDM,1,1,,A,15N4cJ`005Jrek0H@9n`DW5608EP,0*13\r\n'
+        everything = self.connect()
+        filtered = self.connect()
+        filtered.sendall('FILTER types=1 mmsi=265547250\r\n')
+        # Wait for the server to read the filter
+        for i in range(500):
+            if self.server.filters:
+                break
+            time.sleep(0.01)
+        self.server.put(other, {'mmsi': 366730000, 'message': '1'})
+        self.server.put(self.sentence, {'mmsi': 265547250, 'message': '1'})
+        self.assertEqual(self.receive(everything, len(other + self.sentence)), other + self.sentence)
+        self.assertEqual(self.receive(filtered, len(self.sentence)), self.sentence)
+        everything.close()
+        filtered.close()
+
+    def testfilterrelease(self):
+        # Filters are forgotten when changed or when the client leaves
+        client = self.connect()
+        for mmsi in range(265547250, 265547350):
+            client.sendall('FILTER mmsi=%d\r\n' %mmsi)
+        client.sendall('FILTER types=1\r\n')
+        for i in range(500):
+            if [ f for f in self.server.filters.values() if f.types ]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.server.filters), 1)
+        client.close()
+        for i in range(500):
+            if not self.server.stats['clients']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.server.filters, {})
+
+    def testclienterror(self):
+        # A filter that fails only drops the client using it
+        everything = self.connect()
+        broken = self.connect()
+        broken.sendall('FILTER types=1\r\n')
+        for i in range(500):
+            if self.server.filters:
+                break
+            time.sleep(0.01)
+        def fail(message):
+            raise KeyError('broken')
+        self.server.filters.values()[0].match = fail
+        logging.disable(logging.WARNING)
+        try:
+            self.server.put(self.sentence, {'mmsi': 265547250, 'message': '1'})
+            self.assertEqual(self.receive(everything, len(self.sentence)), self.sentence)
+            self.assertEqual(broken.recv(100), '')
+            self.assertEqual(self.server.stats['clients'], 1)
+            self.server.put(self.sentence)
+            self.assertEqual(self.receive(everything, len(self.sentence)), self.sentence)
+        finally:
+            logging.disable(logging.NOTSET)
+        everything.close()
+        broken.close()
+
+
+class TestRelayFilter(unittest.TestCase):
+    def testfilter(self):
+        position = {'mmsi': 265547250, 'message': '1', 'latitude': decimal.Decimal('57.66'), 'longitude': decimal.Decimal('11.83')}
+        static = {'mmsi': 265547250, 'message': '5', 'name': 'TEST'}
+        self.assertTrue(RelayFilter('').empty())
+        self.assertTrue(RelayFilter('types=1,2,3').match(position))
+        self.assertFalse(RelayFilter('types=1,2,3').match(static))
+        self.assertFalse(RelayFilter('mmsi=1,2').match(position))
+        self.assertFalse(RelayFilter('types=1').match({}))
+        self.assertRaises(ValueError, RelayFilter, 'speed=10')
+        self.assertEqual(RelayFilter('types=3,1').key, RelayFilter('TYPES=1,3').key)
+
+    def testbbox(self):
+        inside = {'mmsi': 265547250, 'message': '1', 'latitude': decimal.Decimal('57.66'), 'longitude': decimal.Decimal('11.83')}
+        outside = {'mmsi': 265547250, 'message': '1', 'latitude': decimal.Decimal('59.0'), 'longitude': decimal.Decimal('11.83')}
+        static = {'mmsi': 265547250, 'message': '5', 'name': 'TEST'}
+        relay_filter = RelayFilter('bbox=57.0,11.0,58.5,12.5')
+        self.assertFalse(relay_filter.match(static))
+        self.assertTrue(relay_filter.match(inside))
+        self.assertTrue(relay_filter.match(static))
+        self.assertFalse(relay_filter.match(outside))
+        self.assertFalse(relay_filter.match(static))
+
+    def testradius(self):
+        # The position is just under 10 km from the center
+        position = {'mmsi': 265547250, 'message': '1', 'latitude': decimal.Decimal('57.66'), 'longitude': decimal.Decimal('11.83')}
+        self.assertTrue(RelayFilter('radius=57.7,11.98,10').match(position))
+        self.assertFalse(RelayFilter('radius=57.7,11.98,9.5').match(position))
+        self.assertFalse(RelayFilter('radius=57.7,11.98,10 bbox=57.0,11.9,58.5,12.5').match(position))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# replay.py (part of "AIS Logger")
+# Replay of files containing raw (unparsed) data
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import time, datetime, calendar
+import gzip
+import unittest
+import tempfile
+
+def parsetimestamp(text):
+    # Converts a logged timestamp to seconds since the epoch (UTC)
+    # Accepts epoch seconds (or milliseconds) and ISO 8601 strings
+    # Returns None if the text can't be interpreted as a timestamp
+    try:
+        timestamp = float(text)
+        # Some receivers log milliseconds since the epoch
+        if timestamp > 1e11:
+            timestamp = timestamp / 1000
+        return timestamp
+    except ValueError:
+        pass
+    for format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            parsed = datetime.datetime.strptime(text[:19], format)
+            return calendar.timegm(parsed.timetuple())
+        except ValueError:
+            continue
+    return None
+
+def splitline(line):
+    # Splits a line from a raw data file into a timestamp and the
+    # NMEA sentence. The timestamp is taken from an NMEA 4.0 tag block
+    # (\c:1241544035*1A\!AIVDM...) or from a logged prefix in front of
+    # the sentence (1241544035 !AIVDM... or 2009-05-05T17:20:35 !AIVDM...)
+    # Returns (timestamp, sentence) where timestamp may be None, or
+    # (None, None) if the line doesn't contain a sentence
+    timestamp = None
+    # See if the line starts with a tag block
+    if line.startswith('\\'):
+        end = line.find('\\', 1)
+        if end == -1:
+            return None, None
+        for tag in line[1:end].split('*')[0].split(','):
+            if tag.startswith('c:'):
+                timestamp = parsetimestamp(tag[2:])
+        line = line[end+1:]
+    # Find the start of the sentence
+    start = len(line)
+    for char in ('!', '$'):
+        pos = line.find(char)
+        if pos != -1 and pos < start:
+            start = pos
+    if start == len(line):
+        return None, None
+    # Interpret anything in front of the sentence as a timestamp
+    prefix = line[:start].split()
+    if prefix and timestamp is None:
+        timestamp = parsetimestamp(prefix[0])
+        # ISO timestamps may be written with a space as separator
+        if timestamp is None and len(prefix) > 1:
+            timestamp = parsetimestamp(prefix[0] + ' ' + prefix[1])
+    return timestamp, line[start:]
+
+
+class RawReplay(object):
+    # Replays a raw data file by calling put([source, sentence])
+    # for each sentence in the file.
+    #
+    # A speed of 0 replays the file as fast as possible, a speed of 1
+    # in real time and a speed of N at N times real time. Timed
+    # replays need timestamps in the file (tag blocks or logged
+    # timestamps), lines without timestamps are sent immediately.
+    #
+    # The put function should block when the receiver is busy, which
+    # makes the replay run exactly as fast as the receiver can take
+    # the data without anything being dropped.
+
+    def __init__(self, filename, put, speed=0, source='File'):
+        self.filename = filename
+        self.put = put
+        self.speed = speed
+        self.source = source
+        self.stopped = False
+        self.stats = {'lines': 0, 'sentences': 0, 'elapsed': 0.0, 'rate': 0.0}
+
+    def run(self, progress=None, interval=0.2):
+        # Replay the file. If a progress function is given it is called
+        # with the fraction read (estimated from the file size) at the
+        # given interval. If it returns False the replay is aborted.
+        rawfile = open(self.filename, 'rb')
+        # Read compressed files (such as raw data archives) directly
+        if self.filename.endswith('.gz'):
+            f = gzip.GzipFile(fileobj=rawfile, mode='rb')
+        else:
+            f = rawfile
+        filesize = float(os.path.getsize(self.filename)) or 1.0
+        start_time = time.time()
+        last_progress = start_time
+        first_timestamp = None
+        try:
+            for line in f:
+                if self.stopped:
+                    break
+                self.stats['lines'] += 1
+                timestamp, sentence = splitline(line)
+                if sentence is None:
+                    continue
+                # Wait until it's time to send the sentence
+                if self.speed > 0 and timestamp is not None:
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                        first_time = time.time()
+                    else:
+                        delay = first_time + (timestamp - first_timestamp) / self.speed - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                self.put([self.source, sentence])
+                self.stats['sentences'] += 1
+                # See if we should report progress
+                if progress and time.time() - last_progress > interval:
+                    last_progress = time.time()
+                    self.UpdateStats(start_time)
+                    if progress(min(rawfile.tell() / filesize, 1.0)) is False:
+                        break
+        finally:
+            f.close()
+            rawfile.close()
+        self.UpdateStats(start_time)
+        if progress:
+            progress(1.0)
+        return self.stats
+
+    def UpdateStats(self, start_time):
+        # Calculate elapsed time and throughput
+        self.stats['elapsed'] = time.time() - start_time
+        if self.stats['elapsed'] > 0:
+            self.stats['rate'] = self.stats['sentences'] / self.stats['elapsed']
+
+    def Throughput(self):
+        # Return a human-readable summary of the replay
+        return "%(sentences)d sentences in %(elapsed).1f s (%(rate).0f msgs/sec)" %self.stats
+
+    def stop(self):
+        self.stopped = True
+
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.sentence = '!AIVDM,1,1,,A,13uTAH002nJRLAHEwTi674rh04:8,0*2B\n'
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def writefile(self, lines):
+        f = open(self.filename, 'w')
+        f.writelines(lines)
+        f.close()
+
+    def testsplitline(self):
+        self.assertEqual(splitline(self.sentence), (None, self.sentence))
+        self.assertEqual(splitline('1241544035 ' + self.sentence), (1241544035, self.sentence))
+        self.assertEqual(splitline('1241544035000\t' + self.sentence), (1241544035, self.sentence))
+        self.assertEqual(splitline('2009-05-05T17:20:35 ' + self.sentence), (1241544035, self.sentence))
+        self.assertEqual(splitline('2009-05-05 17:20:35 ' + self.sentence), (1241544035, self.sentence))
+        self.assertEqual(splitline('\\s:rcv,c:1241544035*1A\\' + self.sentence), (1241544035, self.sentence))
+        self.assertEqual(splitline('garbage\n'), (None, None))
+
+    def testfastreplay(self):
+        self.writefile([self.sentence] * 100 + ['garbage\n'])
+        received = []
+        replay = RawReplay(self.filename, received.append, source='Test')
+        stats = replay.run()
+        self.assertEqual(len(received), 100)
+        self.assertEqual(received[0], ['Test', self.sentence])
+        self.assertEqual(stats['lines'], 101)
+        self.assertEqual(stats['sentences'], 100)
+
+    def testtimedreplay(self):
+        # Ten sentences one second apart, replayed at 50x speed
+        self.writefile(['%d %s' %(1241544035 + i, self.sentence) for i in range(10)])
+        received = []
+        start = time.time()
+        RawReplay(self.filename, received.append, speed=50).run()
+        self.assertEqual(len(received), 10)
+        self.assertTrue(time.time() - start >= 9 / 50.0)
+
+    def testarchivereplay(self):
+        # Raw data archives are gzip-compressed with time and source
+        os.remove(self.filename)
+        self.filename = self.filename + '.gz'
+        f = gzip.open(self.filename, 'wb')
+        for i in range(10):
+            f.write('%.3f\tSerial port a (/dev/ttyS0)\t%s' %(1241544035 + i, self.sentence))
+        f.close()
+        received = []
+        start = time.time()
+        RawReplay(self.filename, received.append, speed=50).run()
+        self.assertEqual(received, [['File', self.sentence]] * 10)
+        self.assertTrue(time.time() - start >= 9 / 50.0)
+
+    def testprogressabort(self):
+        self.writefile([self.sentence] * 1000)
+        received = []
+        fractions = []
+        def progress(fraction):
+            fractions.append(fraction)
+            return False
+        RawReplay(self.filename, received.append).run(progress, interval=0)
+        self.assertTrue(len(received) < 1000)
+        self.assertEqual(fractions[-1], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
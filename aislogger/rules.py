@@ -0,0 +1,291 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# rules.py (part of "AIS Logger")
+# Alert rules on object data, evaluated when the data changes
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import re
+import csv
+import unittest
+import StringIO
+
+# Condition operators, longest first so that >= is found before >
+OPERATORS = ('>=', '<=', '>', '<', '=', '~', '^')
+# A condition is a field name, the first operator after it and a value
+# (which may contain operator characters, as in name~^A>B)
+CONDITION = re.compile(r'^(\w+)\s*(%s)(.*)$' %'|'.join(re.escape(operator) for operator in OPERATORS), re.DOTALL)
+
+
+def number(value):
+    # Return the value as a float, or None if it isn't a number
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compilecondition(text):
+    # Compile a condition to a function test(record, zones, events)
+    # that returns True if the condition holds. zones is the set of
+    # zone names the object is in and events the set of fields that
+    # have changed value. Returns (fields, test), where fields are the
+    # fields the condition depends on ('zones' for the zones).
+    #
+    #   sog>10, length<=50     compare a number
+    #   type=30|31|32          the value is one of the values
+    #   name~^SAR              the value matches a regular expression
+    #   mmsi^970               the value starts with the text
+    #   zone=Harbour           the object is in the zone
+    #   changed:navstatus      the value has changed since last report
+    text = text.strip()
+    if text.startswith('changed:'):
+        field = text[8:].strip()
+        if not field:
+            raise ValueError("Invalid condition: %s" %text)
+        return (field,), lambda record, zones, events: field in events
+    match = CONDITION.match(text)
+    if not match:
+        raise ValueError("Invalid condition: %s" %text)
+    (field, operator, value) = match.groups()
+    field = field.lower()
+    value = value.strip()
+    if field == 'zone' and operator == '=':
+        return ('zones',), lambda record, zones, events: value in zones
+    if operator == '=':
+        values = frozenset(v.strip() for v in value.split('|'))
+        return (field,), lambda record, zones, events: unicode(record[field]) in values
+    if operator == '~':
+        search = re.compile(value, re.UNICODE).search
+        return (field,), lambda record, zones, events: record[field] is not None and search(unicode(record[field])) is not None
+    if operator == '^':
+        return (field,), lambda record, zones, events: unicode(record[field]).startswith(value)
+    limit = number(value)
+    if limit is None:
+        raise ValueError("Invalid number in condition: %s" %text)
+    compare = {'>': float.__gt__, '<': float.__lt__, '>=': float.__ge__, '<=': float.__le__}[operator]
+    def test(record, zones, events):
+        value = number(record[field])
+        return value is not None and compare(value, limit)
+    return (field,), test
+
+
+class Rule(object):
+    # A named alert rule that holds when all its conditions hold. The
+    # alert is 'A' (silent) or 'AS' (sound) like in the remark file.
+    # A rule with a changed: condition is an event, it only holds on
+    # the report where the value changed.
+
+    def __init__(self, name, alert, conditions):
+        if alert not in ('A', 'AS'):
+            raise ValueError("Invalid alert for rule %s: %s" %(name, alert))
+        if not conditions:
+            raise ValueError("No conditions for rule %s" %name)
+        self.name = name
+        self.alert = alert
+        self.event = False
+        # The fields of the changed: conditions
+        self.eventfields = ()
+        fields = set()
+        tests = []
+        for condition in conditions:
+            (condition_fields, test) = compilecondition(condition)
+            fields.update(condition_fields)
+            if condition.strip().startswith('changed:'):
+                self.event = True
+                self.eventfields += condition_fields
+            tests.append(test)
+        self.fields = frozenset(fields)
+        # Combine the tests into one function
+        if len(tests) == 1:
+            self.test = tests[0]
+        else:
+            self.test = lambda record, zones, events: all(test(record, zones, events) for test in tests)
+
+
+def readrules(file):
+    # Read rules from a CSV file with one rule on each line:
+    #
+    #   name,alert,condition,condition,...
+    #
+    # where alert is A (silent) or AS (sound) like in the remark file
+    rules = []
+    for row in csv.reader(file):
+        if not row or row[0].startswith('#'):
+            continue
+        try:
+            name = unicode(row[0], 'utf-8')
+        except UnicodeDecodeError:
+            name = unicode(row[0], 'cp1252')
+        if len(row) < 3:
+            raise ValueError("No conditions for rule %s" %name)
+        rules.append(Rule(name, row[1].strip().upper(), [ c for c in row[2:] if c.strip() ]))
+    return rules
+
+
+class RuleEngine(object):
+    # Evaluates alert rules for objects as their data changes.
+    #
+    # Rules are indexed by the fields they depend on, so an update only
+    # evaluates the rules that depend on one of its changed fields.
+    # The rules each object matches are remembered between updates,
+    # which tells when a rule starts to hold (for sound alerts).
+
+    def __init__(self, rules=(), fields=None):
+        # If fields is given, rules may only depend on those fields
+        # (and the zones)
+        self.rules = list(rules)
+        if fields is not None:
+            for rule in self.rules:
+                for field in rule.fields:
+                    if field != 'zones' and field not in fields:
+                        raise ValueError("Unknown field in rule %s: %s" %(rule.name, field))
+        # Field -> list of rules depending on it
+        self.index = {}
+        for rule in self.rules:
+            for field in rule.fields:
+                self.index.setdefault(field, []).append(rule)
+        # The fields that changed: conditions watch
+        self.eventfields = frozenset(field for rule in self.rules for field in rule.eventfields)
+        # Key -> frozenset of matching rules (not events)
+        self.matching = {}
+        # Key -> {field: value} of the watched fields
+        self.previous = {}
+
+    def evaluate(self, key, record, fields=None, zones=frozenset()):
+        # Evaluate the rules depending on the changed fields (all rules
+        # if fields is None) for the object. Returns the rules the
+        # object matches and the rules that started to hold with this
+        # update (including events).
+        if fields is None:
+            candidates = self.rules
+        else:
+            candidates = set()
+            for field in fields:
+                candidates.update(self.index.get(field, ()))
+        # See which watched fields have changed value
+        events = set()
+        if self.eventfields:
+            previous = self.previous.setdefault(key, {})
+            for field in self.eventfields:
+                value = record[field]
+                if value is None:
+                    continue
+                if previous.get(field, value) != value:
+                    events.add(field)
+                previous[field] = value
+        before = self.matching.get(key, frozenset())
+        matching = set(before)
+        started = []
+        for rule in candidates:
+            if rule.test(record, zones, events):
+                if rule.event or rule not in before:
+                    started.append(rule)
+                if not rule.event:
+                    matching.add(rule)
+            else:
+                matching.discard(rule)
+        if matching:
+            self.matching[key] = frozenset(matching)
+        else:
+            self.matching.pop(key, None)
+        return matching, started
+
+    def remove(self, key):
+        self.matching.pop(key, None)
+        self.previous.pop(key, None)
+
+    def __len__(self):
+        return len(self.rules)
+
+
+
+class TestRules(unittest.TestCase):
+    rulefile = ('# Test rules\n'
+                'Fast in harbour,AS,sog>8,zone=Harbour\n'
+                'SART,AS,mmsi^970\n'
+                'Tanker,A,type=80|81|82\n'
+                'Rescue,A,"name~^(SAR|RESCUE) "\n'
+                'Status change,A,changed:navstatus\n')
+
+    def setUp(self):
+        self.record = {'mmsi': 265547250, 'sog': 5.0, 'type': 70, 'name': u'TEST', 'navstatus': None}
+        self.engine = RuleEngine(readrules(StringIO.StringIO(self.rulefile)))
+
+    def names(self, rules):
+        return sorted(rule.name for rule in rules)
+
+    def testconditions(self):
+        self.assertRaises(ValueError, compilecondition, 'sog')
+        self.assertRaises(ValueError, compilecondition, 'sog>fast')
+        self.assertRaises(ValueError, Rule, 'Test', 'X', ['sog>1'])
+        self.assertRaises(ValueError, readrules, StringIO.StringIO('Test,A\n'))
+        self.assertRaises(ValueError, RuleEngine, [Rule('Test', 'A', ['speed>1'])], ['sog'])
+        (fields, test) = compilecondition('sog>=10')
+        self.assertEqual(fields, ('sog',))
+        self.assertTrue(test({'sog': 10}, (), ()))
+        self.assertFalse(test({'sog': 'N/A'}, (), ()))
+        self.assertTrue(compilecondition('mmsi^970')[1]({'mmsi': 970012345}, (), ()))
+        self.assertTrue(compilecondition('name~^SAR ')[1]({'name': u'SAR 123'}, (), ()))
+        self.assertFalse(compilecondition('name~^SAR ')[1]({'name': None}, (), ()))
+        # Operator characters in the value belong to the value
+        (fields, test) = compilecondition('name~a>b')
+        self.assertEqual(fields, ('name',))
+        self.assertTrue(test({'name': u'xa>bx'}, (), ()))
+        self.assertFalse(test({'name': u'ab'}, (), ()))
+        self.assertTrue(compilecondition('destination~x=y')[1]({'destination': u'x=y'}, (), ()))
+        self.assertTrue(compilecondition('name ~^A<')[1]({'name': u'A<B'}, (), ()))
+        self.assertRaises(ValueError, compilecondition, '>10')
+        self.assertRaises(ValueError, compilecondition, 'name x~a')
+
+    def testevaluate(self):
+        (matching, started) = self.engine.evaluate(1, self.record)
+        self.assertEqual((matching, started), (set(), []))
+        # Only the rules depending on sog are evaluated
+        self.record['sog'] = 10.0
+        self.assertEqual(self.engine.evaluate(1, self.record, ['sog']), (set(), []))
+        (matching, started) = self.engine.evaluate(1, self.record, ['zones'], set([u'Harbour']))
+        self.assertEqual(self.names(started), [u'Fast in harbour'])
+        # Still matching, but not started again
+        (matching, started) = self.engine.evaluate(1, self.record, ['sog'], set([u'Harbour']))
+        self.assertEqual((self.names(matching), started), ([u'Fast in harbour'], []))
+        self.record['type'] = 80
+        (matching, started) = self.engine.evaluate(1, self.record, ['type'], set([u'Harbour']))
+        self.assertEqual(self.names(matching), [u'Fast in harbour', u'Tanker'])
+        self.record['sog'] = 2.0
+        (matching, started) = self.engine.evaluate(1, self.record, ['sog'], set([u'Harbour']))
+        self.assertEqual(self.names(matching), [u'Tanker'])
+        self.engine.remove(1)
+        self.assertEqual(self.engine.matching, {})
+
+    def testevent(self):
+        self.record['navstatus'] = 0
+        self.assertEqual(self.engine.evaluate(1, self.record, ['navstatus']), (set(), []))
+        self.record['navstatus'] = 5
+        (matching, started) = self.engine.evaluate(1, self.record, ['navstatus'])
+        self.assertEqual((matching, self.names(started)), (set(), [u'Status change']))
+        self.assertEqual(self.engine.evaluate(1, self.record, ['navstatus']), (set(), []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# spatial.py (part of "AIS Logger")
+# Index of object positions for box and radius queries
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import math
+import random
+import unittest
+
+import geo
+
+
+class GridIndex(object):
+    # Keeps keys (such as MMSI numbers) in a grid of cells by their
+    # last position, so that the keys inside a box or within a
+    # distance of a point can be found without looking at all keys.
+    #
+    # Cells are cellsize degrees of latitude and longitude. A query
+    # only looks at the keys in the cells that overlap the area, or at
+    # the cells in use if there are fewer of them (such as a box
+    # around the whole world). Moving a key within its cell only
+    # updates its position.
+
+    def __init__(self, cellsize=0.1):
+        self.cellsize = float(cellsize)
+        # Cell -> set of keys
+        self.cells = {}
+        # Key -> (latitude, longitude, cell)
+        self.positions = {}
+
+    def cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cellsize)), int(math.floor(longitude / self.cellsize)))
+
+    def update(self, key, latitude, longitude):
+        # Set the position of the key
+        latitude, longitude = float(latitude), float(longitude)
+        cell = self.cell(latitude, longitude)
+        old = self.positions.get(key)
+        if old is None or old[2] != cell:
+            if old is not None:
+                self.discard(key, old[2])
+            keys = self.cells.get(cell)
+            if keys is None:
+                keys = self.cells[cell] = set()
+            keys.add(key)
+        self.positions[key] = (latitude, longitude, cell)
+
+    def remove(self, key):
+        old = self.positions.pop(key, None)
+        if old is not None:
+            self.discard(key, old[2])
+
+    def discard(self, key, cell):
+        # Remove the key from a cell, and the cell if it's empty
+        keys = self.cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self.cells[cell]
+
+    def candidates(self, south, west, north, east):
+        # Return the keys in the cells that overlap the box
+        (bottom, left) = self.cell(south, west)
+        (top, right) = self.cell(north, east)
+        if (top - bottom + 1) * (right - left + 1) > len(self.cells):
+            # Fewer cells in use than in the box, look at all of them
+            cells = [ keys for (cell, keys) in self.cells.iteritems()
+                      if bottom <= cell[0] <= top and left <= cell[1] <= right ]
+        else:
+            cells = [ self.cells[cell] for cell in
+                      ((row, column) for row in xrange(bottom, top + 1) for column in xrange(left, right + 1))
+                      if cell in self.cells ]
+        return [ key for keys in cells for key in keys ]
+
+    def box(self, south, west, north, east):
+        # Return the keys inside the box. A box with west > east
+        # crosses the 180th meridian.
+        south, west, north, east = float(south), float(west), float(north), float(east)
+        if west > east:
+            return self.box(south, west, north, 180.0) + self.box(south, -180.0, north, east)
+        positions = self.positions
+        return [ key for key in self.candidates(south, west, north, east)
+                 if south <= positions[key][0] <= north and west <= positions[key][1] <= east ]
+
+    def radius(self, latitude, longitude, distance):
+        # Return the keys within distance km of the point
+        latitude, longitude = float(latitude), float(longitude)
+        # The box around the circle
+        delta_lat = distance / geo.DEGREE_LATITUDE
+        south, north = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+        # The shortest degree of longitude in the box, in km (a degree
+        # is a bit over 111 km at the equator)
+        degree_lon = math.cos(math.radians(max(abs(south), abs(north)))) * 111.0
+        if degree_lon * 180 <= distance:
+            west, east = -180.0, 180.0
+        else:
+            delta_lon = distance / degree_lon
+            west, east = longitude - delta_lon, longitude + delta_lon
+        if west < -180:
+            west += 360
+        elif east > 180:
+            east -= 360
+        positions = self.positions
+        within_distance = geo.within_distance
+        return [ key for key in self.box(south, west, north, east)
+                 if within_distance(latitude, longitude, positions[key][0], positions[key][1], distance) ]
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+
+
+class TestGridIndex(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.index = GridIndex()
+        self.positions = {}
+        for key in range(2000):
+            position = (random.uniform(56, 59), random.uniform(10, 13))
+            self.positions[key] = position
+            self.index.update(key, *position)
+
+    def testbox(self):
+        expected = [ key for (key, (lat, lon)) in self.positions.iteritems()
+                     if 57.0 <= lat <= 57.5 and 11.0 <= lon <= 12.2 ]
+        self.assertEqual(sorted(self.index.box(57.0, 11.0, 57.5, 12.2)), expected)
+        self.assertEqual(len(self.index.box(-90, -180, 90, 180)), 2000)
+
+    def testradius(self):
+        expected = [ key for (key, (lat, lon)) in self.positions.iteritems()
+                     if geo.inverse(57.7, 11.9, lat, lon)[0] <= 30 ]
+        self.assertEqual(sorted(self.index.radius(57.7, 11.9, 30)), expected)
+        self.assertEqual(len(self.index.radius(57.7, 11.9, 20000)), 2000)
+
+    def testupdate(self):
+        self.index.update(0, 10.0, 20.0)
+        self.assertEqual(self.index.box(9.9, 19.9, 10.1, 20.1), [0])
+        self.index.remove(0)
+        self.index.remove(0)
+        self.assertEqual(self.index.box(9.9, 19.9, 10.1, 20.1), [])
+        self.assertEqual(len(self.index), 1999)
+        self.assertFalse(0 in self.index)
+
+    def testantimeridian(self):
+        index = GridIndex()
+        index.update('east', 10.0, 179.95)
+        index.update('west', 10.0, -179.95)
+        self.assertEqual(sorted(index.box(9.0, 179.0, 11.0, -179.0)), ['east', 'west'])
+        self.assertEqual(sorted(index.radius(10.0, 179.99, 20)), ['east', 'west'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# tracks.py (part of "AIS Logger")
+# Recent tracks of objects, kept in memory
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import threading
+import collections
+import math
+from array import array
+import unittest
+
+# Bytes used by one track point (five doubles)
+POINTSIZE = 5 * array('d').itemsize
+
+def number(value):
+    # Return the value as a float, NaN if it isn't a number
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def unknown(value):
+    # Return None for NaN, else the value
+    if math.isnan(value):
+        return None
+    return value
+
+
+class Track(object):
+    # The last size positions of an object as a ring buffer of typed
+    # arrays (time, latitude, longitude, speed and course). The arrays
+    # grow until the track is full, then the oldest point is
+    # overwritten.
+    __slots__ = ('times', 'lats', 'lons', 'sogs', 'cogs', 'size', 'next')
+
+    def __init__(self, size):
+        self.times = array('d')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.sogs = array('d')
+        self.cogs = array('d')
+        self.size = size
+        # Where the next point goes when the track is full
+        self.next = 0
+
+    def append(self, time, latitude, longitude, sog, cog):
+        if len(self.times) < self.size:
+            self.times.append(time)
+            self.lats.append(latitude)
+            self.lons.append(longitude)
+            self.sogs.append(sog)
+            self.cogs.append(cog)
+        else:
+            i = self.next
+            self.times[i] = time
+            self.lats[i] = latitude
+            self.lons[i] = longitude
+            self.sogs[i] = sog
+            self.cogs[i] = cog
+            self.next = (i + 1) % self.size
+
+    def points(self):
+        # Return the points, oldest first, as a list of (time, latitude,
+        # longitude, sog, cog). Unknown speed or course is None.
+        i = self.next
+        order = range(i, len(self.times)) + range(i)
+        return [ (self.times[j], self.lats[j], self.lons[j],
+                  unknown(self.sogs[j]), unknown(self.cogs[j])) for j in order ]
+
+    def __len__(self):
+        return len(self.times)
+
+
+class TrackStore(object):
+    # Tracks of many objects, with a limit on the memory they use. When
+    # the limit is reached, the tracks that were updated longest ago
+    # are removed first.
+    #
+    # Tracks are added to by one thread (MainThread) and may be read by
+    # others (the GUI), so all access is done holding a lock.
+
+    def __init__(self, size=100, maxbytes=20*1024*1024):
+        self.size = size
+        self.maxbytes = maxbytes
+        # Key -> Track, least recently updated first
+        self.tracks = collections.OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, key, time, latitude, longitude, sog=None, cog=None):
+        # Add a position to the track of the key
+        self.lock.acquire()
+        try:
+            track = self.tracks.pop(key, None)
+            if track is None:
+                track = Track(self.size)
+            before = len(track)
+            track.append(time, float(latitude), float(longitude), number(sog), number(cog))
+            self.bytes += (len(track) - before) * POINTSIZE
+            self.tracks[key] = track
+            # Remove the least recently updated tracks
+            while self.bytes > self.maxbytes and len(self.tracks) > 1:
+                (oldkey, oldtrack) = self.tracks.popitem(last=False)
+                self.bytes -= len(oldtrack) * POINTSIZE
+        finally:
+            self.lock.release()
+
+    def get(self, key):
+        # Return a copy of the track of the key as a list of points
+        # (see Track.points), empty if there is no track
+        self.lock.acquire()
+        try:
+            track = self.tracks.get(key)
+            if track is None:
+                return []
+            return track.points()
+        finally:
+            self.lock.release()
+
+    def remove(self, key):
+        self.lock.acquire()
+        try:
+            track = self.tracks.pop(key, None)
+            if track is not None:
+                self.bytes -= len(track) * POINTSIZE
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        return key in self.tracks
+
+    def __len__(self):
+        return len(self.tracks)
+
+
+
+class TestTracks(unittest.TestCase):
+    def testtrack(self):
+        track = Track(3)
+        for i in range(5):
+            track.append(i, 57.0 + i, 11.0, 10.0, float('nan'))
+        self.assertEqual(len(track), 3)
+        self.assertEqual(track.points(), [(2.0, 59.0, 11.0, 10.0, None),
+                                          (3.0, 60.0, 11.0, 10.0, None),
+                                          (4.0, 61.0, 11.0, 10.0, None)])
+
+    def teststore(self):
+        store = TrackStore(size=10)
+        store.add(1, 1000.0, 57.5, 11.5, 'N/A', None)
+        store.add(1, 1010.0, 57.6, 11.5, 12.3, 45)
+        self.assertEqual(store.get(1), [(1000.0, 57.5, 11.5, None, None), (1010.0, 57.6, 11.5, 12.3, 45.0)])
+        self.assertEqual(store.get(2), [])
+        # A vessel lying still keeps its zero speed and course
+        store.add(3, 1000.0, 57.5, 11.5, 0.0, 0)
+        self.assertEqual(store.get(3), [(1000.0, 57.5, 11.5, 0.0, 0.0)])
+        store.remove(3)
+        self.assertEqual(store.bytes, 2 * POINTSIZE)
+        store.remove(1)
+        self.assertEqual((len(store), store.bytes), (0, 0))
+
+    def testeviction(self):
+        # Room for 25 points
+        store = TrackStore(size=10, maxbytes=25 * POINTSIZE)
+        for key in (1, 2, 3):
+            for i in range(10):
+                store.add(key, i, 57.0, 11.0)
+        # Track 1 was updated longest ago
+        self.assertFalse(1 in store)
+        store.add(2, 10, 57.0, 11.0)
+        store.add(4, 0, 57.0, 11.0)
+        # A full track doesn't grow, but is moved last
+        self.assertEqual([ k for k in store.tracks ], [3, 2, 4])
+        self.assertTrue(store.bytes <= store.maxbytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# vesselstore.py (part of "AIS Logger")
+# In-memory store for the state of live vessels
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+import operator
+import unittest
+
+# The fields of a vessel record
+FIELDS = ('mmsi', 'mid', 'imo',
+          'name', 'type', 'typename',
+          'callsign', 'latitude', 'longitude',
+          'georef', 'creationtime', 'time',
+          'sog', 'cog', 'heading',
+          'destination', 'eta', 'length',
+          'width', 'draught', 'rot',
+          'navstatus', 'posacc', 'distance',
+          'bearing', 'cpa', 'tcpa',
+          'source', 'transponder_type',
+          'old', 'soundalerted')
+# The fields and the version, as stored in a record
+SLOTS = FIELDS + ('__version__',)
+# Gets all slots of a record as a tuple in one call
+getslots = operator.attrgetter(*SLOTS)
+
+
+class VesselRecord(object):
+    # The state of one vessel. Fields are slots, which takes far less
+    # memory than a dict per vessel. Records can be read and written
+    # like dicts (record['name']) for compatibility with older code.
+    # __version__ is the number of updates since the record was created.
+    __slots__ = SLOTS
+
+    def __init__(self, **fields):
+        for field in FIELDS:
+            setattr(self, field, None)
+        self.__version__ = 0
+        for (field, value) in fields.iteritems():
+            setattr(self, field, value)
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        try:
+            setattr(self, field, value)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __contains__(self, field):
+        return field in SLOTS
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def copy(self):
+        # Return the record as a dict, including the version
+        return dict(zip(SLOTS, getslots(self)))
+
+
+class VesselStore(object):
+    # Stores the live vessels, one record per MMSI number. Lookups,
+    # inserts, updates and deletes are all O(1) dict operations.
+
+    def __init__(self):
+        self.records = {}
+
+    def get(self, mmsi):
+        # Return the record for mmsi, or None if not in the store
+        return self.records.get(mmsi)
+
+    def insert(self, mmsi, **fields):
+        record = VesselRecord(mmsi=mmsi, **fields)
+        self.records[mmsi] = record
+        return record
+
+    def update(self, record, **fields):
+        # Set the fields and increase the version number
+        for (field, value) in fields.iteritems():
+            setattr(record, field, value)
+        record.__version__ += 1
+
+    def delete(self, records):
+        # Delete a list of records
+        for record in records:
+            self.records.pop(record.mmsi, None)
+
+    def __contains__(self, mmsi):
+        return mmsi in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return self.records.itervalues()
+
+
+
+class TestVesselStore(unittest.TestCase):
+    def setUp(self):
+        self.store = VesselStore()
+        self.now = datetime.datetime.now()
+
+    def testinsertupdate(self):
+        record = self.store.insert(265547250, creationtime=self.now, time=self.now)
+        self.assertTrue(self.store.get(265547250) is record)
+        self.assertEqual(record['__version__'], 0)
+        self.assertEqual(record['name'], None)
+        self.store.update(record, name='TEST', sog=12, old=False)
+        self.assertEqual(record.name, 'TEST')
+        self.assertEqual(record['sog'], 12)
+        self.assertEqual(record['__version__'], 1)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.get(1), None)
+
+    def testcopy(self):
+        record = self.store.insert(265547250, name='TEST')
+        copy = record.copy()
+        self.assertEqual(len(copy), len(FIELDS) + 1)
+        self.assertEqual(copy['name'], 'TEST')
+        self.assertEqual(copy['__version__'], 0)
+        copy['name'] = 'CHANGED'
+        self.assertEqual(record.name, 'TEST')
+
+    def testdictaccess(self):
+        record = self.store.insert(265547250)
+        self.assertRaises(KeyError, record.__getitem__, 'remark')
+        self.assertRaises(KeyError, record.__setitem__, 'remark', 'x')
+        self.assertTrue('name' in record)
+        self.assertFalse('remark' in record)
+        self.assertEqual(record.get('remark', 'N/A'), 'N/A')
+
+    def testdelete(self):
+        for mmsi in range(10):
+            self.store.insert(mmsi)
+        self.store.delete([r for r in self.store if r.mmsi < 5])
+        self.assertEqual(sorted(r.mmsi for r in self.store), range(5, 10))
+        self.assertFalse(3 in self.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# zones.py (part of "AIS Logger")
+# Polygon zones that alert when objects enter them
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import csv
+import math
+import unittest
+import StringIO
+
+
+def pointinpolygon(latitude, longitude, polygon):
+    # Return True if the point is inside the polygon, a list of
+    # (latitude, longitude) corners (crossing number test)
+    inside = False
+    (lat1, lon1) = polygon[-1]
+    for (lat2, lon2) in polygon:
+        if (lat1 > latitude) != (lat2 > latitude):
+            # Longitude where the edge crosses the point's latitude
+            crossing = lon1 + (latitude - lat1) * (lon2 - lon1) / (lat2 - lat1)
+            if longitude < crossing:
+                inside = not inside
+        (lat1, lon1) = (lat2, lon2)
+    return inside
+
+
+class Zone(object):
+    # A named polygon zone. The alert is 'A' for a silent alert or
+    # 'AS' for a sound alert when an object enters the zone.
+
+    def __init__(self, name, alert, polygon):
+        if alert not in ('A', 'AS'):
+            raise ValueError("Invalid alert for zone %s: %s" %(name, alert))
+        if len(polygon) < 3:
+            raise ValueError("A zone needs at least three corners: %s" %name)
+        self.name = name
+        self.alert = alert
+        self.polygon = [ (float(lat), float(lon)) for (lat, lon) in polygon ]
+        lats = [ lat for (lat, lon) in self.polygon ]
+        lons = [ lon for (lat, lon) in self.polygon ]
+        # South, west, north and east
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+
+    def contains(self, latitude, longitude):
+        south, west, north, east = self.bbox
+        if not (south <= latitude <= north and west <= longitude <= east):
+            return False
+        return pointinpolygon(latitude, longitude, self.polygon)
+
+
+def readzones(file):
+    # Read zones from a CSV file with one zone on each line:
+    #
+    #   name,alert,lat1,lon1,lat2,lon2,lat3,lon3,...
+    #
+    # where alert is A (silent) or AS (sound) like in the remark file
+    zones = []
+    for row in csv.reader(file):
+        if not row or row[0].startswith('#'):
+            continue
+        values = [ float(v) for v in row[2:] ]
+        if len(values) % 2:
+            raise ValueError("Odd number of coordinates for zone %s" %row[0])
+        try:
+            name = unicode(row[0], 'utf-8')
+        except UnicodeDecodeError:
+            name = unicode(row[0], 'cp1252')
+        zones.append(Zone(name, row[1].strip().upper(), zip(values[0::2], values[1::2])))
+    return zones
+
+
+class ZoneIndex(object):
+    # Keeps track of which zones each object is in, and tells when
+    # objects enter or leave zones.
+    #
+    # Zones are indexed in a grid of cellsize degrees by their
+    # bounding box, so a position is only tested against the zones
+    # whose box overlaps its cell, then against the box and only then
+    # against the polygon. The cost of a check follows the number of
+    # zones near the position, not the number of zones.
+
+    def __init__(self, zones=(), cellsize=1.0):
+        self.cellsize = float(cellsize)
+        self.zones = list(zones)
+        # Cell -> list of zones
+        self.cells = {}
+        for zone in self.zones:
+            (bottom, left) = self.cell(zone.bbox[0], zone.bbox[1])
+            (top, right) = self.cell(zone.bbox[2], zone.bbox[3])
+            for row in xrange(bottom, top + 1):
+                for column in xrange(left, right + 1):
+                    self.cells.setdefault((row, column), []).append(zone)
+        # Key -> tuple of zones the key is inside
+        self.inside = {}
+
+    def cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cellsize)), int(math.floor(longitude / self.cellsize)))
+
+    def zonesat(self, latitude, longitude):
+        # Return the zones containing the point
+        latitude, longitude = float(latitude), float(longitude)
+        return tuple(zone for zone in self.cells.get(self.cell(latitude, longitude), ())
+                     if zone.contains(latitude, longitude))
+
+    def check(self, key, latitude, longitude):
+        # Set the position of the key and return the zones it has
+        # entered and left since the last position
+        now = self.zonesat(latitude, longitude)
+        before = self.inside.get(key, ())
+        if now == before:
+            return (), ()
+        if now:
+            self.inside[key] = now
+        else:
+            del self.inside[key]
+        entered = tuple(zone for zone in now if zone not in before)
+        left = tuple(zone for zone in before if zone not in now)
+        return entered, left
+
+    def zonesof(self, key):
+        # Return the zones the key was inside at its last position
+        return self.inside.get(key, ())
+
+    def remove(self, key):
+        self.inside.pop(key, None)
+
+    def __len__(self):
+        return len(self.zones)
+
+
+
+class TestZones(unittest.TestCase):
+    zonefile = ('# Test zones\n'
+                'Harbour,AS,57.68,11.80,57.72,11.80,57.72,11.90,57.68,11.90\n'
+                'Fairway,A,57.60,11.60,57.70,11.85,57.60,11.85\n')
+
+    def testpointinpolygon(self):
+        triangle = [(0.0, 0.0), (10.0, 5.0), (0.0, 10.0)]
+        self.assertTrue(pointinpolygon(2.0, 5.0, triangle))
+        self.assertFalse(pointinpolygon(8.0, 1.0, triangle))
+        self.assertFalse(pointinpolygon(-1.0, 5.0, triangle))
+
+    def testreadzones(self):
+        zones = readzones(StringIO.StringIO(self.zonefile))
+        self.assertEqual([ z.name for z in zones ], [u'Harbour', u'Fairway'])
+        self.assertEqual(zones[0].alert, 'AS')
+        self.assertEqual(zones[1].bbox, (57.60, 11.60, 57.70, 11.85))
+        self.assertRaises(ValueError, readzones, StringIO.StringIO('Bad,A,57.0,11.0,58.0\n'))
+        self.assertRaises(ValueError, readzones, StringIO.StringIO('Line,A,57.0,11.0,58.0,12.0\n'))
+        self.assertRaises(ValueError, readzones, StringIO.StringIO('Bad,X,57.0,11.0,58.0,12.0,57.0,12.0\n'))
+
+    def testcheck(self):
+        (harbour, fairway) = readzones(StringIO.StringIO(self.zonefile))
+        index = ZoneIndex([harbour, fairway], cellsize=0.1)
+        self.assertEqual(index.check(1, 57.5, 11.5), ((), ()))
+        self.assertEqual(index.check(1, 57.69, 11.84), ((harbour, fairway), ()))
+        self.assertEqual(index.zonesof(1), (harbour, fairway))
+        self.assertEqual(index.check(1, 57.69, 11.845), ((), ()))
+        self.assertEqual(index.check(1, 57.71, 11.84), ((), (fairway,)))
+        self.assertEqual(index.check(1, 57.8, 11.82), ((), (harbour,)))
+        self.assertEqual(index.zonesof(1), ())
+        index.check(2, 57.71, 11.82)
+        index.remove(2)
+        self.assertEqual(index.zonesof(2), ())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# distance_benchmark.py (part of "AIS Logger")
+# Compares the approximate, exact and two-tier distance checks
+#
+# Usage: python benchmarks/distance_benchmark.py [number of calls]
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os
+import time
+import random
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'aislogger'))
+import geo
+
+def main():
+    calls = 100000
+    if len(sys.argv) > 1:
+        calls = int(sys.argv[1])
+    # Targets within about 200 km of a point, checked against a 25 km
+    # limit like an alert or filter radius
+    center = (57.7, 11.9)
+    limit = 25
+    targets = [(center[0] + random.uniform(-2, 2), center[1] + random.uniform(-3, 3)) for i in xrange(calls)]
+    print "%d calls, %d km limit" %(calls, limit)
+    print "%-18s %12s %10s" %('method', 'us/call', 'inside')
+    for (name, function) in (('approximate', lambda lat, lon: geo.approximate(center[0], center[1], lat, lon) <= limit),
+                             ('exact', lambda lat, lon: geo.inverse(center[0], center[1], lat, lon)[0] <= limit),
+                             ('within_distance', lambda lat, lon: geo.within_distance(center[0], center[1], lat, lon, limit))):
+        start = time.time()
+        inside = 0
+        for (lat, lon) in targets:
+            if function(lat, lon):
+                inside += 1
+        elapsed = time.time() - start
+        print "%-18s %12.2f %10d" %(name, elapsed * 1e6 / calls, inside)
+    # How often the exact formula is needed
+    near = len([t for t in targets
+                if abs(geo.approximate(center[0], center[1], t[0], t[1]) - limit) <= limit * geo.APPROXIMATION_ERROR])
+    print "exact formula needed for %.2f%% of the calls" %(near * 100.0 / calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# expiry_benchmark.py (part of "AIS Logger")
+# Compares finding expired objects with a full scan and with a time wheel
+#
+# Usage: python benchmarks/expiry_benchmark.py [number of vessels]
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os
+import time
+import random
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'aislogger'))
+import vesselstore
+import expiry
+
+def main():
+    vessels = 50000
+    if len(sys.argv) > 1:
+        vessels = int(sys.argv[1])
+    # Vessels last updated during the last hour, checked every 10 s
+    # against a one hour removal limit like CheckDBForOld
+    now = time.time()
+    store = vesselstore.VesselStore()
+    wheel = expiry.TimeWheel()
+    for mmsi in xrange(vessels):
+        updated = now - random.uniform(0, 3600)
+        store.insert(mmsi, time=updated)
+        wheel.touch(mmsi, updated)
+    ticks = 100
+    print "%d vessels, %d checks 10 s apart" %(vessels, ticks)
+    start = time.time()
+    scanned = 0
+    for tick in xrange(ticks):
+        limit = now + tick * 10 - 3600
+        remove = [r for r in store if r.time < limit]
+        store.delete(remove)
+        scanned += len(remove)
+    scan_time = (time.time() - start) / ticks
+    start = time.time()
+    expired = 0
+    for tick in xrange(ticks):
+        expired += len(wheel.expire(now + tick * 10 - 3600))
+    wheel_time = (time.time() - start) / ticks
+    print "%-12s %12s %14s" %('method', 'ms/check', 'expired/check')
+    print "%-12s %12.3f %14.1f" %('full scan', scan_time * 1000, scanned / float(ticks))
+    print "%-12s %12.3f %14.1f" %('time wheel', wheel_time * 1000, expired / float(ticks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# geo_benchmark.py (part of "AIS Logger")
+# Compares calculating distances one at a time and for all vessels at once
+#
+# Usage: python benchmarks/geo_benchmark.py [number of vessels]
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os
+import time
+import random
+import decimal
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'aislogger'))
+import geo
+
+def main():
+    vessels = 50000
+    if len(sys.argv) > 1:
+        vessels = int(sys.argv[1])
+    # Vessels within about 100 km of own position, with positions as
+    # Decimal like the decoder gives them
+    own = (57.7, 11.9)
+    lats = [decimal.Decimal('%.5f' %(own[0] + random.uniform(-1, 1))) for i in xrange(vessels)]
+    lons = [decimal.Decimal('%.5f' %(own[1] + random.uniform(-1.5, 1.5))) for i in xrange(vessels)]
+    print "%d vessels" %vessels
+    print "%-22s %10s %12s" %('method', 'ms', 'us/vessel')
+    tenth = decimal.Decimal('0.1')
+    start = time.time()
+    for (lat, lon) in zip(lats, lons):
+        distance, bearing = geo.inverse(own[0], own[1], lat, lon)
+        decimal.Decimal(str(distance)).quantize(tenth)
+        decimal.Decimal(str(bearing)).quantize(tenth)
+    report('scalar, Decimal result', time.time() - start, vessels)
+    start = time.time()
+    for (lat, lon) in zip(lats, lons):
+        distance, bearing = geo.inverse(own[0], own[1], lat, lon)
+        round(distance, 1)
+        round(bearing, 1)
+    report('scalar, float result', time.time() - start, vessels)
+    start = time.time()
+    geo.inverse_array(own[0], own[1], lats, lons)
+    report('array', time.time() - start, vessels)
+
+def report(method, elapsed, vessels):
+    print "%-22s %10.1f %12.2f" %(method, elapsed * 1000, elapsed * 1e6 / vessels)
+
+
+if __name__ == '__main__':
+    main()
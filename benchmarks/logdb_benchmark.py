@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# logdb_benchmark.py (part of "AIS Logger")
+# Measures sustained writes of position reports to the log file
+#
+# Usage: python benchmarks/logdb_benchmark.py
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os
+import time
+import random
+import decimal
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'aislogger'))
+import logdb
+
+# A saturated receiver gets about 2 x 2250 slots per minute
+RECEIVER_RATE = 75.0
+
+def reports(count):
+    # Position reports as decoded, for 2000 vessels
+    vessels = [ (random.randint(200000000, 799999999), random.uniform(50, 66), random.uniform(-4, 30)) for i in xrange(2000) ]
+    for i in xrange(count):
+        (mmsi, lat, lon) = vessels[i % len(vessels)]
+        yield (1241544035 + i / 100.0, mmsi, decimal.Decimal('%.4f' %lat), decimal.Decimal('%.4f' %lon),
+               decimal.Decimal('12.3'), decimal.Decimal('181.5'))
+
+def reconnecting(filename, rows, batch):
+    # Open the file, insert and close for each batch. Returns the
+    # longest time (s) the caller was held up by one batch.
+    longest = 0
+    for i in xrange(0, len(rows), batch):
+        start = time.time()
+        connection = logdb.sqlite.connect(filename)
+        logdb.createtable(connection, 'track')
+        connection.executemany(logdb.TABLES['track'][1], rows[i:i+batch])
+        connection.commit()
+        connection.close()
+        longest = max(longest, time.time() - start)
+    return longest
+
+def writer(filename, rows, batch):
+    # Queue the batches to the log writer thread
+    writer = logdb.LogWriter(filename, maxqueue=len(rows) / batch + 1)
+    writer.start()
+    longest = 0
+    for i in xrange(0, len(rows), batch):
+        start = time.time()
+        writer.put({'track': rows[i:i+batch]})
+        longest = max(longest, time.time() - start)
+    writer.stop()
+    writer.thread.join()
+    if writer.ReturnStats()['dropped']:
+        print "  %d rows dropped" %writer.ReturnStats()['dropped']
+    return longest
+
+def main():
+    count = 200000
+    rows = [ logdb.trackrow(*report) for report in reports(count) ]
+    # Rows per second until everything is written, and the longest
+    # time the main loop would be held up by one write
+    print "%-22s %8s %12s %12s %12s" %('method', 'batch', 'rows/s', 'receivers', 'stall ms')
+    for (name, function, batch) in (('reconnect per batch', reconnecting, 100),
+                                    ('reconnect per batch', reconnecting, 1000),
+                                    ('reconnect per batch', reconnecting, logdb.TRACKBATCH),
+                                    ('log writer', writer, 100),
+                                    ('log writer', writer, 1000),
+                                    ('log writer', writer, logdb.TRACKBATCH)):
+        (fd, filename) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            start = time.time()
+            longest = function(filename, rows, batch)
+            rate = count / (time.time() - start)
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(filename + suffix):
+                    os.remove(filename + suffix)
+        print "%-22s %8d %12.0f %12.0f %12.2f" %(name, batch, rate, rate / RECEIVER_RATE, longest * 1000)
+
+
+if __name__ == '__main__':
+    main()
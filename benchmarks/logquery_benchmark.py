@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# logquery_benchmark.py (part of "AIS Logger")
+# Compares queries on log files in the old and in the current format
+#
+# Usage: python benchmarks/logquery_benchmark.py [positions]
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os
+import time, datetime
+import random
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'aislogger'))
+import logdb
+
+def writev1(filename, positions, vessels=2000):
+    # Write a log file in the old format, one position per vessel and
+    # log interval (60 s)
+    connection = logdb.sqlite.connect(filename)
+    connection.execute("CREATE TABLE position (time, mmsi, latitude, longitude, georef, sog, cog);")
+    start = datetime.datetime(2009, 5, 5)
+    fleet = [ (200000000 + i, random.uniform(50, 66), random.uniform(-4, 30)) for i in xrange(vessels) ]
+    rows = []
+    for i in xrange(positions):
+        (mmsi, lat, lon) = fleet[i % vessels]
+        timestamp = start + datetime.timedelta(seconds=60 * (i / vessels))
+        rows.append((timestamp.isoformat(), mmsi, lat, lon, 'PKGH1642', 12.3, 181.5))
+        if len(rows) == 100000:
+            connection.executemany("INSERT INTO position VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            rows = []
+    connection.executemany("INSERT INTO position VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+    return start, start + datetime.timedelta(seconds=60 * (positions / vessels))
+
+def timequery(connection, query, parameters, repeat=20):
+    # Return the time in ms for a query and the number of rows
+    start = time.time()
+    for i in xrange(repeat):
+        rows = len(connection.execute(query, parameters).fetchall())
+    return (time.time() - start) / repeat * 1000, rows
+
+def main():
+    if len(sys.argv) > 1:
+        positions = int(sys.argv[1])
+    else:
+        positions = 1000000
+    (fd, oldfile) = tempfile.mkstemp()
+    os.close(fd)
+    newfile = oldfile + '.new'
+    try:
+        (first, last) = writev1(oldfile, positions)
+        start = time.time()
+        logdb.migrate(oldfile, newfile)
+        print "%d positions migrated in %.1f s" %(positions, time.time() - start)
+        print "%-8s %10s %16s %16s" %('format', 'size MB', 'mmsi+time ms', 'time range ms')
+        # One vessel over a day, and all vessels during ten minutes
+        middle = first + (last - first) / 2
+        for (name, filename, convert) in (('old', oldfile, lambda t: t.isoformat()),
+                                          ('current', newfile, logdb.epoch)):
+            connection = logdb.sqlite.connect(filename)
+            vessel = timequery(connection, "SELECT * FROM position WHERE mmsi = ? AND time BETWEEN ? AND ?;",
+                               (200000042, convert(first), convert(first + datetime.timedelta(days=1))))
+            area = timequery(connection, "SELECT * FROM position WHERE time BETWEEN ? AND ?;",
+                             (convert(middle), convert(middle + datetime.timedelta(minutes=10))))
+            connection.close()
+            print "%-8s %10.1f %16.2f %16.2f" %(name, os.path.getsize(filename) / 1048576.0, vessel[0], area[0])
+    finally:
+        for filename in (oldfile, newfile):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# spatial_benchmark.py (part of "AIS Logger")
+# Compares area queries with a full scan and with the grid index
+#
+# Usage: python benchmarks/spatial_benchmark.py
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os
+import time
+import random
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'aislogger'))
+import geo
+import spatial
+
+def main():
+    # Vessels spread over the North Sea and the Baltic, queried with a
+    # map viewport of about 60 x 60 km and a 25 km radius
+    box = (57.5, 11.5, 58.0, 12.5)
+    center = (57.7, 11.9, 25)
+    queries = 100
+    print "%8s %-12s %12s %12s %12s" %('vessels', 'method', 'update us', 'box ms', 'radius ms')
+    for vessels in (10000, 50000, 100000):
+        positions = [(random.uniform(50, 66), random.uniform(-4, 30)) for i in xrange(vessels)]
+        # Full scan of all positions
+        start = time.time()
+        for i in xrange(queries):
+            [ mmsi for (mmsi, (lat, lon)) in enumerate(positions)
+              if box[0] <= lat <= box[2] and box[1] <= lon <= box[3] ]
+        scan_box = (time.time() - start) / queries
+        start = time.time()
+        for i in xrange(queries / 10):
+            [ mmsi for (mmsi, (lat, lon)) in enumerate(positions)
+              if geo.within_distance(center[0], center[1], lat, lon, center[2]) ]
+        scan_radius = (time.time() - start) / (queries / 10)
+        print "%8d %-12s %12s %12.3f %12.3f" %(vessels, 'full scan', '-', scan_box * 1000, scan_radius * 1000)
+        # Grid index, including the cost of keeping it updated
+        index = spatial.GridIndex()
+        start = time.time()
+        for (mmsi, (lat, lon)) in enumerate(positions):
+            index.update(mmsi, lat, lon)
+        update = (time.time() - start) / vessels
+        start = time.time()
+        for i in xrange(queries):
+            index.box(*box)
+        grid_box = (time.time() - start) / queries
+        start = time.time()
+        for i in xrange(queries):
+            index.radius(*center)
+        grid_radius = (time.time() - start) / queries
+        print "%8d %-12s %12.2f %12.3f %12.3f" %(vessels, 'grid index', update * 1e6, grid_box * 1000, grid_radius * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# vesselstore_benchmark.py (part of "AIS Logger")
+# Compares the live vessel store with the PyDbLite setup it replaced
+#
+# Usage: python benchmarks/vesselstore_benchmark.py [number of vessels]
+#
+# Copyright (c) 2006-2009 Erik I.J. Olsson <olcai@users.sourceforge.net>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, os
+import time, datetime
+import random
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'aislogger'))
+import external.pydblite as pydblite
+import vesselstore
+
+def positions(mmsis, count):
+    # Generate position updates like the ones DbUpdate makes
+    now = datetime.datetime.now()
+    updates = []
+    for i in xrange(count):
+        updates.append((random.choice(mmsis),
+                        {'latitude': random.uniform(55, 60), 'longitude': random.uniform(10, 20),
+                         'sog': random.uniform(0, 20), 'cog': random.uniform(0, 360),
+                         'time': now, 'old': False}))
+    return updates
+
+def pydblite_size(db):
+    # Container overhead: record dicts and the mmsi index
+    size = sys.getsizeof(db.records)
+    for record in db.records.itervalues():
+        size += sys.getsizeof(record)
+    for index in db.indices.itervalues():
+        size += sys.getsizeof(index)
+        for ids in index.itervalues():
+            size += sys.getsizeof(ids)
+    return size
+
+def vesselstore_size(store):
+    # Container overhead: record objects and the mmsi dict
+    size = sys.getsizeof(store.records)
+    for record in store.records.itervalues():
+        size += sys.getsizeof(record)
+    return size
+
+def run_pydblite(mmsis, updates):
+    db = pydblite.Base('dummy')
+    db.create(*vesselstore.FIELDS, mode="override")
+    db.create_index('mmsi')
+    start = time.time()
+    for mmsi in mmsis:
+        db.insert(mmsi=mmsi)
+    insert_time = time.time() - start
+    start = time.time()
+    for (mmsi, fields) in updates:
+        record = db._mmsi[mmsi][0]
+        db.update(record, **fields)
+    update_time = time.time() - start
+    start = time.time()
+    for (mmsi, fields) in updates:
+        db._mmsi[mmsi][0].copy()
+    copy_time = time.time() - start
+    return insert_time, update_time, copy_time, pydblite_size(db)
+
+def run_vesselstore(mmsis, updates):
+    store = vesselstore.VesselStore()
+    start = time.time()
+    for mmsi in mmsis:
+        store.insert(mmsi)
+    insert_time = time.time() - start
+    start = time.time()
+    for (mmsi, fields) in updates:
+        record = store.get(mmsi)
+        store.update(record, **fields)
+    update_time = time.time() - start
+    start = time.time()
+    for (mmsi, fields) in updates:
+        store.get(mmsi).copy()
+    copy_time = time.time() - start
+    return insert_time, update_time, copy_time, vesselstore_size(store)
+
+def main():
+    vessels = 50000
+    if len(sys.argv) > 1:
+        vessels = int(sys.argv[1])
+    mmsis = random.sample(xrange(200000000, 800000000), vessels)
+    updates = positions(mmsis, 200000)
+    print "%d vessels, %d position updates" %(vessels, len(updates))
+    print "%-12s %12s %12s %12s %12s" %('store', 'inserts/s', 'updates/s', 'copies/s', 'memory (MB)')
+    for (name, run) in (('pydblite', run_pydblite), ('vesselstore', run_vesselstore)):
+        insert_time, update_time, copy_time, size = run(mmsis, updates)
+        print "%-12s %12.0f %12.0f %12.0f %12.1f" %(name, vessels / insert_time, len(updates) / update_time,
+                                                   len(updates) / copy_time, size / 1048576.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,7 @@ setup (name='aislogger',
        author_email='olcai@users.sourceforge.net',
        url='http://sourceforge.net/projects/aislogger/',
        license='MIT',
-       scripts=['bin/aislogger'],
+       scripts=['bin/aislogger', 'bin/aislogger-migratelog'],
        packages=['aislogger', 'aislogger.external'],
        package_dir={'aislogger.external': 'external'},
        package_data={'aislogger': ['data/*', 'doc/manual.html']},